@@ -25,6 +25,7 @@
 import argparse
 import config
 import logging
+import math
 import pymongo
 import serial
 import sys
@@ -38,13 +39,67 @@ def insert_into_collection(collection, doc):
         result = collection.insert_one(doc)
     return result is not None and result.inserted_id is not None 
 
+# Rollup resolutions, and their bucket sizes in seconds. Must match the web app's rollups module.
+ROLLUP_RESOLUTIONS = [ ("minute", 60), ("hour", 3600), ("day", 86400) ]
+ROLLUP_EXCLUDED_KEYS = [ "_id", "ts" ]
+
+g_mongo_client = None
+
+def get_mongo_client(url):
+    """Returns the (shared) mongo client, creating it the first time it's needed."""
+    global g_mongo_client
+    if g_mongo_client is None:
+        g_mongo_client = pymongo.MongoClient(url)
+    return g_mongo_client
+
+def rollup_numeric_fields(values):
+    """Returns the fields of a reading that can be summarized. A copy of numeric_fields in the web app's rollups
+    module, since this client runs on its own; keep the two identical."""
+    fields = {}
+    for key, value in values.items():
+        if key in ROLLUP_EXCLUDED_KEYS or '.' in key or key.startswith('$'):
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        if isinstance(value, float) and not math.isfinite(value):
+            continue
+        fields[key] = value
+    return fields
+
+def update_rollups(db, collection_name, values):
+    """Merges a reading into the minute, hour, and day rollups for the collection. Builds the same update as
+    mongo_rollup_update in the web app's database module; keep the two identical."""
+    ts = values['ts']
+    increments = { "count": 1 }
+    minimums = {}
+    maximums = {}
+    for key, value in rollup_numeric_fields(values).items():
+        prefix = "fields." + key + "."
+        increments[prefix + "sum"] = value
+        increments[prefix + "count"] = 1
+        minimums[prefix + "min"] = value
+        maximums[prefix + "max"] = value
+        maximums[prefix + "last"] = { "ts": ts, "value": value }
+    update = { "$inc": increments }
+    if len(minimums) > 0:
+        update["$min"] = minimums
+        update["$max"] = maximums
+    for resolution, bucket_secs in ROLLUP_RESOLUTIONS:
+        bucket = math.floor(ts / bucket_secs) * bucket_secs
+        db[collection_name + "_" + resolution].update_one({ "ts": bucket }, update, upsert=True)
+
 def post_to_mongo(url, values):
     try:
-        conn = pymongo.MongoClient(url)
+        conn = get_mongo_client(url)
         db = conn['statusdb']
         collection = db['indoor_air_quality']
-        return insert_into_collection(collection, values)
-    except pymongo.errors.ConnectionFailure as e:
+        if not insert_into_collection(collection, values):
+            return False
+        update_rollups(db, 'indoor_air_quality', values)
+        return True
+    except pymongo.errors.PyMongoError as e:
+        logger = logging.getLogger()
+        logger.error(e)
         return False
 
 def parse_air_quality_output(line):
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Evaluates the sensor limits against readings as they are received, so alerts don't depend on a browser tab being open."""
+
+import collections
+import threading
+import time
+
+DEFAULT_HYSTERESIS_FRACTION = 0.02 # Fraction of the limit range a value must come back by before an alert clears
+DEFAULT_MAX_ALERTS = 500 # Alerts kept for the alerts request
+DEVICE_KEY = "device"
+TS_KEY = "ts"
+
+STATE_OK = "ok"
+STATE_HIGH = "high"
+STATE_LOW = "low"
+
+def to_number(value):
+    """Limits have been stored as strings as well as numbers. Returns None for anything that isn't a number."""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+class Rule(object):
+    """One sensor key's limits, with the thresholds an out of range value has to come back past to clear."""
+
+    def __init__(self, key, lower_limit, upper_limit, hysteresis_fraction):
+        self.key = key
+        self.lower_limit = lower_limit
+        self.upper_limit = upper_limit
+        if lower_limit is not None and upper_limit is not None:
+            band = hysteresis_fraction * abs(upper_limit - lower_limit)
+        else:
+            band = hysteresis_fraction * abs(lower_limit if upper_limit is None else upper_limit)
+        self.upper_clear = None if upper_limit is None else upper_limit - band
+        self.lower_clear = None if lower_limit is None else lower_limit + band
+        super(Rule, self).__init__()
+
+    def next_state(self, state, value):
+        """Returns the state a value puts the sensor in, given the state it was in."""
+        if self.upper_limit is not None and value > self.upper_limit:
+            return STATE_HIGH
+        if self.lower_limit is not None and value < self.lower_limit:
+            return STATE_LOW
+        if state == STATE_HIGH and self.upper_clear is not None and value > self.upper_clear:
+            return STATE_HIGH
+        if state == STATE_LOW and self.lower_clear is not None and value < self.lower_clear:
+            return STATE_LOW
+        return STATE_OK
+
+    def limit_for(self, state):
+        return self.upper_limit if state == STATE_HIGH else self.lower_limit
+
+def compile_rules(limits, hysteresis_fraction):
+    """Builds the rule table from the stored limits, a dictionary of key -> (lower limit, upper limit). Keys without a usable limit are left out."""
+    rules = {}
+    for key, (lower_limit, upper_limit) in limits.items():
+        lower_limit = to_number(lower_limit)
+        upper_limit = to_number(upper_limit)
+        if lower_limit is None and upper_limit is None:
+            continue
+        rules[key] = Rule(key, lower_limit, upper_limit, hysteresis_fraction)
+    return rules
+
+class AlertEngine(object):
+    """Tracks, per (collection, device, key), whether readings are inside the limits. An alert is raised when a sensor
+    goes out of range and cleared when it comes back past the hysteresis threshold. While it stays out of range the
+    alert is updated rather than raised again, so a sensor sitting over its limit produces one alert, not one per reading."""
+
+    def __init__(self, get_limits_func, hysteresis_fraction=DEFAULT_HYSTERESIS_FRACTION, max_alerts=DEFAULT_MAX_ALERTS):
+        self.get_limits_func = get_limits_func
+        self.hysteresis_fraction = max(0.0, hysteresis_fraction)
+        self.lock = threading.Lock()
+        self.rules = {}
+        self.rules_source = None # The limits the rules were compiled from
+        self.states = {} # (collection, device, key) -> the active alert, if the sensor is out of range
+        self.alerts = collections.OrderedDict() # Alert ID -> alert, oldest first
+        self.max_alerts = max(1, max_alerts)
+        self.next_id = 1
+        self.version = 0 # Incremented whenever an alert is raised, updated, or cleared
+        super(AlertEngine, self).__init__()
+
+    def current_rules(self):
+        """Returns the rule table, recompiling it if the limits have been reloaded since it was built. Alerts for
+        keys that no longer have limits are cleared, since nothing would ever clear them otherwise."""
+        limits = self.get_limits_func()
+        with self.lock:
+            if limits is self.rules_source:
+                return self.rules
+        rules = compile_rules(limits, self.hysteresis_fraction)
+        with self.lock:
+            self.rules = rules
+            self.rules_source = limits
+            for state_key in [ state_key for state_key in self.states if state_key[2] not in rules ]:
+                self.clear_alert(state_key, time.time())
+        return rules
+
+    def has_rules(self):
+        """Returns True if any limits are set, i.e. if there's any point evaluating readings."""
+        return len(self.current_rules()) > 0
+
+    def evaluate(self, collection_name, values_list):
+        """Checks readings against the limits. Called for every reading that is received, so it only looks at the keys that have limits."""
+        rules = self.current_rules()
+        if len(rules) == 0:
+            return
+        for values in values_list:
+            matched = [ rule for key, rule in rules.items() if key in values ]
+            if len(matched) == 0:
+                continue
+            ts = values.get(TS_KEY, time.time())
+            device = values.get(DEVICE_KEY)
+            with self.lock:
+                for rule in matched:
+                    value = to_number(values[rule.key])
+                    if value is not None:
+                        self.update_state((collection_name, device, rule.key), rule, value, ts)
+
+    def touch(self, alert):
+        """Records that an alert changed. The lock must be held."""
+        self.version = self.version + 1
+        alert["version"] = self.version
+
+    def clear_alert(self, state_key, ts):
+        """Marks a sensor's active alert as cleared. The lock must be held."""
+        alert = self.states.pop(state_key)
+        alert["active"] = False
+        alert["cleared_ts"] = ts
+        self.touch(alert)
+
+    def update_state(self, state_key, rule, value, ts):
+        """Applies one value to a sensor's state, raising, updating, or clearing its alert. The lock must be held."""
+        alert = self.states.get(state_key)
+        state = STATE_OK if alert is None else alert["state"]
+        new_state = rule.next_state(state, value)
+        if new_state == state:
+            if alert is not None:
+                alert["last_value"] = value
+                alert["last_ts"] = ts
+                alert["count"] = alert["count"] + 1
+                self.touch(alert)
+            return
+
+        # The old alert is finished, either because the sensor is back in range or because it went straight from high to low.
+        if alert is not None:
+            self.clear_alert(state_key, ts)
+        if new_state != STATE_OK:
+            collection_name, device, key = state_key
+            alert = {
+                "id": self.next_id,
+                "collection": collection_name,
+                "device": device,
+                "key": key,
+                "state": new_state,
+                "limit": rule.limit_for(new_state),
+                "value": value,
+                "ts": ts,
+                "last_value": value,
+                "last_ts": ts,
+                "count": 1,
+                "active": True,
+                "cleared_ts": None,
+                "version": 0
+            }
+            self.next_id = self.next_id + 1
+            self.states[state_key] = alert
+            self.alerts[alert["id"]] = alert
+            self.touch(alert)
+
+            # Forget the oldest alerts that are no longer active.
+            while len(self.alerts) > self.max_alerts:
+                oldest_id, oldest = next(iter(self.alerts.items()))
+                if oldest["active"]:
+                    break
+                del self.alerts[oldest_id]
+
+    def list_alerts(self, since_version=0, active_only=False):
+        """Returns copies of the alerts that changed after the given version, and the current version, which the
+        caller passes next time to get only what changed since."""
+        with self.lock:
+            alerts = [ dict(alert) for alert in self.alerts.values() if alert["version"] > since_version and (alert["active"] or not active_only) ]
+            return alerts, self.version
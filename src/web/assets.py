@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Content-hashed ("fingerprinted") static asset names, so browsers can cache the files forever and still pick up changes."""
+
+import hashlib
+import json
+import os
+
+MANIFEST_FILE = "static_manifest.json"
+HASH_LENGTH = 12 # Hex digits of the content hash put in the file name
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def content_hash(path):
+    """Returns the hash that goes in the fingerprinted name of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as asset_file:
+        for block in iter(lambda: asset_file.read(65536), b""):
+            digest.update(block)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+def fingerprinted_name(file_name, hash_str):
+    """Puts the hash before the extension, e.g. site.css becomes site.0123456789ab.css."""
+    base, ext = os.path.splitext(file_name)
+    return base + "." + hash_str + ext
+
+def is_fingerprinted_name(file_name):
+    """Returns True if the file name looks like one made by fingerprinted_name."""
+    base, _ = os.path.splitext(file_name)
+    _, _, hash_str = base.rpartition(".")
+    return len(hash_str) == HASH_LENGTH and all(c in "0123456789abcdef" for c in hash_str)
+
+class AssetManifest(object):
+    """Maps static file paths, such as css/site.css, to their fingerprinted copies. Without a manifest (e.g. the
+    build step wasn't run, or in development mode) the original paths are used and cached the normal way."""
+
+    def __init__(self, root_url="", assets=None):
+        self.root_url = root_url
+        self.assets = assets or {}
+        self.fingerprinted = set(self.assets.values())
+        super(AssetManifest, self).__init__()
+
+    @staticmethod
+    def load(root_dir, root_url=""):
+        """Reads the manifest written by the build step. Returns an empty manifest if there isn't one."""
+        path = os.path.join(root_dir, MANIFEST_FILE)
+        if not os.path.isfile(path):
+            return AssetManifest(root_url)
+        with open(path, "r") as manifest_file:
+            return AssetManifest(root_url, json.load(manifest_file))
+
+    def url(self, path):
+        """Returns the URL to use for a static file in a page. Called from the templates."""
+        return self.root_url + "/" + self.assets.get(path, path)
+
+    def is_immutable(self, static_dir, file_name):
+        """Returns True if the requested file is a fingerprinted copy, which never changes, so it can be cached for good."""
+        return static_dir + "/" + file_name in self.fingerprinted
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""In-process cache for authentication lookups, so checking an API key or session cookie is a dictionary
+lookup rather than a database round trip."""
+
+import collections
+import hashlib
+import threading
+import time
+
+KIND_API_KEY = "api_key"
+KIND_SESSION = "session"
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL_SECS = 300.0 # Bounds how long a credential revoked by another process keeps working
+DEFAULT_NEGATIVE_TTL_SECS = 30.0 # Unknown credentials are remembered for less time, so a new one works quickly
+
+class AuthCache(object):
+    """Thread safe LRU cache with expiry. Entries are keyed by a hash of the credential, so the cache never holds
+    the credentials themselves. A value of None records that the credential is not valid."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_secs=DEFAULT_TTL_SECS, negative_ttl_secs=DEFAULT_NEGATIVE_TTL_SECS):
+        self.max_entries = max_entries
+        self.ttl_secs = ttl_secs
+        self.negative_ttl_secs = negative_ttl_secs
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict() # hashed key -> (value, expiry time), least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(kind, credential):
+        """Hashes the credential, along with what kind of credential it is."""
+        return hashlib.sha256((kind + ":" + str(credential)).encode('utf-8')).hexdigest()
+
+    def get(self, kind, credential):
+        """Returns (True, value) if the credential is cached and hasn't expired, (False, None) otherwise."""
+        key = AuthCache.make_key(kind, credential)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now < entry[1]:
+                self.entries.move_to_end(key)
+                self.hits = self.hits + 1
+                return True, entry[0]
+            if entry is not None:
+                del self.entries[key]
+            self.misses = self.misses + 1
+        return False, None
+
+    def put(self, kind, credential, value, expires_at=None):
+        """Caches the result of a lookup. The entry never outlives expires_at, the credential's own expiry, if one is given."""
+        if self.max_entries <= 0:
+            return
+        ttl_secs = self.ttl_secs if value is not None else self.negative_ttl_secs
+        expiry = time.time() + ttl_secs
+        if expires_at is not None:
+            expiry = min(expiry, expires_at)
+        key = AuthCache.make_key(kind, credential)
+        with self.lock:
+            self.entries[key] = (value, expiry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, kind, credential):
+        """Removes a credential, called when it is deleted or a new one is created."""
+        key = AuthCache.make_key(kind, credential)
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        """Removes everything."""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Returns the hit and miss counts, for monitoring."""
+        with self.lock:
+            return { "entries": len(self.entries), "hits": self.hits, "misses": self.misses }
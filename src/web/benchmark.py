@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Compares the performance of the database backends on the operations the dashboard does the most."""
+
+import argparse
+import database
+import random
+import schema
+import sys
+import time
+
+BENCHMARK_COLLECTION = database.COLLECTION_PATIO_MONITOR
+
+def make_reading(ts):
+    """Returns a reading that looks like what the patio monitor posts."""
+    return { "ts": ts, "wind speed ms": random.uniform(0.0, 10.0), "temperature": random.uniform(-10.0, 40.0), "humidity": random.uniform(0.0, 100.0),
+        "moisture_sensor_1": random.random(), "moisture_sensor_2": random.random() }
+
+def time_it(func):
+    """Calls the function and returns the elapsed time, in seconds."""
+    start_time = time.perf_counter()
+    func()
+    return time.perf_counter() - start_time
+
+def benchmark(database_url, num_readings, batch_size):
+    """Runs each benchmark against the given database and returns a list of (name, seconds, operations)."""
+    db = database.create_database(database_url)
+    db.connect(database_url)
+    schema.upgrade(db)
+    results = []
+    try:
+        start_ts = time.time() - num_readings
+        readings = [ make_reading(start_ts + i) for i in range(num_readings) ]
+
+        def single_inserts():
+            for reading in readings[:num_readings // 2]:
+                db.create_status(BENCHMARK_COLLECTION, dict(reading))
+        results.append(("single inserts", time_it(single_inserts), num_readings // 2))
+
+        def batched_inserts():
+            remaining = readings[num_readings // 2:]
+            for i in range(0, len(remaining), batch_size):
+                db.create_statuses(BENCHMARK_COLLECTION, [ dict(reading) for reading in remaining[i:i + batch_size] ])
+        results.append(("batched inserts", time_it(batched_inserts), num_readings - num_readings // 2))
+
+        def range_queries():
+            for i in range(10):
+                list(db.retrieve_patio_status(start_ts + (num_readings * i / 10.0)))
+        results.append(("range queries", time_it(range_queries), 10))
+
+        def latest_queries():
+            for i in range(100):
+                db.retrieve_latest_patio_status()
+        results.append(("latest queries", time_it(latest_queries), 100))
+    finally:
+        db.close()
+    return results
+
+def main():
+    """Entry point for the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database", type=str, action="append", help="The URI of a database to benchmark; may be repeated. Use a scratch database, e.g. mongodb://localhost:27017/benchmark or sqlite:///benchmark.db, as readings are inserted.", required=True)
+    parser.add_argument("--readings", type=int, action="store", default=10000, help="The number of readings to insert.", required=False)
+    parser.add_argument("--batch-size", type=int, action="store", default=100, help="The number of readings per batched insert.", required=False)
+
+    try:
+        args = parser.parse_args()
+    except IOError as e:
+        parser.error(e)
+        sys.exit(1)
+
+    for database_url in args.database:
+        print(database_url)
+        for name, elapsed, operations in benchmark(database_url, args.readings, args.batch_size):
+            print("    %-16s %10.3f secs %12.1f ops/sec" % (name, elapsed, operations / elapsed))
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Compact binary encoding for a series of readings.
+
+All values are little-endian:
+    magic        4 bytes, "DSR1"
+    num_fields   uint16
+    num_rows     uint32
+    field names  num_fields * (uint16 length, UTF-8 bytes)
+    timestamps   num_rows * int64, milliseconds; the first is absolute and the rest are deltas from the previous one
+    fields       for each field, a validity bitmap of ceil(num_rows / 8) bytes (bit i % 8 of byte i / 8 is set when
+                 row i has a value, least significant bit first) followed by num_rows * float32, zero where missing
+
+Only numeric fields are encoded; callers should check can_encode first, since everything else would be dropped."""
+
+import struct
+import numpy
+
+MIME_TYPE = "application/x-dashboard-series"
+MAGIC = b"DSR1"
+TS_KEY = "ts"
+
+def is_number(value):
+    """Returns True if the value can be encoded, booleans are not considered numbers here."""
+    return value is not None and not isinstance(value, bool) and isinstance(value, (int, float))
+
+def can_encode(columns):
+    """Returns True if every value in the columns is either missing or a number, so that encoding loses nothing."""
+    return all(value is None or is_number(value) for column in columns.values() for value in column)
+
+def encode_columns(columns, ts_key=TS_KEY):
+    """Encodes a dictionary of equal length columns, as produced for the columnar JSON format, into bytes."""
+    ts_values = columns.get(ts_key, [])
+    num_rows = len(ts_values)
+    field_names = [ key for key, column in columns.items() if key != ts_key and any(is_number(value) for value in column) ]
+
+    parts = [ MAGIC, struct.pack("<HI", len(field_names), num_rows) ]
+    for key in field_names:
+        encoded_key = key.encode("utf-8")
+        parts.append(struct.pack("<H", len(encoded_key)))
+        parts.append(encoded_key)
+
+    ts_ms = numpy.rint(numpy.array(ts_values, dtype=numpy.float64) * 1000.0).astype(numpy.int64)
+    if num_rows > 1:
+        ts_ms[1:] = numpy.diff(ts_ms)
+    parts.append(ts_ms.astype("<i8").tobytes())
+
+    for key in field_names:
+        column = columns[key]
+        valid = numpy.fromiter((is_number(value) for value in column), dtype=bool, count=num_rows)
+        values = numpy.fromiter((value if is_number(value) else 0.0 for value in column), dtype=numpy.float64, count=num_rows)
+        parts.append(numpy.packbits(valid, bitorder="little").tobytes())
+        parts.append(values.astype("<f4").tobytes())
+    return b"".join(parts)
+
+def decode(data, ts_key=TS_KEY):
+    """Decodes bytes produced by encode_columns back into columns, with None for missing values. Mostly useful for testing clients."""
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a binary series.")
+    offset = len(MAGIC)
+    num_fields, num_rows = struct.unpack_from("<HI", data, offset)
+    offset = offset + 6
+    field_names = []
+    for _ in range(num_fields):
+        key_len, = struct.unpack_from("<H", data, offset)
+        offset = offset + 2
+        field_names.append(data[offset:offset + key_len].decode("utf-8"))
+        offset = offset + key_len
+
+    ts_ms = numpy.frombuffer(data, dtype="<i8", count=num_rows, offset=offset)
+    offset = offset + 8 * num_rows
+    columns = { ts_key: (numpy.cumsum(ts_ms) / 1000.0).tolist() }
+    bitmap_len = (num_rows + 7) // 8
+    for key in field_names:
+        valid = numpy.unpackbits(numpy.frombuffer(data, dtype=numpy.uint8, count=bitmap_len, offset=offset), count=num_rows, bitorder="little")
+        offset = offset + bitmap_len
+        values = numpy.frombuffer(data, dtype="<f4", count=num_rows, offset=offset)
+        offset = offset + 4 * num_rows
+        columns[key] = [ float(value) if is_valid else None for value, is_valid in zip(values, valid) ]
+    return columns
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Writes fingerprinted copies of the static files, and the manifest that points the pages at them, then gzip and brotli
+compressed copies of those, so the server can send them without compressing anything per request.
+Run this whenever the files in css, js, or images change. Compressed copies older than their original are ignored by the server."""
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sys
+
+import assets
+import compression
+
+STATIC_DIRS = [ "css", "js", "images" ]
+
+# Formats that are already compressed and won't get any smaller.
+SKIPPED_EXTENSIONS = set([ ".br", ".gz", ".png", ".jpg", ".jpeg", ".gif", ".webp", ".ico", ".woff", ".woff2" ])
+
+def write_variant(path, suffix, data):
+    """Writes a compressed copy of a file, unless it isn't any smaller. Returns the number of bytes written."""
+    variant_path = path + suffix
+    if len(data) >= os.path.getsize(path):
+        if os.path.exists(variant_path):
+            os.remove(variant_path)
+        return 0
+    with open(variant_path, "wb") as variant_file:
+        variant_file.write(data)
+    return len(data)
+
+def fingerprint(root_dir):
+    """Copies each static file to a name containing its content hash, removes copies made for older contents,
+    and writes the manifest mapping each file to its copy. Returns the manifest."""
+    manifest = {}
+    for static_dir in STATIC_DIRS:
+        dir_path = os.path.join(root_dir, static_dir)
+        if not os.path.isdir(dir_path):
+            continue
+        file_names = [ file_name for file_name in sorted(os.listdir(dir_path)) if os.path.isfile(os.path.join(dir_path, file_name)) ]
+        copy_names = set()
+        for file_name in file_names:
+            if os.path.splitext(file_name)[1].lower() in [ ".br", ".gz" ] or assets.is_fingerprinted_name(file_name):
+                continue
+            copy_name = assets.fingerprinted_name(file_name, assets.content_hash(os.path.join(dir_path, file_name)))
+            if not os.path.exists(os.path.join(dir_path, copy_name)):
+                shutil.copyfile(os.path.join(dir_path, file_name), os.path.join(dir_path, copy_name))
+            copy_names.add(copy_name)
+            manifest[static_dir + "/" + file_name] = static_dir + "/" + copy_name
+
+        # Copies of older contents, and their compressed copies, are no longer referenced.
+        for file_name in file_names:
+            copy_name = file_name
+            for suffix in [ ".br", ".gz" ]:
+                if copy_name.endswith(suffix):
+                    copy_name = copy_name[:-len(suffix)]
+            if assets.is_fingerprinted_name(copy_name) and copy_name not in copy_names:
+                os.remove(os.path.join(dir_path, file_name))
+    with open(os.path.join(root_dir, assets.MANIFEST_FILE), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4, sort_keys=True)
+    return manifest
+
+def build(root_dir):
+    """Compresses every eligible file in the static directories under root_dir."""
+    for static_dir in STATIC_DIRS:
+        dir_path = os.path.join(root_dir, static_dir)
+        if not os.path.isdir(dir_path):
+            continue
+        for file_name in sorted(os.listdir(dir_path)):
+            path = os.path.join(dir_path, file_name)
+            if not os.path.isfile(path) or os.path.splitext(file_name)[1].lower() in SKIPPED_EXTENSIONS:
+                continue
+            with open(path, "rb") as original_file:
+                data = original_file.read()
+            gzip_size = write_variant(path, ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+            brotli_size = 0
+            if compression.brotli is not None:
+                brotli_size = write_variant(path, ".br", compression.brotli.compress(data, quality=11))
+            print("%s: %d bytes, gzip %d, brotli %d" % (path, len(data), gzip_size, brotli_size))
+
+def main():
+    """Entry point for the static file build."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root-dir", type=str, action="store", default=os.path.dirname(os.path.abspath(__file__)), help="The directory containing css, js, and images.", required=False)
+
+    try:
+        args = parser.parse_args()
+    except IOError as e:
+        parser.error(e)
+        sys.exit(1)
+
+    if compression.brotli is None:
+        print("The brotli module is not installed, only writing gzip copies.")
+    fingerprint(args.root_dir)
+    build(args.root_dir)
+
+if __name__=="__main__":
+    main()
@@ -8,3 +8,6 @@ source venv/bin/activate
 
 # Install the packages.
 pip3 install -r requirements.txt
+
+# Fingerprint and precompress the static files.
+python3 build_static.py
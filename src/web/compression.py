@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Content negotiated compression of responses, and serving of precompressed static files."""
+
+import flask
+import mimetypes
+import os
+import zlib
+
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODING_BROTLI = "br"
+ENCODING_GZIP = "gzip"
+
+# Precompressed static files are stored alongside the original with these suffixes.
+PRECOMPRESSED_SUFFIXES = [ (ENCODING_BROTLI, ".br"), (ENCODING_GZIP, ".gz") ]
+
+# Runtime compression is cheap at these levels, which matters on a Raspberry Pi.
+DEFAULT_GZIP_LEVEL = 5
+DEFAULT_BROTLI_QUALITY = 4
+DEFAULT_MIN_SIZE = 1024 # Responses smaller than this, in bytes, aren't worth compressing
+
+COMPRESSIBLE_MIME_TYPES = set([ "application/json", "application/javascript", "application/x-dashboard-series", "image/svg+xml" ])
+
+def is_compressible(mimetype):
+    """Returns True if content of the given type is likely to get smaller when compressed."""
+    if mimetype is None:
+        return False
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_MIME_TYPES
+
+def gzip_compressor(level):
+    """Returns a zlib compressor that produces gzip output."""
+    return zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+def compress(data, encoding, level):
+    """Compresses a complete response body."""
+    if encoding == ENCODING_BROTLI:
+        return brotli.compress(data, quality=level)
+    compressor = gzip_compressor(level)
+    return compressor.compress(data) + compressor.flush()
+
+def compress_stream(chunks, encoding, level):
+    """Generator that compresses a streamed response body, flushing after each chunk so the client
+    still gets data as soon as it is produced."""
+    if encoding == ENCODING_BROTLI:
+        compressor = brotli.Compressor(quality=level)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = gzip_compressor(level)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+class ResponseCompressor(object):
+    """Compresses responses using the best encoding the client accepts. A level of zero disables that encoding."""
+
+    def __init__(self, gzip_level=DEFAULT_GZIP_LEVEL, brotli_quality=DEFAULT_BROTLI_QUALITY, min_size=DEFAULT_MIN_SIZE):
+        self.levels = {}
+        if brotli is not None and brotli_quality > 0:
+            self.levels[ENCODING_BROTLI] = brotli_quality
+        if gzip_level > 0:
+            self.levels[ENCODING_GZIP] = gzip_level
+        self.min_size = min_size
+
+    def choose_encoding(self, accept_encodings):
+        """Returns the preferred encoding that the client accepts, or None."""
+        for encoding in [ ENCODING_BROTLI, ENCODING_GZIP ]:
+            if encoding in self.levels and accept_encodings[encoding] > 0:
+                return encoding
+        return None
+
+    def compress_response(self, request, response):
+        """Compresses the response in place, if it is worth it and the client accepts it. Meant to be called after each request."""
+        if response.status_code < 200 or response.status_code >= 300 or response.status_code == 204:
+            return response
+        if response.direct_passthrough or "Content-Encoding" in response.headers or not is_compressible(response.mimetype):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = self.choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        level = self.levels[encoding]
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding, level)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(compress(data, encoding, level))
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+def precompressed_variant(directory, file_name, accept_encodings):
+    """Returns the name of a precompressed copy of the file that the client accepts, and its encoding. The copy
+    is only used if it is at least as new as the original, so a stale build is never served."""
+    original_path = safe_join(directory, file_name)
+    if original_path is None or not os.path.isfile(original_path):
+        return None, None
+    original_mtime = os.path.getmtime(original_path)
+    for encoding, suffix in PRECOMPRESSED_SUFFIXES:
+        if accept_encodings[encoding] <= 0:
+            continue
+        variant_path = original_path + suffix
+        if os.path.isfile(variant_path) and os.path.getmtime(variant_path) >= original_mtime:
+            return file_name + suffix, encoding
+    return None, None
+
+def send_static_file(directory, file_name, accept_encodings):
+    """Sends a static file, using a precompressed copy if there is a suitable one, so that nothing is compressed per request."""
+    variant_name, encoding = precompressed_variant(directory, file_name, accept_encodings)
+    if variant_name is None:
+        response = flask.send_from_directory(directory, file_name)
+    else:
+        mimetype, _ = mimetypes.guess_type(file_name)
+        response = flask.send_from_directory(directory, variant_name, mimetype=mimetype)
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
@@ -22,42 +22,89 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import alerts
 import argparse
-import bcrypt
+import assets
+import auth_cache
+import base64
+import concurrent.futures
+import binary_series
+import compression
 import database
+import datetime
+import downsample
 import flask
 import functools
+import hashlib
+import ingest_queue
+import itertools
 import json
+import latest_cache
+import limits_cache
 import logging
+import metrics
 import os
+import page_cache
+import password_pool
+import retention
+import rollups
+import schema
 import secrets
 import signal
+import site_status
+import stream
 import sys
+import tailer
 import time
 import uuid
 import waitress
 import traceback
 import InputChecker
 
-from mako.template import Template
 from urllib.parse import unquote_plus
 
-# Global variables
-g_flask_app = flask.Flask(__name__)
-g_root_dir = ""
-g_root_url = ""
-g_db_uri = ""
-g_tempmod_dir = "tempmod"
-
 # Files and directories
 ERROR_LOG = 'error.log'
 CSS_DIR = 'css'
 JS_DIR = 'js'
 IMAGES_DIR = 'images'
 HTML_DIR = 'html'
+PAGE_TEMPLATES = [ 'login.html', 'admin.html', 'scale.html', 'index.html' ]
+
+# Global variables
+g_flask_app = flask.Flask(__name__)
+g_root_dir = ""
+g_root_url = ""
+g_db_manager = database.DatabaseConnectionManager()
+g_write_behind_queue = None # Only used when write-behind mode is enabled
+g_compaction_job = None # Enforces the retention policy, None if disabled
+g_response_compressor = compression.ResponseCompressor()
+g_latest_cache = latest_cache.LatestReadingCache()
+g_auth_cache = auth_cache.AuthCache()
+g_password_pool = password_pool.PasswordPool(workers=0) # Replaced with a real pool in main()
+g_tempmod_dir = "tempmod"
+g_stream_hub = stream.StreamHub() # Only publishes while the stream server is running
+g_stream_server = None # Serves the live readings stream, None if disabled
+g_db_tailer = None # Picks up readings other processes write to the database
+g_limits_cache = limits_cache.LimitsCache(lambda: connect_to_db())
+g_alert_engine = alerts.AlertEngine(lambda: g_limits_cache.get()) # Replaced in main(), to apply the options
+g_stream_url = None # Where the stream can be reached, when it isn't this host on the stream port
+g_asset_manifest = assets.AssetManifest() # Loaded in main(), empty until then
+g_waitress_server = None # Set in main(), so the metrics can read its queue
+g_page_cache = page_cache.PageCache(os.path.join(g_root_dir, HTML_DIR), os.path.join(g_tempmod_dir, HTML_DIR)) # Replaced in main(), to apply the options
 
 START_TS = 'start_ts'
 LATEST = 'latest'
+RESOLUTION = 'resolution'
+MAX_POINTS = 'max_points'
+FORMAT = 'format'
+FORMAT_ROWS = 'rows' # An array of reading objects, the default
+FORMAT_COLUMNAR = 'columnar' # An object containing an array of values for each field
+FIELDS = 'fields'
+END_TS = 'end_ts'
+LIMIT = 'limit'
+CURSOR = 'cursor'
+NEXT_CURSOR_HEADER = 'X-Next-Cursor' # Returned when there are more readings after the page that was returned
 MIN_PASSWORD_LEN  = 8
 SESSION_COOKIE = 'session_cookie'
 
@@ -74,7 +121,59 @@ PARAM_API_KEY = "api_key"
 PARAM_COLLECTION = "collection"
 PARAM_TIMESTAMP = "ts"
 PARAM_NAME = "name"
-PARAM_LIMITS_KEY = "key"
+PARAM_LIMITS_KEY = "key" # Optional when listing limits, all of them are returned without it
+PARAM_LIMITS = "limits" # Object of key -> { lower_limit, upper_limit }, for setting several limits at once
+PARAM_LOWER_LIMIT = "lower_limit"
+PARAM_UPPER_LIMIT = "upper_limit"
+PARAM_KEY = "key" # An API key being managed, as opposed to the one authenticating the request
+PARAM_READINGS = "readings" # List of readings, for batched status updates
+PARAM_DEVICE = latest_cache.DEVICE_KEY # Optional, identifies the device that sent a reading
+PARAM_SINCE = "since" # Alerts version the caller already has
+PARAM_ACTIVE = "active" # Only return active alerts
+PARAM_SITE = "site" # Comma separated list of monitored sites, for the per-site website status requests
+
+MAX_READINGS_PER_BATCH = 5000
+STREAM_CHUNK_ITEMS = 200 # Number of readings encoded per chunk of a streamed series
+MAX_FIELDS = 32
+MAX_PAGE_LIMIT = 10000
+DEFAULT_SERIES_WINDOW_SECS = 86400 # Series requests without a start time get the last day
+DEFAULT_SERVER_THREADS = 8 # Waitress threads serving requests. Password hashing may only hold some of them.
+SNAPSHOT_WORKERS = 8 # Threads shared by dashboard snapshots, to run each snapshot's queries at the same time
+SNAPSHOT_PARAM_COLLECTIONS = 'collections'
+KEG_SCALE_NAME = 'keg'
+
+# The database method that retrieves each sensor collection's raw readings.
+SERIES_RETRIEVE_METHODS = {
+    database.COLLECTION_INDOOR_AIR_QUALITY: "retrieve_air_quality",
+    database.COLLECTION_PATIO_MONITOR: "retrieve_patio_status",
+    database.COLLECTION_AC: "retrieve_ac_status",
+    database.COLLECTION_KEG: "retrieve_keg_status",
+    database.COLLECTION_WEBSITE_STATUS: "retrieve_website_status"
+}
+
+# Runs the queries for dashboard snapshots.
+g_snapshot_executor = concurrent.futures.ThreadPoolExecutor(max_workers=SNAPSHOT_WORKERS, thread_name_prefix="snapshot")
+
+# Metrics. Requests are broken down by route and, for API requests, by API method; unknown API methods are counted together.
+METRICS_UNMATCHED_ROUTE = "unmatched"
+METRICS_UNKNOWN_API_METHOD = "unknown"
+HTTP_REQUESTS = metrics.REGISTRY.counter("dashboard_http_requests_total", "HTTP requests, by route, API method, and status code.", [ "route", "api_method", "code" ])
+HTTP_REQUEST_SECONDS = metrics.REGISTRY.histogram("dashboard_http_request_seconds", "Time taken to handle HTTP requests, by route and API method.", [ "route", "api_method" ])
+
+def auth_cache_metric(key):
+    """Returns a function that reads one of the auth cache's counters, for the metrics."""
+    return lambda: g_auth_cache.stats()[key]
+
+def waitress_metric(read_func):
+    """Returns a function that reads from waitress's task dispatcher, for the metrics. None until the server is running."""
+    return lambda: read_func(g_waitress_server.task_dispatcher) if g_waitress_server is not None else None
+
+metrics.REGISTRY.callback("dashboard_auth_cache_hits_total", "API key and session lookups answered by the auth cache.", metrics.TYPE_COUNTER, auth_cache_metric("hits"))
+metrics.REGISTRY.callback("dashboard_auth_cache_misses_total", "API key and session lookups that went to the database.", metrics.TYPE_COUNTER, auth_cache_metric("misses"))
+metrics.REGISTRY.callback("dashboard_auth_cache_entries", "Entries in the auth cache.", metrics.TYPE_GAUGE, auth_cache_metric("entries"))
+metrics.REGISTRY.callback("dashboard_waitress_queue_depth", "Requests waiting for a waitress worker thread.", metrics.TYPE_GAUGE, waitress_metric(lambda dispatcher: len(dispatcher.queue)))
+metrics.REGISTRY.callback("dashboard_waitress_active_threads", "Waitress worker threads handling a request.", metrics.TYPE_GAUGE, waitress_metric(lambda dispatcher: dispatcher.active_count))
+metrics.REGISTRY.callback("dashboard_waitress_threads", "Waitress worker threads.", metrics.TYPE_GAUGE, waitress_metric(lambda dispatcher: len(dispatcher.threads)))
 
 def login_required(function_to_protect):
     @functools.wraps(function_to_protect)
@@ -93,11 +192,13 @@ def login_required(function_to_protect):
 
             # Get the user from the session cookie.
             # This function will take care of checking for session expiry.
-            db = connect_to_db()
-            user, expiry = db.retrieve_session_data(str(session_cookie))
+            try:
+                valid_session, user = validate_session(session_cookie)
+            except ApiServiceUnavailableException as e:
+                return e.message, e.code
 
             # We found a user with a valid login session, continue.
-            if user:
+            if valid_session and user:
                 return function_to_protect(*args, **kwargs)
         
         # No valid login session, redirect to the login page.
@@ -133,9 +234,42 @@ class ApiNotLoggedInException(ApiException):
 
     def __init__(self):
         ApiException.__init__(self, 403, "Not logged in")
+
+class ApiServiceUnavailableException(ApiException):
+    """Exception thrown by a REST API when the request cannot be handled right now, but may succeed later."""
+
+    def __init__(self, message):
+        ApiException.__init__(self, 503, message)
         
+def shutdown():
+    """Releases process-wide resources, such as the database connection pool."""
+    global g_db_manager
+    global g_write_behind_queue
+    global g_compaction_job
+    global g_stream_server
+    global g_db_tailer
+
+    if g_db_tailer is not None:
+        g_db_tailer.stop()
+        g_db_tailer = None
+    if g_stream_server is not None:
+        g_stream_server.stop()
+        g_stream_server = None
+    g_password_pool.stop()
+    g_snapshot_executor.shutdown(wait=False)
+    if g_compaction_job is not None:
+        g_compaction_job.stop()
+        g_compaction_job = None
+
+    # Write anything that is still queued before the database goes away.
+    if g_write_behind_queue is not None:
+        g_write_behind_queue.stop()
+        g_write_behind_queue = None
+    g_db_manager.close()
+
 def signal_handler(signal, frame):
     print("Exiting...")
+    shutdown()
     sys.exit(0)
 
 def log_info(log_str):
@@ -149,11 +283,23 @@ def log_error(log_str):
     logger.error(log_str)
 
 def connect_to_db():
-    """Utility function for getting a database connection."""
-    global g_db_uri
-    db = database.AppMongoDatabase()
-    db.connect(g_db_uri)
-    return db
+    """Utility function for getting a database connection. The connection is shared by the whole process."""
+    global g_db_manager
+    return g_db_manager.get()
+
+def hash_password(password):
+    """Hashes a password on the password pool. Raises ApiServiceUnavailableException if the pool is saturated."""
+    try:
+        return g_password_pool.hash(password)
+    except password_pool.PasswordPoolBusyException as e:
+        raise ApiServiceUnavailableException(str(e))
+
+def check_password(password, hashed):
+    """Checks a password on the password pool. Raises ApiServiceUnavailableException if the pool is saturated."""
+    try:
+        return g_password_pool.check(password, hashed)
+    except password_pool.PasswordPoolBusyException as e:
+        raise ApiServiceUnavailableException(str(e))
 
 def authenticate_user(email, password):
     """Validates a user against the credentials in the database."""
@@ -171,11 +317,7 @@ def authenticate_user(email, password):
         raise Exception("The user (" + email + ") could not be found.")
 
     # Validate the provided password against the hash from the database.
-    if isinstance(password, str):
-        password = password.encode()
-    if isinstance(db_hash1, str):
-        db_hash1 = db_hash1.encode()
-    return bcrypt.checkpw(password, db_hash1)
+    return check_password(password, db_hash1)
 
 def create_user(email, realname, password1, password2):
     """Adds a user to the database."""
@@ -197,8 +339,7 @@ def create_user(email, realname, password1, password2):
         raise Exception("The user already exists.")
 
     # Generate the salted hash of the password.
-    salt = bcrypt.gensalt()
-    computed_hash = bcrypt.hashpw(password1.encode('utf-8'), salt)
+    computed_hash = hash_password(password1)
     if not db.create_user(email, realname, computed_hash):
         raise Exception("An internal error was encountered when creating the user.")
 
@@ -219,13 +360,36 @@ def create_new_session(email):
     return None, None
 
 def delete_session(session_cookie):
+    g_auth_cache.invalidate(auth_cache.KIND_SESSION, str(session_cookie))
     db = connect_to_db()
     return db.delete_session_cookie(session_cookie)
 
+def lookup_credentials(retrieve_func):
+    """Runs a session or API key lookup against the database. A lookup that failed raises ApiServiceUnavailableException rather
+    than returning nothing, so that it isn't mistaken for (and cached as) unknown credentials."""
+    try:
+        return retrieve_func(connect_to_db())
+    except database.DatabaseException:
+        raise ApiServiceUnavailableException("The database is unavailable.")
+
+def lookup_session(session_cookie):
+    """Returns the user and expiry for a session cookie, (None, None) if there is no such session. Uses the auth cache when it can.
+    A failed lookup is not cached."""
+    session_cookie = str(session_cookie)
+    found, session = g_auth_cache.get(auth_cache.KIND_SESSION, session_cookie)
+    if not found:
+        user, expiry = lookup_credentials(lambda db: db.retrieve_session_data(session_cookie))
+        session = None
+        if expiry is not None:
+            session = (user, expiry)
+        g_auth_cache.put(auth_cache.KIND_SESSION, session_cookie, session, expires_at=expiry)
+    if session is None:
+        return None, None
+    return session
+
 def validate_session(session_cookie):
     """Returns TRUE if the session cookie is valid."""
-    db = connect_to_db()
-    user, expiry = db.retrieve_session_data(str(session_cookie))
+    user, expiry = lookup_session(session_cookie)
     if expiry is not None:
 
         # Is the cookie still valid.
@@ -234,7 +398,7 @@ def validate_session(session_cookie):
             return True, user
 
         # Cookie is expired, so delete it.
-        db.delete_session_cookie(session_cookie)
+        delete_session(session_cookie)
     return False, user
 
 def common_api_key_check(values):
@@ -244,11 +408,15 @@ def common_api_key_check(values):
         raise ApiAuthenticationException("API key not specified.")
 
     # Validate the key.
-    key = values[PARAM_API_KEY]
-
-    # Check the database.
-    db = connect_to_db()
-    user = db.retrieve_api_key(key)
+    key = str(values[PARAM_API_KEY])
+
+    # Check the cache, then the database. Unknown keys are cached too, so a misconfigured device can't make every request hit the database.
+    found, user = g_auth_cache.get(auth_cache.KIND_API_KEY, key)
+    if not found:
+        user = lookup_credentials(lambda db: db.retrieve_api_key(key))
+        g_auth_cache.put(auth_cache.KIND_API_KEY, key, user)
+    if user is None:
+        raise ApiAuthenticationException("API key is invalid.")
     return True, user
 
 def common_session_check(values):
@@ -279,11 +447,18 @@ def common_auth_check(values):
         return common_session_check(values)
     raise Exception("Internal error.")
 
+def send_static_file(static_dir, file_name):
+    """Sends a file from one of the static directories. Fingerprinted copies never change, so the client is told to keep them."""
+    response = compression.send_static_file(static_dir, file_name, flask.request.accept_encodings)
+    if g_asset_manifest.is_immutable(static_dir, file_name):
+        response.headers["Cache-Control"] = assets.IMMUTABLE_CACHE_CONTROL
+    return response
+
 @g_flask_app.route('/css/<file_name>')
 def css(file_name):
     """Returns the CSS page."""
     try:
-        return flask.send_from_directory(CSS_DIR, file_name)
+        return send_static_file(CSS_DIR, file_name)
     except:
         log_error(traceback.format_exc())
         log_error(sys.exc_info()[0])
@@ -294,7 +469,7 @@ def css(file_name):
 def js(file_name):
     """Returns the JS page."""
     try:
-        return flask.send_from_directory(JS_DIR, file_name)
+        return send_static_file(JS_DIR, file_name)
     except:
         log_error(traceback.format_exc())
         log_error(sys.exc_info()[0])
@@ -305,20 +480,52 @@ def js(file_name):
 def images(file_name):
     """Returns the contents from the images directory."""
     try:
-        return flask.send_from_directory(IMAGES_DIR, file_name)
+        return send_static_file(IMAGES_DIR, file_name)
     except:
         log_error(traceback.format_exc())
         log_error(sys.exc_info()[0])
         log_error('Unhandled exception in ' + js.__name__)
     return ""
 
+@g_flask_app.before_request
+def start_request_timer():
+    """Notes when the request started, for the request metrics."""
+    flask.g.request_start_time = time.perf_counter()
+
+@g_flask_app.after_request
+def record_request_metrics(response):
+    """Counts and times the request. Registered before compress_response, so it runs after it and the time includes compression.
+    Streamed responses are only timed once the server has finished sending them, since that's when the database cursor is read."""
+    start_time = getattr(flask.g, "request_start_time", None)
+    if start_time is not None:
+        url_rule = flask.request.url_rule
+        route = url_rule.rule if url_rule is not None else METRICS_UNMATCHED_ROUTE
+        api_method = getattr(flask.g, "api_method", "")
+        status_code = str(response.status_code)
+        def record():
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start_time, (route, api_method))
+            HTTP_REQUESTS.inc((route, api_method, status_code))
+        if response.is_streamed:
+            response.call_on_close(record)
+        else:
+            record()
+    return response
+
+@g_flask_app.route('/metrics')
+def metrics_request():
+    """Returns the metrics, in the Prometheus text format."""
+    return flask.Response(metrics.REGISTRY.render(), mimetype=metrics.CONTENT_TYPE)
+
+@g_flask_app.after_request
+def compress_response(response):
+    """Compresses the response, if the client accepts it and it's big enough to be worth it."""
+    return g_response_compressor.compress_response(flask.request, response)
+
 @g_flask_app.route('/login')
 def login():
     """Renders the login page."""
     try:
-        html_file = os.path.join(g_root_dir, HTML_DIR, 'login.html')
-        my_template = Template(filename=html_file, module_directory=g_tempmod_dir)
-        return my_template.render(root_url=g_root_url)
+        return g_page_cache.render('login.html', root_url=g_root_url, asset=g_asset_manifest.url)
     except:
         log_error("Unhandled Exception")
     return ""
@@ -328,9 +535,7 @@ def login():
 def admin():
     """Renders the admin page."""
     try:
-        html_file = os.path.join(g_root_dir, HTML_DIR, 'admin.html')
-        my_template = Template(filename=html_file, module_directory=g_tempmod_dir)
-        return my_template.render(root_url=g_root_url)
+        return g_page_cache.render('admin.html', root_url=g_root_url, asset=g_asset_manifest.url)
     except:
         log_error("Unhandled Exception")
     return ""
@@ -340,9 +545,7 @@ def admin():
 def scale():
     """Renders the scale configuration page."""
     try:
-        html_file = os.path.join(g_root_dir, HTML_DIR, 'scale.html')
-        my_template = Template(filename=html_file, module_directory=g_tempmod_dir)
-        return my_template.render(root_url=g_root_url)
+        return g_page_cache.render('scale.html', root_url=g_root_url, asset=g_asset_manifest.url)
     except:
         log_error("Unhandled Exception")
     return ""
@@ -351,59 +554,314 @@ def scale():
 def index():
     """Renders the index page."""
     try:
-        html_file = os.path.join(g_root_dir, HTML_DIR, 'index.html')
-        my_template = Template(filename=html_file, module_directory=g_tempmod_dir)
-        return my_template.render(root_url=g_root_url)
+        return g_page_cache.render('index.html', root_url=g_root_url, asset=g_asset_manifest.url)
     except:
         log_error("Unhandled Exception")
     return ""
 
+def parse_start_ts(values):
+    """Returns the start time from the API request. If one wasn't provided then the default window, ending now, is used.
+    An explicit start time of zero means everything."""
+    if START_TS not in values:
+        return int(time.time() - DEFAULT_SERIES_WINDOW_SECS)
+    try:
+        return int(float(values[START_TS]))
+    except ValueError:
+        raise ApiMalformedRequestException("Invalid start_ts.")
+
+def parse_end_ts(values, start_ts):
+    """Returns the (exclusive) end time from the API request, None if the range is open ended."""
+    if END_TS not in values:
+        return None
+    try:
+        end_ts = float(values[END_TS])
+    except ValueError:
+        raise ApiMalformedRequestException("Invalid end_ts.")
+    if end_ts <= start_ts:
+        raise ApiMalformedRequestException("end_ts must be after start_ts.")
+    return end_ts
+
+def parse_limit(values):
+    """Returns the maximum number of readings the caller wants in one page, None if it wants them all."""
+    if LIMIT not in values:
+        return None
+    try:
+        limit = int(values[LIMIT])
+    except ValueError:
+        raise ApiMalformedRequestException("Invalid limit.")
+    if limit < 1 or limit > MAX_PAGE_LIMIT:
+        raise ApiMalformedRequestException("limit must be between 1 and %d." % MAX_PAGE_LIMIT)
+    return limit
+
+def encode_cursor(key):
+    """Converts the key of the last reading on a page into an opaque continuation cursor."""
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+def parse_cursor(values):
+    """Returns the key from the continuation cursor in the API request, None if there isn't one."""
+    if CURSOR not in values:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(values[CURSOR].encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise ApiMalformedRequestException("Invalid cursor.")
+    if not isinstance(key, list) or len(key) != 2 or not isinstance(key[0], (int, float)):
+        raise ApiMalformedRequestException("Invalid cursor.")
+    return key
+
+def parse_resolution(values, start_ts, end_ts=None):
+    """Returns the resolution to use for a series request: raw readings, or one of the rollups."""
+    resolution = rollups.RESOLUTION_RAW
+    if RESOLUTION in values:
+        resolution = values[RESOLUTION]
+    if not rollups.is_valid_resolution(resolution):
+        raise ApiMalformedRequestException("Invalid resolution.")
+    if resolution == rollups.RESOLUTION_AUTO:
+        if end_ts is None:
+            end_ts = time.time()
+        resolution = rollups.choose_resolution(start_ts, end_ts)
+    return resolution
+
+def parse_max_points(values):
+    """Returns the maximum number of points per field the caller wants, or None if it doesn't care."""
+    if MAX_POINTS not in values:
+        return None
+    try:
+        max_points = int(values[MAX_POINTS])
+    except ValueError:
+        raise ApiMalformedRequestException("Invalid max_points.")
+    if max_points < downsample.MIN_POINTS:
+        raise ApiMalformedRequestException("max_points is too small.")
+    return max_points
+
+def parse_fields(values):
+    """Returns the list of fields the caller wants, or None if it wants all of them."""
+    if FIELDS not in values:
+        return None
+    fields = [ field.strip() for field in values[FIELDS].split(",") if len(field.strip()) > 0 ]
+    if len(fields) == 0 or len(fields) > MAX_FIELDS:
+        raise ApiMalformedRequestException("Invalid fields.")
+    for field in fields:
+        if field.startswith("$") or "." in field:
+            raise ApiMalformedRequestException("Invalid field name.")
+    return fields
+
+def parse_format(values):
+    """Returns the response format the caller wants for a series."""
+    response_format = FORMAT_ROWS
+    if FORMAT in values:
+        response_format = values[FORMAT]
+    if response_format not in [ FORMAT_ROWS, FORMAT_COLUMNAR ]:
+        raise ApiMalformedRequestException("Invalid format.")
+    return response_format
+
+def retrieve_series(db, collection_name, retrieve_raw_func, values):
+    """Common code for the requests that return a series of readings. Returns either the raw
+    readings or the summarized readings from a rollup, depending on the requested resolution,
+    downsampled if the caller limited the number of points. If the caller asked for a page
+    of readings then the cursor for the next page is also returned, None if there isn't one."""
+    start_ts = parse_start_ts(values)
+    end_ts = parse_end_ts(values, start_ts)
+    resolution = parse_resolution(values, start_ts, end_ts)
+    max_points = parse_max_points(values)
+    fields = parse_fields(values)
+    limit = parse_limit(values)
+    after = parse_cursor(values)
+    next_key = None
+    if resolution == rollups.RESOLUTION_RAW or collection_name not in database.ROLLUP_COLLECTIONS:
+        if limit is None and after is None:
+            readings = retrieve_raw_func(start_ts, fields, end_ts)
+        else:
+            try:
+                readings, next_key = db.retrieve_status_page(collection_name, start_ts, end_ts, fields, limit or MAX_PAGE_LIMIT, after)
+            except ValueError:
+                raise ApiMalformedRequestException("Invalid cursor.")
+    else:
+        # Rollup buckets have unique start times, so the time alone is enough to continue from.
+        if after is not None:
+            start_ts = after[0] + rollups.RESOLUTION_SECS[resolution]
+        readings = db.retrieve_rollups(collection_name, resolution, start_ts, fields, end_ts)
+        if limit is not None:
+            readings = list(itertools.islice(readings, limit + 1))
+            if len(readings) > limit:
+                readings = readings[:limit]
+                next_key = [ readings[-1][rollups.ROLLUP_TS_KEY], None ]
+    if max_points is not None:
+        readings = downsample.downsample_rows(list(readings), max_points)
+    next_cursor = None
+    if next_key is not None:
+        next_cursor = encode_cursor(next_key)
+    return readings, next_cursor
+
+def stream_json_array(items):
+    """Generator that encodes an iterable as a JSON array, a chunk of items at a time, so the
+    whole series never has to be held in memory as objects or as one big string."""
+    yield "["
+    chunk = []
+    separator = ""
+    for item in items:
+        chunk.append(json.dumps(item))
+        if len(chunk) >= STREAM_CHUNK_ITEMS:
+            yield separator + ",".join(chunk)
+            separator = ","
+            chunk = []
+    if chunk:
+        yield separator + ",".join(chunk)
+    yield "]"
+
+def rows_to_columns(readings, fields):
+    """Pivots a series of readings into a dictionary of equal length arrays, one per field, with None
+    wherever a reading doesn't have the field."""
+    columns = { PARAM_TIMESTAMP: [] }
+    if fields is not None:
+        for field in fields:
+            columns[field] = []
+    num_rows = 0
+    for reading in readings:
+        for key, value in reading.items():
+            if key not in columns:
+                columns[key] = [ None ] * num_rows
+            columns[key].append(value)
+        num_rows = num_rows + 1
+        for column in columns.values():
+            if len(column) < num_rows:
+                column.append(None)
+    return columns
+
+def stream_json_object(columns):
+    """Generator that encodes a dictionary as a JSON object, a member at a time."""
+    separator = "{"
+    for key, column in columns.items():
+        yield separator + json.dumps(key) + ":" + json.dumps(column)
+        separator = ","
+    if separator == "{":
+        yield separator
+    yield "}"
+
+def wants_binary_series():
+    """Returns True if the caller's Accept header prefers the binary series encoding over JSON."""
+    accept = flask.request.accept_mimetypes
+    return accept[binary_series.MIME_TYPE] > accept['application/json']
+
+def json_series_response(readings, values, next_cursor=None, allow_binary=True):
+    """Returns a streaming response for a series of readings, in the format the caller asked for. Rows are
+    encoded as the database cursor is consumed; columns have to be collected first, but only hold the values.
+    Callers that accept the binary series encoding get that instead of JSON, unless the series has text fields
+    the binary encoding would drop, in which case the readings have to be collected to find out."""
+    response_format = parse_format(values)
+    columns = None
+    if allow_binary and wants_binary_series():
+        readings = list(readings)
+        columns = rows_to_columns(readings, parse_fields(values))
+        if not binary_series.can_encode(columns):
+            columns = None
+    if columns is not None:
+        response = flask.Response(binary_series.encode_columns(columns), mimetype=binary_series.MIME_TYPE)
+    elif response_format == FORMAT_COLUMNAR:
+        response = flask.Response(stream_json_object(rows_to_columns(readings, parse_fields(values))), mimetype='application/json')
+    else:
+        response = flask.Response(stream_json_array(readings), mimetype='application/json')
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    response.vary.add('Accept')
+    return response
+
+def series_response(db, collection_name, retrieve_raw_func, values):
+    """Retrieves a series of readings and returns the response for it."""
+    readings, next_cursor = retrieve_series(db, collection_name, retrieve_raw_func, values)
+    return json_series_response(readings, values, next_cursor)
+
+def make_etag(validator, values):
+    """Builds an entity tag from a validator and the parameters that affect the representation. The start time
+    and credentials are left out: clients poll with a moving start time, and a client that already holds the
+    collection at this version has every reading a later start time could return."""
+    params = sorted([ (key, str(value)) for key, value in values.items() if key not in [ START_TS, PARAM_SESSION_COOKIE, PARAM_API_KEY ] ])
+    representation = json.dumps([ validator, params, wants_binary_series() ])
+    return hashlib.sha1(representation.encode('utf-8')).hexdigest()
+
+def conditional_response(validator, last_modified_ts, values, build_response_func):
+    """Answers 304 Not Modified, without calling build_response_func, if the client's If-None-Match or
+    If-Modified-Since shows it is already current. Otherwise returns the built response with validators attached."""
+    etag = make_etag(validator, values)
+    last_modified = None
+    if last_modified_ts:
+        last_modified = datetime.datetime.fromtimestamp(int(last_modified_ts), tz=datetime.timezone.utc)
+
+    request = flask.request
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    else:
+        not_modified = last_modified is not None and request.if_modified_since is not None and request.if_modified_since >= last_modified
+
+    if not_modified:
+        response = flask.Response(status=304)
+    else:
+        response = build_response_func()
+        if not isinstance(response, flask.Response):
+            response = flask.Response(response, mimetype='application/json')
+    response.set_etag(etag, weak=True) # Weak, since the bytes differ when the response is compressed
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    response.vary.add('Accept')
+    return response
+
+def conditional_status_response(db, collection_name, values, build_response_func):
+    """Conditional response for a request that reads a sensor collection, validated by the collection's latest reading and write marker."""
+    latest_ts, write_marker = db.retrieve_status_validator(collection_name)
+    return conditional_response([ collection_name, latest_ts, write_marker ], latest_ts, values, build_response_func)
+
+def latest_reading_response(db, collection_name, values):
+    """Returns the latest reading for a collection, or for one device in it, from the cache. The reading itself
+    is the validator, so answering a conditional request doesn't touch the database either."""
+    reading = g_latest_cache.get(db, collection_name, values.get(PARAM_DEVICE))
+    if reading is None:
+        reading = [] # What the database methods have always returned for an empty collection
+        last_modified_ts = None
+    else:
+        last_modified_ts = reading.get(PARAM_TIMESTAMP)
+    result = json.dumps(reading)
+    return conditional_response(result, last_modified_ts, values, lambda: result)
+
 def handle_api_indoor_air_request(values):
     """Called when an API request for the indoor air status data is received."""
     db = connect_to_db()
     if LATEST in values:
-        readings = db.retrieve_latest_air_quality()
-        result = json.dumps(readings)
+        result = latest_reading_response(db, database.COLLECTION_INDOOR_AIR_QUALITY, values)
     else:
-        start_ts = 0
-        if START_TS in values:
-            start_ts = int(float(values[START_TS]))
-        readings = list(db.retrieve_air_quality(start_ts))
-        result = json.dumps(readings)
+        build_response_func = lambda: series_response(db, database.COLLECTION_INDOOR_AIR_QUALITY, db.retrieve_air_quality, values)
+        result = conditional_status_response(db, database.COLLECTION_INDOOR_AIR_QUALITY, values, build_response_func)
     return True, result
 
 def handle_api_patio_request(values):
     """Called when an API request for the patio status is received."""
     db = connect_to_db()
     if LATEST in values:
-        readings = db.retrieve_latest_patio_status()
-        result = json.dumps(readings)
+        result = latest_reading_response(db, database.COLLECTION_PATIO_MONITOR, values)
     else:
-        start_ts = 0
-        if START_TS in values:
-            start_ts = int(float(values[START_TS]))
-        readings = list(db.retrieve_patio_status(start_ts))
-        result = json.dumps(readings)
+        build_response_func = lambda: series_response(db, database.COLLECTION_PATIO_MONITOR, db.retrieve_patio_status, values)
+        result = conditional_status_response(db, database.COLLECTION_PATIO_MONITOR, values, build_response_func)
     return True, result
 
 def handle_api_ac_request(values):
     """Called when an API request for the AC status is received."""
-    start_ts = 0
-    if START_TS in values:
-        start_ts = int(float(values[START_TS]))
     db = connect_to_db()
-    readings = list(db.retrieve_ac_status(start_ts))
-    result = json.dumps(readings)
+    if LATEST in values:
+        result = latest_reading_response(db, database.COLLECTION_AC, values)
+    else:
+        build_response_func = lambda: series_response(db, database.COLLECTION_AC, db.retrieve_ac_status, values)
+        result = conditional_status_response(db, database.COLLECTION_AC, values, build_response_func)
     return True, result
 
 def handle_api_keg_request(values):
     """Called when an API request for the keg status is received."""
-    start_ts = 0
-    if START_TS in values:
-        start_ts = int(float(values[START_TS]))
     db = connect_to_db()
-    readings = list(db.retrieve_keg_status(start_ts))
-    result = json.dumps(readings)
+    if LATEST in values:
+        result = latest_reading_response(db, database.COLLECTION_KEG, values)
+    else:
+        build_response_func = lambda: series_response(db, database.COLLECTION_KEG, db.retrieve_keg_status, values)
+        result = conditional_status_response(db, database.COLLECTION_KEG, values, build_response_func)
     return True, result
 
 def handle_api_scale_calibration_request(values):
@@ -415,18 +873,122 @@ def handle_api_scale_calibration_request(values):
     if database.DATABASE_ID_KEY in cal:
         del cal[database.DATABASE_ID_KEY]
     result = json.dumps(cal)
+
+    # The calibration is a single small document, so it is its own validator.
+    result = conditional_response(result, None, values, lambda: result)
     return True, result
 
 def handle_api_website_status(values):
     """Called when an API request for the website status data is received."""
-    start_ts = 0
-    if START_TS in values:
-        start_ts = int(float(values[START_TS]))
     db = connect_to_db()
-    readings = list(db.retrieve_website_status(start_ts))
-    result = json.dumps(readings)
+    if LATEST in values:
+        result = latest_reading_response(db, database.COLLECTION_WEBSITE_STATUS, values)
+    else:
+        build_response_func = lambda: series_response(db, database.COLLECTION_WEBSITE_STATUS, db.retrieve_website_status, values)
+        result = conditional_status_response(db, database.COLLECTION_WEBSITE_STATUS, values, build_response_func)
+    return True, result
+
+def parse_sites(values):
+    """Returns the list of sites the caller wants, or None if it wants all of them."""
+    if PARAM_SITE not in values:
+        return None
+    sites = [ site.strip() for site in values[PARAM_SITE].split(",") if len(site.strip()) > 0 ]
+    if len(sites) == 0 or len(sites) > MAX_FIELDS:
+        raise ApiMalformedRequestException("Invalid site.")
+    return sites
+
+def retrieve_site_series(db, values):
+    """Returns the per-site website status rows for the requested time range and sites, downsampled per site if the caller limited the number of points."""
+    start_ts = parse_start_ts(values)
+    end_ts = parse_end_ts(values, start_ts)
+    max_points = parse_max_points(values)
+    rows = db.retrieve_site_statuses(start_ts, parse_sites(values), end_ts)
+    if max_points is not None:
+        rows = site_status.downsample_by_site(list(rows), max_points)
+    return rows
+
+def handle_api_site_status_request(values):
+    """Called when an API request for the per-site website status series is received. Returns rows of
+    (site, ts, load_time_secs, status), for every site or only the ones given in 'site'."""
+    db = connect_to_db()
+    build_response_func = lambda: json_series_response(retrieve_site_series(db, values), values, allow_binary=False)
+    result = conditional_status_response(db, database.COLLECTION_WEBSITE_STATUS, values, build_response_func)
     return True, result
 
+def handle_api_site_percentiles_request(values):
+    """Called when an API request for website load time percentiles is received. Returns, for each site, the p50, p95,
+    and p99 load times between start_ts (the last day by default) and end_ts, and how many loads they cover."""
+    db = connect_to_db()
+    start_ts = parse_start_ts(values)
+    end_ts = parse_end_ts(values, start_ts)
+    sites = parse_sites(values)
+    build_response_func = lambda: json.dumps(site_status.load_time_percentiles(db.retrieve_site_statuses(start_ts, sites, end_ts)))
+    result = conditional_status_response(db, database.COLLECTION_WEBSITE_STATUS, values, build_response_func)
+    return True, result
+
+def snapshot_validator(collection_name):
+    """Returns a collection's validator for a dashboard snapshot. Runs on the snapshot executor."""
+    latest_ts, write_marker = connect_to_db().retrieve_status_validator(collection_name)
+    return [ collection_name, latest_ts, write_marker ]
+
+def snapshot_collection(collection_name, values):
+    """Returns a collection's part of a dashboard snapshot: its latest reading and its series, as columns. Runs on the snapshot executor."""
+    db = connect_to_db()
+    if collection_name == database.COLLECTION_WEBSITE_STATUS:
+        readings = retrieve_site_series(db, values) # One row per site, rather than one nested object per reading
+    else:
+        readings, _ = retrieve_series(db, collection_name, getattr(db, SERIES_RETRIEVE_METHODS[collection_name]), values)
+    return { "latest": g_latest_cache.get(db, collection_name), "series": rows_to_columns(readings, None) }
+
+def limits_to_dict(limits):
+    """Converts limits from the cache's key -> (lower limit, upper limit) form to what the API returns."""
+    return { key: { PARAM_LOWER_LIMIT: lower_limit, PARAM_UPPER_LIMIT: upper_limit } for key, (lower_limit, upper_limit) in limits.items() }
+
+def snapshot_scale_calibration():
+    """Returns the keg scale's calibration for a dashboard snapshot. Runs on the snapshot executor."""
+    cal = connect_to_db().retrieve_scale_calibration(KEG_SCALE_NAME)
+    cal.pop(database.DATABASE_ID_KEY, None)
+    return cal
+
+def handle_api_dashboard_request(values):
+    """Called when an API request for everything the dashboard shows is received: each collection's series and latest
+    reading, the keg calibration, and, for logged in users, the sensor limits. The queries run at the same time, on the
+    snapshot executor, so the response takes about as long as the slowest of them. The series parameters (start_ts,
+    end_ts, resolution, max_points) apply to every collection and the series are always columnar."""
+    collection_names = database.SENSOR_COLLECTIONS
+    if SNAPSHOT_PARAM_COLLECTIONS in values:
+        collection_names = [ name for name in values[SNAPSHOT_PARAM_COLLECTIONS].split(",") if len(name) > 0 ]
+        if len(collection_names) == 0 or not set(collection_names).issubset(database.SENSOR_COLLECTIONS):
+            raise ApiMalformedRequestException("Invalid collections.")
+
+    # Limits are only for logged in users.
+    include_limits = PARAM_SESSION_COOKIE in values
+    if include_limits:
+        _, _ = common_session_check(values)
+
+    # Paging and projection don't make sense across collections.
+    series_values = { key: value for key, value in values.items() if key not in [ LIMIT, CURSOR, FIELDS, FORMAT, SNAPSHOT_PARAM_COLLECTIONS ] }
+    if RESOLUTION not in series_values:
+        series_values[RESOLUTION] = rollups.RESOLUTION_AUTO
+
+    # The limits and calibration are small enough to be fetched along with the validators, and are part of the validator.
+    # The limits come from the limits cache, so they don't need a query of their own.
+    validator_futures = [ g_snapshot_executor.submit(snapshot_validator, name) for name in collection_names ]
+    cal_future = g_snapshot_executor.submit(snapshot_scale_calibration)
+    limits = limits_to_dict(g_limits_cache.get()) if include_limits else None
+    cal = cal_future.result()
+    validator = [ future.result() for future in validator_futures ] + [ cal, limits ]
+
+    def build_response():
+        series_futures = { name: g_snapshot_executor.submit(snapshot_collection, name, series_values) for name in collection_names }
+        result = { "collections": { name: future.result() for name, future in series_futures.items() }, "scale_calibration": cal }
+        if limits is not None:
+            result["limits"] = limits
+        return json.dumps(result)
+
+    # The limits and calibration don't have a modification time, so only the entity tag is used.
+    return True, conditional_response(validator, None, values, build_response)
+
 def handle_api_login(values):
     """Called when an API request to login a user is received."""
     # Required parameters.
@@ -445,6 +1007,8 @@ def handle_api_login(values):
     try:
         if not authenticate_user(email, password):
             raise ApiAuthenticationException("Authentication failed.")
+    except ApiException:
+        raise
     except Exception as e:
         raise ApiAuthenticationException(str(e))
 
@@ -489,6 +1053,8 @@ def handle_api_create_login(values):
     try:
         if not create_user(email, realname, password1, password2):
             raise Exception("User creation failed.")
+    except ApiServiceUnavailableException:
+        raise
     except:
         raise Exception("User creation failed.")
 
@@ -527,8 +1093,21 @@ def handle_api_logout(values):
     delete_session(session_cookie)
     return True, ""
 
+def readings_accepted(collection, values_list):
+    """Called once readings have been stored, or queued to be, and for readings other processes wrote to the database.
+    Keeps the latest reading cache current, sends the readings to stream subscribers, and checks them against the limits."""
+    g_latest_cache.update_many(collection, values_list)
+    g_stream_hub.publish_many(collection, values_list)
+    g_alert_engine.evaluate(collection, values_list)
+    if g_db_tailer is not None:
+        g_db_tailer.note(collection, values_list)
+
 def handle_api_update_status(values):
     """Called when an API request to update the status of a sensor is received."""
+    # Batched updates are handled separately.
+    if PARAM_READINGS in values:
+        return handle_api_update_status_batch(values)
+
     # Required parameters.
     if PARAM_COLLECTION not in values:
         raise ApiAuthenticationException("Collection not specified.")
@@ -543,26 +1122,114 @@ def handle_api_update_status(values):
     # What are we updating?
     collection = values[PARAM_COLLECTION]
     del values[PARAM_COLLECTION] # Remove this as there's no reason to store it.
+    if collection not in database.WRITABLE_STATUS_COLLECTIONS:
+        raise ApiMalformedRequestException("Unknown collection.") # Checked here, since in write-behind mode it isn't written until later
 
     # Was a timestamp provided? If not, add one.
     if not PARAM_TIMESTAMP in values:
         values[PARAM_TIMESTAMP] = time.time()
 
+    # In write-behind mode the reading is written later, by the queue's thread.
+    if g_write_behind_queue is not None:
+        if not g_write_behind_queue.put(collection, values):
+            raise ApiServiceUnavailableException("Ingest queue is full.")
+        readings_accepted(collection, [ values ])
+        return True, ""
+
     # Connect to the database.
     db = connect_to_db()
 
     # Add to the database.
-    db.create_status(collection, values)
+    if db.create_status(collection, values):
+        readings_accepted(collection, [ values ])
 
     return True, ""
 
+def validate_status_reading(reading, default_collection, now):
+    """Checks one reading from a batched status update. Returns the collection name and the values to store."""
+    if not isinstance(reading, dict):
+        raise ApiMalformedRequestException("Reading is not an object.")
+
+    # Credentials are only accepted at the top level of the request, and are never stored.
+    values = dict(reading)
+    values.pop(PARAM_API_KEY, None)
+    values.pop(PARAM_SESSION_COOKIE, None)
+
+    # Which collection does this reading go in?
+    collection = values.pop(PARAM_COLLECTION, default_collection)
+    if collection is None:
+        raise ApiMalformedRequestException("Collection not specified.")
+    if collection not in database.WRITABLE_STATUS_COLLECTIONS:
+        raise ApiMalformedRequestException("Unknown collection.")
+
+    # Was a timestamp provided? If not, add one.
+    if PARAM_TIMESTAMP in values:
+        if isinstance(values[PARAM_TIMESTAMP], bool) or not isinstance(values[PARAM_TIMESTAMP], (int, float)):
+            raise ApiMalformedRequestException("Invalid timestamp.")
+    else:
+        values[PARAM_TIMESTAMP] = now
+
+    return collection, values
+
+def handle_api_update_status_batch(values):
+    """Called when an API request containing a list of sensor readings is received. The readings may span several
+    collections. The request is authenticated once, each reading is validated, and the valid ones are written with
+    one insert per collection. Returns a result for each reading, in the order they were received."""
+    readings = values[PARAM_READINGS]
+    if not isinstance(readings, list):
+        raise ApiMalformedRequestException("Readings must be a list.")
+    if len(readings) > MAX_READINGS_PER_BATCH:
+        raise ApiMalformedRequestException("Too many readings.")
+
+    # Validate the session cookie or API key.
+    _, _ = common_auth_check(values)
+
+    # Validate each reading and group the good ones by collection.
+    default_collection = values.get(PARAM_COLLECTION)
+    now = time.time()
+    results = [ None ] * len(readings)
+    batches = {}
+    for index, reading in enumerate(readings):
+        try:
+            collection, reading_values = validate_status_reading(reading, default_collection, now)
+            batches.setdefault(collection, []).append((index, reading_values))
+        except ApiException as e:
+            results[index] = { "index": index, "status": "error", "message": e.message }
+
+    # In write-behind mode the readings are written later, by the queue's thread.
+    if g_write_behind_queue is not None:
+        for collection, batch in batches.items():
+            for index, reading_values in batch:
+                if g_write_behind_queue.put(collection, reading_values):
+                    readings_accepted(collection, [ reading_values ])
+                    results[index] = { "index": index, "status": "queued" }
+                else:
+                    results[index] = { "index": index, "status": "error", "message": "Ingest queue is full." }
+        return True, json.dumps(results)
+
+    # Connect to the database.
+    db = connect_to_db()
+
+    # Add to the database, one round trip per collection.
+    for collection, batch in batches.items():
+        values_list = [ reading_values for _, reading_values in batch ]
+        if db.create_statuses(collection, values_list):
+            readings_accepted(collection, values_list)
+            for index, _ in batch:
+                results[index] = { "index": index, "status": "ok" }
+        else:
+            for index, _ in batch:
+                results[index] = { "index": index, "status": "error", "message": "Database error." }
+
+    return True, json.dumps(results)
+
 def latest_scale_reading(db):
-    """Returns the latest scale reading."""
+    """Returns the latest scale reading, from the cache."""
     ten_minutes_ago = time.time() - 600.0
-    recent_scale_readings = list(db.retrieve_keg_status(ten_minutes_ago))
-    if len(recent_scale_readings) == 0:
+    scale_reading = g_latest_cache.get(db, database.COLLECTION_KEG)
+    if scale_reading is None or scale_reading.get(PARAM_TIMESTAMP, 0) <= ten_minutes_ago:
         raise ApiMalformedRequestException("No scale readings within the last ten minutes.")
-    return recent_scale_readings[-1]
+    return scale_reading
 
 def handle_api_tare_scale(values):
     """Called when an API request to tare a scale is received."""
@@ -658,6 +1325,8 @@ def handle_api_full_scale(values):
             cal_rec[database.SCALE_CALIBRATION_WEIGHT_KEY],
             raw_value)
 
+    return True, ""
+
 def handle_api_create_api_key(values):
     """Called when an API request to create an API key is received."""
     # Validate the session cookie.
@@ -674,9 +1343,33 @@ def handle_api_create_api_key(values):
     db = connect_to_db()
 
     # Store it.
+    g_auth_cache.invalidate(auth_cache.KIND_API_KEY, api_key)
     db.create_api_key(api_key, expiry, user)
     return True, ""
 
+def handle_api_delete_api_key(values):
+    """Called when an API request to delete one of the user's API keys is received."""
+    # Validate the session cookie.
+    _, user = common_session_check(values)
+
+    # Required parameters.
+    if PARAM_KEY not in values:
+        raise ApiMalformedRequestException("Key not specified.")
+    api_key = str(values[PARAM_KEY])
+
+    # Connect to the database.
+    db = connect_to_db()
+
+    # Users can only delete their own keys.
+    if db.retrieve_api_key(api_key) != user:
+        raise ApiAuthenticationException("Not allowed.")
+
+    # Stop accepting the key immediately, rather than when its cache entry expires.
+    g_auth_cache.invalidate(auth_cache.KIND_API_KEY, api_key)
+    if not db.delete_api_key(api_key):
+        raise ApiMalformedRequestException("Failed to delete the key.")
+    return True, ""
+
 def handle_api_list_api_keys(values):
     """Called when an API request to list API keys is received."""
     # Validate the session cookie.
@@ -691,39 +1384,113 @@ def handle_api_list_api_keys(values):
     return True, keys
 
 def handle_api_limits_request(values):
-    """Called when an API request to list sensor limits is received."""
-    # Check for required parameters.
-    if PARAM_LIMITS_KEY not in values:
-        raise ApiAuthenticationException("Limits key not specified.")
-
+    """Called when an API request to list sensor limits is received. With a key, returns that sensor's limits,
+    otherwise returns every sensor's limits, keyed by sensor. Served from the limits cache."""
     # Validate the session cookie.
     _, user = common_session_check(values)
 
-    # Connect to the database.
-    db = connect_to_db()
-
-    # Query the database.
-    upper_limit, lower_limit = db.retrieve_sensor_limits(values[PARAM_LIMITS_KEY])
-    result = { 'upper_limit': upper_limit, 'lower_limit': lower_limit }
-
-    return True, result
+    # Look up the limits.
+    if PARAM_LIMITS_KEY in values:
+        lower_limit, upper_limit = g_limits_cache.get_one(values[PARAM_LIMITS_KEY])
+        result = { PARAM_UPPER_LIMIT: upper_limit, PARAM_LOWER_LIMIT: lower_limit }
+    else:
+        result = limits_to_dict(g_limits_cache.get())
+
+    return True, json.dumps(result)
+
+def parse_limits(key, limit_values):
+    """Validates one sensor's limits from a create_limits request. Returns (lower limit, upper limit)."""
+    if not isinstance(limit_values, dict) or PARAM_LOWER_LIMIT not in limit_values or PARAM_UPPER_LIMIT not in limit_values:
+        raise ApiMalformedRequestException("Limits for " + str(key) + " must have a lower_limit and an upper_limit.")
+    lower_limit = limits_cache.parse_limit_value(limit_values[PARAM_LOWER_LIMIT])
+    upper_limit = limits_cache.parse_limit_value(limit_values[PARAM_UPPER_LIMIT])
+    if lower_limit is None or upper_limit is None:
+        raise ApiMalformedRequestException("Limits for " + str(key) + " must be numbers.")
+    if lower_limit > upper_limit:
+        raise ApiMalformedRequestException("The lower limit for " + str(key) + " is above its upper limit.")
+    return lower_limit, upper_limit
 
 def handle_api_create_limits(values):
-    """Called when an API request to set sensor limits is received."""
+    """Called when an API request to set sensor limits is received. Takes either a single key with its lower_limit and
+    upper_limit, or 'limits', an object of key -> { lower_limit, upper_limit }. Every limit is validated before any are written."""
     # Validate the session cookie.
     _, user = common_session_check(values)
 
+    # Collect and validate the limits.
+    if PARAM_LIMITS in values:
+        if not isinstance(values[PARAM_LIMITS], dict) or len(values[PARAM_LIMITS]) == 0:
+            raise ApiMalformedRequestException("Invalid limits.")
+        limits = { str(key): parse_limits(key, limit_values) for key, limit_values in values[PARAM_LIMITS].items() }
+    elif PARAM_LIMITS_KEY in values:
+        limits = { str(values[PARAM_LIMITS_KEY]): parse_limits(values[PARAM_LIMITS_KEY], values) }
+    else:
+        raise ApiMalformedRequestException("Limits not specified.")
+
     # Connect to the database.
     db = connect_to_db()
 
-    # Remove any old entries.
-    db.delete_sensor_limits(values['key'])
-
     # Store.
-    db.create_sensor_limit(values['key'], values['upper_limit'], values['lower_limit'])
+    if not db.update_sensor_limits(limits):
+        raise ApiException(500, "Failed to store the limits.")
+    g_limits_cache.invalidate()
 
     return True, ""
 
+def handle_api_alerts_request(values):
+    """Called when an API request for the alerts raised by the sensor limits is received. Callers pass back the version
+    from the previous response as 'since' to get only the alerts that changed; with active=1 only the ones still active."""
+    # Validate the session cookie or API key.
+    _, _ = common_auth_check(values)
+
+    since_version = 0
+    if PARAM_SINCE in values:
+        try:
+            since_version = int(values[PARAM_SINCE])
+        except ValueError:
+            raise ApiMalformedRequestException("Invalid since.")
+    active_only = values.get(PARAM_ACTIVE) in [ "1", "true" ]
+
+    alert_list, version = g_alert_engine.list_alerts(since_version, active_only)
+    result = json.dumps({ "alerts": alert_list, "version": version })
+    return True, conditional_response(result, None, values, lambda: result)
+
+def handle_api_ingest_queue_status(values):
+    """Called when an API request for the write-behind queue counters is received."""
+    # Validate the session cookie.
+    _, _ = common_session_check(values)
+
+    if g_write_behind_queue is None:
+        return True, json.dumps({ "enabled": False })
+    result = g_write_behind_queue.stats()
+    result["enabled"] = True
+    return True, json.dumps(result)
+
+def handle_api_password_pool_status(values):
+    """Called when an API request for the password hashing counters is received."""
+    # Validate the session cookie.
+    _, _ = common_session_check(values)
+
+    return True, json.dumps(g_password_pool.stats())
+
+def handle_api_stream(values):
+    """Called when a request for the live readings stream reaches the main server. The stream is served from its own
+    port, so the client is redirected there, keeping the query string (collections, last_event_id)."""
+    if g_stream_server is None:
+        raise ApiServiceUnavailableException("The live readings stream is not enabled.")
+    url = g_stream_url
+    if url is None:
+        url = "%s://%s:%d%s" % (flask.request.scheme, flask.request.host.rsplit(":", 1)[0], g_stream_server.port, stream.STREAM_PATH)
+    if flask.request.query_string:
+        url = url + "?" + flask.request.query_string.decode('utf-8')
+    return True, flask.redirect(url, code=307)
+
+def handle_api_stream_status(values):
+    """Called when an API request for the live readings stream counters is received."""
+    # Validate the session cookie.
+    _, _ = common_session_check(values)
+
+    return True, json.dumps(g_stream_hub.stats())
+
 def handle_api_1_0_get_request(request, values):
     """Called to parse a version 1.0 API GET request."""
     if request == 'indoor_air':
@@ -738,10 +1505,26 @@ def handle_api_1_0_get_request(request, values):
         return handle_api_scale_calibration_request(values)
     if request == 'website_status':
         return handle_api_website_status(values)
+    if request == 'site_status':
+        return handle_api_site_status_request(values)
+    if request == 'site_percentiles':
+        return handle_api_site_percentiles_request(values)
     if request == 'list_api_keys':
         return handle_api_list_api_keys(values)
     if request == 'limits':
         return handle_api_limits_request(values)
+    if request == 'ingest_queue_status':
+        return handle_api_ingest_queue_status(values)
+    if request == 'password_pool_status':
+        return handle_api_password_pool_status(values)
+    if request == 'dashboard':
+        return handle_api_dashboard_request(values)
+    if request == 'alerts':
+        return handle_api_alerts_request(values)
+    if request == 'stream':
+        return handle_api_stream(values)
+    if request == 'stream_status':
+        return handle_api_stream_status(values)
     return False, ""
 
 def handle_api_1_0_post_request(request, values):
@@ -768,6 +1551,8 @@ def handle_api_1_0_post_request(request, values):
 
 def handle_api_1_0_delete_request(request, values):
     """Called to parse a version 1.0 API DELETE request."""
+    if request == 'delete_api_key':
+        return handle_api_delete_api_key(values)
     return False, ""
 
 def handle_api_request(verb, request, values):
@@ -801,15 +1586,24 @@ def api(version, method):
             verb = "GET"
             params = ""
 
-        # Process the API request.
+        # Process the API request. Only methods that exist are used as a metrics label, so a client can't create new ones at will.
+        # Unknown methods are never raised from, they're just not handled.
         if version == '1.0':
+            flask.g.api_method = method.lower()
             handled, response = handle_api_request(verb, method, params)
+            if not handled:
+                flask.g.api_method = METRICS_UNKNOWN_API_METHOD
+            if handled and isinstance(response, flask.Response):
+                return response # Already has its status code, e.g. 304 Not Modified
             if handled:
                 code = 200
             else:
                 code = 400
         else:
             code = 404
+    except ApiException as e:
+        response = e.message
+        code = e.code
     except:
         log_error(traceback.format_exc())
         log_error(sys.exc_info()[0])
@@ -819,7 +1613,20 @@ def api(version, method):
 
 def main():
     global g_flask_app
-    global g_db_uri
+    global g_db_manager
+    global g_write_behind_queue
+    global g_compaction_job
+    global g_response_compressor
+    global g_latest_cache
+    global g_auth_cache
+    global g_password_pool
+    global g_page_cache
+    global g_asset_manifest
+    global g_stream_server
+    global g_db_tailer
+    global g_alert_engine
+    global g_stream_url
+    global g_waitress_server
 
     # Configure the error logger.
     logging.basicConfig(filename=ERROR_LOG, filemode='w', level=logging.DEBUG, format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
@@ -833,23 +1640,142 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--host", type=str, action="store", default="localhost", help="The host interface on which to bind.", required=False)
     parser.add_argument("--port", type=int, action="store", default=5050, help="The host port on which to bind.", required=False)
-    parser.add_argument("--database", type=str, action="store", default="mongodb://localhost:27017", help="The URI for connecting to the database.", required=False)
+    parser.add_argument("--threads", type=int, action="store", default=DEFAULT_SERVER_THREADS, help="The number of threads serving requests.", required=False)
+    parser.add_argument("--database", type=str, action="store", default="mongodb://localhost:27017", help="The URI for connecting to the database, either mongodb://... or sqlite:///path.", required=False)
+    parser.add_argument("--db-pool-size", type=int, action="store", default=database.DEFAULT_POOL_SIZE, help="The maximum number of pooled database connections.", required=False)
+    parser.add_argument("--db-connect-timeout-ms", type=int, action="store", default=database.DEFAULT_CONNECT_TIMEOUT_MS, help="The database connection timeout, in milliseconds.", required=False)
+    parser.add_argument("--db-server-selection-timeout-ms", type=int, action="store", default=database.DEFAULT_SERVER_SELECTION_TIMEOUT_MS, help="How long to wait for a database server to become available, in milliseconds.", required=False)
+    parser.add_argument("--db-socket-timeout-ms", type=int, action="store", default=database.DEFAULT_SOCKET_TIMEOUT_MS, help="The database socket timeout, in milliseconds.", required=False)
+    parser.add_argument("--write-behind", action="store_true", default=False, help="Queue sensor readings in memory and write them to the database in groups, from a background thread.", required=False)
+    parser.add_argument("--write-behind-max-items", type=int, action="store", default=ingest_queue.DEFAULT_MAX_ITEMS, help="The number of readings the write-behind queue can hold before new readings are rejected.", required=False)
+    parser.add_argument("--write-behind-batch-size", type=int, action="store", default=ingest_queue.DEFAULT_BATCH_SIZE, help="The maximum number of readings written per group.", required=False)
+    parser.add_argument("--write-behind-flush-ms", type=int, action="store", default=ingest_queue.DEFAULT_FLUSH_INTERVAL_MS, help="How long a reading may wait in the queue before it is written, in milliseconds.", required=False)
+    parser.add_argument("--retention", type=str, action="append", default=[], help="Overrides the retention for a collection, as COLLECTION[:TIER]=DAYS where TIER is raw (the default), minute, hour, or day. Zero days means keep forever.", required=False)
+    parser.add_argument("--compaction-interval-mins", type=float, action="store", default=retention.DEFAULT_INTERVAL_MINS, help="How often to remove data that is past its retention period, in minutes. Zero disables compaction.", required=False)
+    parser.add_argument("--gzip-level", type=int, action="store", default=compression.DEFAULT_GZIP_LEVEL, help="The gzip level (1-9) used to compress responses. Zero disables gzip.", required=False)
+    parser.add_argument("--brotli-quality", type=int, action="store", default=compression.DEFAULT_BROTLI_QUALITY, help="The brotli quality (1-11) used to compress responses. Zero disables brotli.", required=False)
+    parser.add_argument("--compress-min-bytes", type=int, action="store", default=compression.DEFAULT_MIN_SIZE, help="Responses smaller than this are not compressed.", required=False)
+    parser.add_argument("--latest-cache-max-age-secs", type=float, action="store", default=latest_cache.DEFAULT_MAX_AGE_SECS, help="How long a cached latest reading is trusted before it is reloaded, to pick up readings written by other processes.", required=False)
+    parser.add_argument("--password-workers", type=int, action="store", default=password_pool.DEFAULT_WORKERS, help="The number of processes used to hash passwords. Zero hashes on the request thread.", required=False)
+    parser.add_argument("--password-max-pending", type=int, action="store", default=None, help="The number of password hashing requests that may run or wait at once before new ones are rejected with 503. Must be less than --threads. Defaults to the number of workers plus " + str(password_pool.DEFAULT_MAX_QUEUED) + ".", required=False)
+    parser.add_argument("--bcrypt-rounds", type=int, action="store", default=password_pool.DEFAULT_ROUNDS, help="The bcrypt work factor for new password hashes.", required=False)
+    parser.add_argument("--auth-cache-size", type=int, action="store", default=auth_cache.DEFAULT_MAX_ENTRIES, help="The number of API keys and sessions to cache. Zero disables the cache.", required=False)
+    parser.add_argument("--auth-cache-ttl-secs", type=float, action="store", default=auth_cache.DEFAULT_TTL_SECS, help="How long a valid API key or session is cached.", required=False)
+    parser.add_argument("--auth-cache-negative-ttl-secs", type=float, action="store", default=auth_cache.DEFAULT_NEGATIVE_TTL_SECS, help="How long an unknown API key or session is cached.", required=False)
+    parser.add_argument("--stream-port", type=int, action="store", default=0, help="The port on which to serve the live readings stream. Zero disables the stream.", required=False)
+    parser.add_argument("--stream-url", type=str, action="store", default=None, help="The public URL of the live readings stream, if it isn't this host on the stream port (e.g. behind a proxy).", required=False)
+    parser.add_argument("--stream-max-subscribers", type=int, action="store", default=stream.DEFAULT_MAX_SUBSCRIBERS, help="The number of clients that may subscribe to the live readings stream at once.", required=False)
+    parser.add_argument("--stream-heartbeat-secs", type=float, action="store", default=stream.DEFAULT_HEARTBEAT_SECS, help="How often idle stream connections are sent a heartbeat.", required=False)
+    parser.add_argument("--tail", type=str, action="append", default=None, help="A collection whose readings are written to the database directly, rather than through this server, and so must be polled for the stream and the alerts. Defaults to " + database.COLLECTION_INDOOR_AIR_QUALITY + ".", required=False)
+    parser.add_argument("--tail-secs", type=float, action="store", default=tailer.DEFAULT_INTERVAL_SECS, help="How often to poll for readings written directly to the database.", required=False)
+    parser.add_argument("--alert-hysteresis-pct", type=float, action="store", default=alerts.DEFAULT_HYSTERESIS_FRACTION * 100.0, help="How far back inside its limits, as a percentage of the limit range, a value must come before its alert clears.", required=False)
+    parser.add_argument("--dev-mode", action="store_true", default=False, help="Render pages again when their templates change, instead of caching them for the life of the process, and don't use fingerprinted static files.", required=False)
+    parser.add_argument("--skip-migrations", action="store_true", default=False, help="Do not create indexes or apply schema migrations on startup.", required=False)
 
     try:
         args = parser.parse_args()
-    except IOError as e:
+        retention_policy = retention.default_policy()
+        for retention_arg in args.retention:
+            retention.parse_retention_arg(retention_policy, retention_arg)
+
+        # Each password request holds a server thread while it runs or waits, so some threads must always be left for everything else.
+        if args.password_max_pending is None:
+            args.password_max_pending = password_pool.default_max_pending(args.password_workers)
+        if args.password_max_pending >= args.threads:
+            raise ValueError("--password-max-pending (%d) must be less than --threads (%d)." % (args.password_max_pending, args.threads))
+    except (IOError, ValueError) as e:
         parser.error(e)
         sys.exit(1)
 
-    # Register the signal handler.
+    # Register the signal handlers.
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
 
     # Cleanup the arguments.
     if len(args.host) == 0:
         args.host = "localhost"
 
-    # Make a note of the database URI.
-    g_db_uri = args.database
+    # Configure the shared database connection pool.
+    g_db_manager.configure(args.database,
+        pool_size=args.db_pool_size,
+        connect_timeout_ms=args.db_connect_timeout_ms,
+        server_selection_timeout_ms=args.db_server_selection_timeout_ms,
+        socket_timeout_ms=args.db_socket_timeout_ms)
+
+    # Configure response compression.
+    g_response_compressor = compression.ResponseCompressor(gzip_level=args.gzip_level, brotli_quality=args.brotli_quality, min_size=args.compress_min_bytes)
+
+    # Bring the database schema (indexes, etc.) up to date.
+    if not args.skip_migrations:
+        try:
+            schema_version = schema.upgrade(connect_to_db())
+            log_info("Database schema is at version %d." % schema_version)
+        except:
+            log_error(traceback.format_exc())
+            log_error("Schema migration failed, continuing with the existing schema.")
+
+    # Start the password hashing workers.
+    g_password_pool = password_pool.PasswordPool(workers=args.password_workers, max_pending=args.password_max_pending, rounds=args.bcrypt_rounds)
+    g_password_pool.start()
+
+    # Configure the authentication cache.
+    g_auth_cache = auth_cache.AuthCache(max_entries=args.auth_cache_size, ttl_secs=args.auth_cache_ttl_secs, negative_ttl_secs=args.auth_cache_negative_ttl_secs)
+
+    # Load the latest readings, so requests for them don't need the database.
+    g_latest_cache = latest_cache.LatestReadingCache(max_age_secs=args.latest_cache_max_age_secs)
+    try:
+        g_latest_cache.prime(connect_to_db(), database.SENSOR_COLLECTIONS)
+    except:
+        log_error(traceback.format_exc())
+        log_error("Could not load the latest readings, they will be loaded when requested.")
+
+    # Start the write-behind queue, if requested.
+    if args.write_behind:
+        g_write_behind_queue = ingest_queue.WriteBehindQueue(connect_to_db,
+            max_items=args.write_behind_max_items,
+            batch_size=args.write_behind_batch_size,
+            flush_interval_ms=args.write_behind_flush_ms)
+        g_write_behind_queue.start()
+
+    # Start the job that removes data that is past its retention period.
+    if args.compaction_interval_mins > 0:
+        g_compaction_job = retention.CompactionJob(connect_to_db, retention_policy, interval_mins=args.compaction_interval_mins)
+        g_compaction_job.start()
+
+    # Start the live readings stream, if requested.
+    if args.stream_port > 0:
+        g_stream_server = stream.StreamServer(g_stream_hub, args.host, args.stream_port, database.SENSOR_COLLECTIONS,
+            max_subscribers=args.stream_max_subscribers,
+            heartbeat_secs=args.stream_heartbeat_secs)
+        g_stream_server.start()
+        g_stream_url = args.stream_url
+
+    # Alerts are raised as readings arrive.
+    g_alert_engine = alerts.AlertEngine(g_limits_cache.get, hysteresis_fraction=args.alert_hysteresis_pct / 100.0)
+
+    # Readings written straight to the database still need to reach the stream and the alerts.
+    tailed_collections = args.tail if args.tail is not None else [ database.COLLECTION_INDOOR_AIR_QUALITY ]
+    tailed_collections = [ collection for collection in tailed_collections if collection in database.SENSOR_COLLECTIONS ]
+    if len(tailed_collections) > 0:
+        is_needed_func = lambda: g_stream_hub.num_subscribers > 0 or g_alert_engine.has_rules()
+        g_db_tailer = tailer.DatabaseTailer(connect_to_db, tailed_collections, readings_accepted, is_needed_func, interval_secs=args.tail_secs)
+        g_db_tailer.start()
+
+    # Point the pages at the fingerprinted static files. In development mode the files are expected to change, so they aren't used.
+    if not args.dev_mode:
+        try:
+            g_asset_manifest = assets.AssetManifest.load(g_root_dir or ".", g_root_url)
+        except:
+            log_error(traceback.format_exc())
+            log_error("Could not load the static file manifest, serving the original files.")
+
+    # Compile the page templates now, rather than on the first request for each.
+    g_page_cache = page_cache.PageCache(os.path.join(g_root_dir, HTML_DIR), os.path.join(g_tempmod_dir, HTML_DIR), dev_mode=args.dev_mode)
+    try:
+        g_page_cache.compile(PAGE_TEMPLATES)
+    except:
+        log_error(traceback.format_exc())
+        log_error("Could not compile the page templates, they will be compiled when requested.")
 
     # Random secret key.
     g_flask_app.secret_key = os.urandom(12).hex()
@@ -857,7 +1783,13 @@ def main():
     # Create the app object. It contains all the functionality.
     print(f"The app is running on http://{args.host}:{args.port}")
     #g_flask_app.run(host=args.host, port=args.port)
-    waitress.serve(g_flask_app, host=args.host, port=args.port)
+    try:
+        # Same as waitress.serve, but keeps the server so the metrics can see its queue.
+        g_waitress_server = waitress.create_server(g_flask_app, host=args.host, port=args.port, threads=args.threads)
+        g_waitress_server.print_listen("Serving on http://{}:{}")
+        g_waitress_server.run()
+    finally:
+        shutdown()
 
 if __name__=="__main__":
     main()
@@ -23,11 +23,18 @@
 # SOFTWARE.
 """Database base classes"""
 
+import datetime
+import json
 import logging
+import metrics
 import os
 import pymongo
+import rollups
+import site_status
 import sqlite3
 import sys
+import threading
+import time
 import traceback
 from bson.objectid import ObjectId
 
@@ -41,6 +48,7 @@ HASH_KEY = "hash" # Password hash
 SESSION_COOKIE_KEY = "cookie"
 SESSION_USER_KEY = "user"
 SESSION_EXPIRY_KEY = "expiry"
+SESSION_EXPIRES_AT_KEY = "expires_at" # Expiry as a date, so the database can expire the session on its own
 
 # Keys associated with scale calibration.
 SCALE_NAME_KEY = "name"
@@ -60,13 +68,74 @@ COLLECTION_PATIO_MONITOR = "patio_monitor"
 COLLECTION_AC = "ac"
 COLLECTION_KEG = "keg"
 COLLECTION_WEBSITE_STATUS = "website_status"
+COLLECTION_SITE_STATUS = "site_status" # The website status readings, split into a row per site
 COLLECTION_LIMITS = "limits"
+COLLECTION_SCHEMA_VERSION = "schema_version"
+COLLECTION_ROLLUP_STATE = "rollup_state"
+
+# Keys associated with the schema version.
+SCHEMA_VERSION_DOC_ID = "schema"
+SCHEMA_VERSION_KEY = "version"
+SCHEMA_HISTORY_KEY = "history"
+SCHEMA_DESCRIPTION_KEY = "description"
+SCHEMA_APPLIED_TS_KEY = "applied_ts"
+
+# Collections that store time series sensor readings.
+SENSOR_COLLECTIONS = [ COLLECTION_INDOOR_AIR_QUALITY, COLLECTION_PATIO_MONITOR, COLLECTION_AC, COLLECTION_KEG, COLLECTION_WEBSITE_STATUS ]
+
+# Sensor collections that can be written through create_status.
+WRITABLE_STATUS_COLLECTIONS = [ COLLECTION_INDOOR_AIR_QUALITY, COLLECTION_PATIO_MONITOR, COLLECTION_AC, COLLECTION_KEG, COLLECTION_WEBSITE_STATUS ]
+
+# Sensor collections that have minute, hour, and day rollups. Website status readings are nested, per-site, objects so they're excluded.
+ROLLUP_COLLECTIONS = [ COLLECTION_INDOOR_AIR_QUALITY, COLLECTION_PATIO_MONITOR, COLLECTION_AC, COLLECTION_KEG ]
+
+# Keys associated with the rollup state, i.e. how much of the raw history has been summarized.
+ROLLUP_STATE_EPOCH_KEY = "epoch" # Readings from before this time were not summarized when they were received
+ROLLUP_STATE_BACKFILLED_TO_KEY = "backfilled_to" # Readings from before the epoch, but after this time, have since been summarized
 
 # Keys associated with API key management.
 API_KEY = "key"
 API_EXPIRY_KEY = "expiry"
 API_USER_KEY = "user"
 
+# Database URLs starting with this are SQLite files, everything else is MongoDB.
+SQLITE_URL_PREFIX = "sqlite:///"
+
+# Number of compiled statements each SQLite connection keeps around.
+SQLITE_STATEMENT_CACHE_SIZE = 64
+
+# Rough per-row cost of the id, timestamp, and b-tree bookkeeping, used when estimating the space used by a row.
+SQLITE_ROW_OVERHEAD_BYTES = 24
+STATUS_CURSOR_BATCH_SIZE = 1000 # Number of readings fetched per round trip when iterating over a series
+
+# Name of the database the readings and accounts are stored in.
+DEFAULT_DATABASE_NAME = "statusdb"
+
+# Connection pool defaults.
+DEFAULT_POOL_SIZE = 16
+DEFAULT_MIN_POOL_SIZE = 1
+DEFAULT_CONNECT_TIMEOUT_MS = 5000
+DEFAULT_SERVER_SELECTION_TIMEOUT_MS = 5000
+DEFAULT_SOCKET_TIMEOUT_MS = 30000
+
+# Metrics.
+READINGS_INGESTED = metrics.REGISTRY.counter("dashboard_readings_ingested_total", "Sensor readings stored, by collection.", [ "collection" ])
+MONGO_COMMAND_SECONDS = metrics.REGISTRY.histogram("dashboard_mongo_command_seconds", "Time taken by MongoDB commands, by command.", [ "command" ])
+MONGO_COMMAND_FAILURES = metrics.REGISTRY.counter("dashboard_mongo_command_failures_total", "MongoDB commands that failed, by command.", [ "command" ])
+
+class MongoCommandMetrics(pymongo.monitoring.CommandListener):
+    """Times every command the Mongo client sends, using the durations the driver measures anyway."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1000000.0, (event.command_name,))
+
+    def failed(self, event):
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1000000.0, (event.command_name,))
+        MONGO_COMMAND_FAILURES.inc((event.command_name,))
+
 class DatabaseException(Exception):
     """Exception thrown by the database."""
 
@@ -136,6 +205,16 @@ class SqliteDatabase(Database):
                 con.close()
         return None
 
+def is_sqlite_url(database_url):
+    """Returns True if the database URL refers to a SQLite file."""
+    return database_url is not None and database_url.startswith(SQLITE_URL_PREFIX)
+
+def create_database(database_url):
+    """Returns an (unconnected) database object of the type needed for the given URL."""
+    if is_sqlite_url(database_url):
+        return AppSqliteDatabase()
+    return AppMongoDatabase()
+
 def insert_into_collection(collection, doc):
     """Handles differences in document insertion between pymongo 3 and 4."""
     if int(pymongo.__version__[0]) < 4:
@@ -155,22 +234,114 @@ def update_collection(collection, doc):
         result = collection.update_one(query, new_values)
         return result.matched_count > 0 
 
+def mongo_status_filter(min_ts, end_ts):
+    """Returns the Mongo filter for readings with min_ts < ts < end_ts. Either bound may be omitted."""
+    ts_filter = {}
+    if min_ts > 0:
+        ts_filter["$gt"] = min_ts
+    if end_ts is not None:
+        ts_filter["$lt"] = end_ts
+    if len(ts_filter) == 0:
+        return {}
+    return { "ts": ts_filter }
+
+def sqlite_status_where(min_ts, end_ts, after=None):
+    """Returns the WHERE clause, and its parameters, for readings with min_ts < ts < end_ts that sort after
+    the (ts, id) key. Either bound, and the key, may be omitted."""
+    clauses = []
+    params = []
+    if min_ts > 0:
+        clauses.append("ts > ?")
+        params.append(min_ts)
+    if end_ts is not None:
+        clauses.append("ts < ?")
+        params.append(end_ts)
+    if after is not None:
+        clauses.append("(ts > ? OR (ts = ? AND id > ?))")
+        params.extend([ after[0], after[0], after[1] ])
+    if len(clauses) == 0:
+        return "", params
+    return " WHERE " + " AND ".join(clauses), params
+
+def sqlite_site_status_value(status):
+    """SQLite can store a site's status as is if it's a number or a string, anything else is stored as JSON."""
+    if status is None or isinstance(status, (int, float, str)):
+        return status
+    return json.dumps(status)
+
+def status_projection(fields):
+    """Returns the Mongo projection for reading a series, limited to the timestamp and the given fields if there are any."""
+    projection = { DATABASE_ID_KEY: 0 }
+    if fields is not None:
+        projection["ts"] = 1
+        for field in fields:
+            projection[field] = 1
+    return projection
+
+def rollup_projection(fields):
+    """Returns the Mongo projection for reading rollups, limited to the given fields if there are any."""
+    projection = { DATABASE_ID_KEY: 0 }
+    if fields is not None:
+        projection[rollups.ROLLUP_TS_KEY] = 1
+        projection[rollups.ROLLUP_COUNT_KEY] = 1
+        for field in fields:
+            projection[rollups.ROLLUP_FIELDS_KEY + "." + field] = 1
+    return projection
+
+def select_fields(values, fields):
+    """Returns the timestamp and the given fields from a reading, or the whole reading if no fields were given."""
+    if fields is None:
+        return values
+    return { key: values[key] for key in [ "ts" ] + fields if key in values }
+
+def mongo_rollup_update(rollup):
+    """Converts a partial rollup document into an update that merges it into the stored one. The indoor air quality
+    client builds the same update for its readings; keep the two identical."""
+    increments = { rollups.ROLLUP_COUNT_KEY: rollup[rollups.ROLLUP_COUNT_KEY] }
+    minimums = {}
+    maximums = {}
+    for key, summary in rollup[rollups.ROLLUP_FIELDS_KEY].items():
+        prefix = rollups.ROLLUP_FIELDS_KEY + "." + key + "."
+        increments[prefix + rollups.ROLLUP_SUM_KEY] = summary[rollups.ROLLUP_SUM_KEY]
+        increments[prefix + rollups.ROLLUP_COUNT_KEY] = summary[rollups.ROLLUP_COUNT_KEY]
+        minimums[prefix + rollups.ROLLUP_MIN_KEY] = summary[rollups.ROLLUP_MIN_KEY]
+        maximums[prefix + rollups.ROLLUP_MAX_KEY] = summary[rollups.ROLLUP_MAX_KEY]
+        maximums[prefix + rollups.ROLLUP_LAST_KEY] = summary[rollups.ROLLUP_LAST_KEY] # Compared by ts first, so the latest value wins
+    update = { "$inc": increments }
+    if len(minimums) > 0:
+        update["$min"] = minimums
+        update["$max"] = maximums
+    return update
+
 class AppMongoDatabase(Database):
     """Mongo DB implementation of the application database."""
 
     def __init__(self):
+        self.conn = None
+        self.rollup_backfilled_to = {} # Cached rollup state, collection name -> backfilled_to
         Database.__init__(self)
 
-    def connect(self, database_url):
+    def connect(self, database_url,
+                pool_size=DEFAULT_POOL_SIZE,
+                connect_timeout_ms=DEFAULT_CONNECT_TIMEOUT_MS,
+                server_selection_timeout_ms=DEFAULT_SERVER_SELECTION_TIMEOUT_MS,
+                socket_timeout_ms=DEFAULT_SOCKET_TIMEOUT_MS):
         """Connects/creates the database."""
         try:
-            # Connect to the database server.
-            self.conn = pymongo.MongoClient(database_url)
+            # Connect to the database server. The client is thread safe and maintains its own connection pool,
+            # so a single instance should be shared by the whole process.
+            self.conn = pymongo.MongoClient(database_url,
+                maxPoolSize=pool_size,
+                minPoolSize=min(DEFAULT_MIN_POOL_SIZE, pool_size),
+                connectTimeoutMS=connect_timeout_ms,
+                serverSelectionTimeoutMS=server_selection_timeout_ms,
+                socketTimeoutMS=socket_timeout_ms,
+                event_listeners=[ MongoCommandMetrics() ])
             if self.conn is None:
                 raise DatabaseException("Could not connect to MongoDB.")
 
-            # Get a handle to the database.
-            self.database = self.conn['statusdb']
+            # Get a handle to the database. Always the same name, whatever the URL says, since the collectors write to it by name.
+            self.database = self.conn[DEFAULT_DATABASE_NAME]
             if self.database is None:
                 raise DatabaseException("Could not connect to MongoDB.")
 
@@ -185,9 +356,36 @@ class AppMongoDatabase(Database):
             self.ac_monitor = self.database[COLLECTION_AC]
             self.keg = self.database[COLLECTION_KEG]
             self.website_status = self.database[COLLECTION_WEBSITE_STATUS]
+            self.site_status = self.database[COLLECTION_SITE_STATUS]
+            self.schema_version_collection = self.database[COLLECTION_SCHEMA_VERSION]
+            self.rollup_state_collection = self.database[COLLECTION_ROLLUP_STATE]
         except pymongo.errors.ConnectionFailure as e:
             raise DatabaseException("Could not connect to MongoDB: %s" % e)
 
+    def close(self):
+        """Closes the connection pool and stops the client's monitoring threads."""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    #
+    # Schema version methods
+    #
+
+    def retrieve_schema_version(self):
+        """Returns the schema version recorded in the database, zero if nothing has been applied."""
+        doc = self.schema_version_collection.find_one({ DATABASE_ID_KEY: SCHEMA_VERSION_DOC_ID })
+        if doc is None:
+            return 0
+        return doc.get(SCHEMA_VERSION_KEY, 0)
+
+    def update_schema_version(self, version, description):
+        """Records that the schema migration with the given version has been applied."""
+        history_item = { SCHEMA_VERSION_KEY: version, SCHEMA_DESCRIPTION_KEY: description, SCHEMA_APPLIED_TS_KEY: time.time() }
+        self.schema_version_collection.update_one({ DATABASE_ID_KEY: SCHEMA_VERSION_DOC_ID },
+            { "$set": { SCHEMA_VERSION_KEY: version }, "$push": { SCHEMA_HISTORY_KEY: history_item } },
+            upsert=True)
+
     #
     # User management methods
     #
@@ -330,7 +528,8 @@ class AppMongoDatabase(Database):
             raise Exception("Unexpected empty object: expiry")
 
         try:
-            post = { SESSION_COOKIE_KEY: cookie, SESSION_USER_KEY: user, SESSION_EXPIRY_KEY: expiry }
+            expires_at = datetime.datetime.fromtimestamp(expiry, tz=datetime.timezone.utc)
+            post = { SESSION_COOKIE_KEY: cookie, SESSION_USER_KEY: user, SESSION_EXPIRY_KEY: expiry, SESSION_EXPIRES_AT_KEY: expires_at }
             return insert_into_collection(self.sessions_collection, post)
         except:
             self.log_error(traceback.format_exc())
@@ -338,7 +537,7 @@ class AppMongoDatabase(Database):
         return False
 
     def retrieve_session_data(self, cookie):
-        """Retrieve method for session data."""
+        """Retrieve method for session data. Returns (None, None) if there is no such session, raises DatabaseException if the lookup failed."""
         if cookie is None:
             raise Exception("Unexpected empty object: cookie")
 
@@ -346,10 +545,11 @@ class AppMongoDatabase(Database):
             session_data = self.sessions_collection.find_one({ SESSION_COOKIE_KEY: cookie })
             if session_data is not None:
                 return session_data[SESSION_USER_KEY], session_data[SESSION_EXPIRY_KEY]
+            return (None, None)
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
-        return (None, None)
+            raise DatabaseException("Lookup failed.")
 
     def delete_session_cookie(self, cookie):
         """Delete method for a session cookie."""
@@ -387,7 +587,7 @@ class AppMongoDatabase(Database):
         return False
 
     def retrieve_api_key(self, key):
-        """Retrieve method for data associated with an API key."""
+        """Retrieve method for data associated with an API key. Returns None if there is no such key, raises DatabaseException if the lookup failed."""
         if key is None:
             raise Exception("Unexpected empty object: key")
 
@@ -395,10 +595,11 @@ class AppMongoDatabase(Database):
             api_key = self.api_keys_collection.find_one({ API_KEY: key })
             if api_key is not None:
                 return api_key[API_USER_KEY]
+            return None
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
-        return None
+            raise DatabaseException("Lookup failed.")
 
     def retrieve_api_keys(self, user):
         """Retrieve method for API keys associated with a specific user."""
@@ -455,7 +656,7 @@ class AppMongoDatabase(Database):
             raise Exception("Unexpected empty object: key")
 
         try:
-            limits_result = self.limits_collection.find_one({ "key": key }, {})
+            limits_result = self.limits_collection.find_one({ "key": key }, { "_id": 0, "lower_limit": 1, "upper_limit": 1 })
             if limits_result is not None:
                 return limits_result["lower_limit"], limits_result["upper_limit"]
         except:
@@ -463,6 +664,30 @@ class AppMongoDatabase(Database):
             self.log_error(sys.exc_info()[0])
         return None, None
 
+    def retrieve_all_sensor_limits(self):
+        """Retrieve method for every sensor's limits, as a dictionary of key -> (lower limit, upper limit)."""
+        limits = {}
+        for limits_result in self.limits_collection.find({}, { "_id": 0, "key": 1, "lower_limit": 1, "upper_limit": 1 }):
+            limits[limits_result["key"]] = (limits_result.get("lower_limit"), limits_result.get("upper_limit"))
+        return limits
+
+    def update_sensor_limits(self, limits):
+        """Upsert method for sensor limits, given as a dictionary of key -> (lower limit, upper limit). Every key is written in one round trip."""
+        if limits is None:
+            raise Exception("Unexpected empty object: limits")
+
+        try:
+            requests = []
+            for key, (lower_limit, upper_limit) in limits.items():
+                requests.append(pymongo.UpdateOne({ "key": str(key) }, { "$set": { "lower_limit": lower_limit, "upper_limit": upper_limit } }, upsert=True))
+            if len(requests) > 0:
+                self.limits_collection.bulk_write(requests, ordered=False)
+            return True
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
     def delete_sensor_limits(self, key):
         """Delete method for a user."""
         if key is None:
@@ -489,31 +714,251 @@ class AppMongoDatabase(Database):
             raise Exception("Unexpected empty object: values")
 
         try:
-            if collection_name == COLLECTION_PATIO_MONITOR:
-                return insert_into_collection(self.patio_monitor, values)
-            if collection_name == COLLECTION_AC:
-                return insert_into_collection(self.ac_monitor, values)
-            if collection_name == COLLECTION_KEG:
-                return insert_into_collection(self.keg, values)
+            collection = self.status_collection(collection_name)
+            if collection is None:
+                raise Exception("Unknown collection")
+            if not insert_into_collection(collection, values):
+                return False
+            READINGS_INGESTED.inc((collection_name,))
+            self.update_rollups(collection_name, self.readings_to_summarize(collection_name, [ values ]))
+            if collection_name == COLLECTION_WEBSITE_STATUS:
+                return self.create_site_statuses([ values ])
+            return True
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    def create_statuses(self, collection_name, values_list):
+        """Create method for a batch of statuses, all destined for the same collection."""
+        if collection_name is None:
+            raise Exception("Unexpected empty object: collection_name")
+        if values_list is None:
+            raise Exception("Unexpected empty object: values_list")
+        if len(values_list) == 0:
+            return True
+
+        try:
+            collection = self.status_collection(collection_name)
+            if collection is None:
+                raise Exception("Unknown collection")
+            result = collection.insert_many(values_list, ordered=False)
+            if result is None or len(result.inserted_ids) != len(values_list):
+                return False
+            READINGS_INGESTED.inc((collection_name,), len(values_list))
+            self.update_rollups(collection_name, self.readings_to_summarize(collection_name, values_list))
             if collection_name == COLLECTION_WEBSITE_STATUS:
-                return insert_into_collection(self.website_status, values)
+                return self.create_site_statuses(values_list)
+            return True
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    def status_collection(self, collection_name):
+        """Returns the handle to the writable status collection with the given name, or None if there isn't one."""
+        if collection_name == COLLECTION_INDOOR_AIR_QUALITY:
+            return self.indoor_air_quality
+        if collection_name == COLLECTION_PATIO_MONITOR:
+            return self.patio_monitor
+        if collection_name == COLLECTION_AC:
+            return self.ac_monitor
+        if collection_name == COLLECTION_KEG:
+            return self.keg
+        if collection_name == COLLECTION_WEBSITE_STATUS:
+            return self.website_status
+        return None
+
+    def retrieve_status_range(self, collection_name, start_ts, end_ts):
+        """Retrieve method for the readings in a sensor collection with start_ts <= ts < end_ts, oldest first."""
+        if collection_name not in SENSOR_COLLECTIONS:
+            raise Exception("Unknown collection")
+        query = { "ts": { "$gte": start_ts, "$lt": end_ts } }
+        return list(self.database[collection_name].find(query, { "_id": 0 }).sort("ts", pymongo.ASCENDING))
+
+    def retrieve_status_page(self, collection_name, min_ts, end_ts, fields, limit, after):
+        """Returns up to limit readings with min_ts < ts < end_ts, in (ts, _id) order, starting after the given (ts, id) key.
+        Also returns the key to continue from, or None if this is the last page."""
+        if collection_name not in SENSOR_COLLECTIONS:
+            raise Exception("Unknown collection")
+        filter = mongo_status_filter(min_ts, end_ts)
+        if after is not None:
+            try:
+                after_id = ObjectId(str(after[1]))
+            except Exception:
+                raise ValueError("Invalid key")
+            after_filter = { "$or": [ { "ts": { "$gt": after[0] } }, { "ts": after[0], DATABASE_ID_KEY: { "$gt": after_id } } ] }
+            filter = { "$and": [ filter, after_filter ] }
+        projection = None
+        if fields is not None:
+            projection = status_projection(fields)
+            projection[DATABASE_ID_KEY] = 1
+        cursor = self.database[collection_name].find(filter, projection).sort([ ("ts", pymongo.ASCENDING), (DATABASE_ID_KEY, pymongo.ASCENDING) ]).limit(limit + 1)
+        docs = list(cursor)
+        next_key = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_key = [ docs[-1]["ts"], str(docs[-1][DATABASE_ID_KEY]) ]
+        for doc in docs:
+            del doc[DATABASE_ID_KEY]
+        return docs, next_key
+
+    def retrieve_latest_status(self, collection_name):
+        """Retrieve method for the most recent reading in a sensor collection, None if it is empty."""
+        if collection_name not in SENSOR_COLLECTIONS:
+            raise Exception("Unknown collection")
+        return self.database[collection_name].find_one({}, { DATABASE_ID_KEY: 0 }, sort=[ ("ts", pymongo.DESCENDING) ])
+
+    def retrieve_status_validator(self, collection_name):
+        """Returns a cheap (latest timestamp, write marker) pair that changes whenever a reading is added to or removed from a
+        sensor collection. The marker catches late readings, which don't change the latest timestamp. Both are zero if the
+        collection is empty."""
+        if collection_name not in SENSOR_COLLECTIONS:
+            raise Exception("Unknown collection")
+        collection = self.database[collection_name]
+        latest = collection.find_one({}, { "_id": 0, "ts": 1 }, sort=[ ("ts", pymongo.DESCENDING) ])
+        if latest is None:
+            return 0, 0
+        return latest.get("ts", 0), collection.estimated_document_count()
+
+    def retrieve_oldest_status_ts(self, collection_name):
+        """Returns the timestamp of the oldest reading in a sensor collection, or None if it is empty."""
+        if collection_name not in SENSOR_COLLECTIONS:
+            raise Exception("Unknown collection")
+        oldest = self.database[collection_name].find_one({}, { "_id": 0, "ts": 1 }, sort=[ ("ts", pymongo.ASCENDING) ])
+        if oldest is None:
+            return None
+        return oldest.get("ts")
+
+    def count_statuses(self, collection_name, start_ts, end_ts):
+        """Returns the number of readings in a sensor collection with start_ts <= ts < end_ts."""
+        if collection_name not in SENSOR_COLLECTIONS:
+            raise Exception("Unknown collection")
+        return self.database[collection_name].count_documents({ "ts": { "$gte": start_ts, "$lt": end_ts } })
+
+    def delete_statuses(self, collection_name, start_ts, end_ts, limit):
+        """Deletes up to limit of the oldest readings in a sensor collection with start_ts <= ts < end_ts. Returns the number deleted."""
+        if collection_name not in SENSOR_COLLECTIONS:
+            raise Exception("Unknown collection")
+        collection = self.database[collection_name]
+        query = { "ts": { "$gte": start_ts, "$lt": end_ts } }
+        ids = [ doc[DATABASE_ID_KEY] for doc in collection.find(query, { DATABASE_ID_KEY: 1 }).sort("ts", pymongo.ASCENDING).limit(limit) ]
+        if len(ids) == 0:
+            return 0
+        return collection.delete_many({ DATABASE_ID_KEY: { "$in": ids } }).deleted_count
+
+    def average_document_size(self, collection_name):
+        """Returns the average size, in bytes, of a document in the collection."""
+        try:
+            stats = list(self.database[collection_name].aggregate([ { "$collStats": { "storageStats": {} } } ]))
+            if len(stats) > 0:
+                return stats[0]["storageStats"].get("avgObjSize", 0)
+        except pymongo.errors.OperationFailure:
+            pass
+        return 0
+
+    def average_status_size(self, collection_name):
+        """Returns the average size, in bytes, of a reading in a sensor collection."""
+        if collection_name not in SENSOR_COLLECTIONS:
             raise Exception("Unknown collection")
+        return self.average_document_size(collection_name)
+
+    #
+    # Rollup methods
+    #
+
+    def readings_to_summarize(self, collection_name, values_list):
+        """Returns the newly received readings that should be merged into the rollups."""
+        if collection_name not in ROLLUP_COLLECTIONS:
+            return []
+        if collection_name not in self.rollup_backfilled_to:
+            _, self.rollup_backfilled_to[collection_name] = self.retrieve_rollup_state(collection_name)
+        return rollups.readings_to_summarize(values_list, self.rollup_backfilled_to[collection_name])
+
+    def update_rollups(self, collection_name, values_list):
+        """Merges a list of readings into the minute, hour, and day rollups for the collection."""
+        if collection_name not in ROLLUP_COLLECTIONS:
+            return True
+        try:
+            for resolution, bucket_secs in rollups.RESOLUTIONS:
+                requests = []
+                for bucket, rollup in rollups.aggregate_readings(values_list, bucket_secs).items():
+                    requests.append(pymongo.UpdateOne({ rollups.ROLLUP_TS_KEY: bucket }, mongo_rollup_update(rollup), upsert=True))
+                if len(requests) > 0:
+                    self.database[rollups.rollup_collection_name(collection_name, resolution)].bulk_write(requests, ordered=False)
+            return True
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
         return False
 
+    def retrieve_rollups(self, collection_name, resolution, min_ts, fields=None, end_ts=None):
+        """Retrieve method for the summarized readings from the bucket containing min_ts onwards, up to the bucket containing end_ts."""
+        try:
+            if collection_name not in ROLLUP_COLLECTIONS:
+                raise Exception("Collection does not have rollups")
+            bucket_secs = rollups.RESOLUTION_SECS[resolution]
+            ts_filter = {}
+            if min_ts > 0:
+                ts_filter["$gte"] = rollups.bucket_start(min_ts, bucket_secs)
+            if end_ts is not None:
+                ts_filter["$lt"] = end_ts
+            filter = {}
+            if len(ts_filter) > 0:
+                filter = { rollups.ROLLUP_TS_KEY: ts_filter }
+            docs = self.database[rollups.rollup_collection_name(collection_name, resolution)].find(filter, rollup_projection(fields)).sort(rollups.ROLLUP_TS_KEY, pymongo.ASCENDING).batch_size(STATUS_CURSOR_BATCH_SIZE)
+            return ( rollups.summarize(doc, fields) for doc in docs )
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return []
+
+    def count_rollups_before(self, collection_name, resolution, end_ts):
+        """Returns the number of rollup buckets that start before end_ts."""
+        rollup_collection = self.database[rollups.rollup_collection_name(collection_name, resolution)]
+        return rollup_collection.count_documents({ rollups.ROLLUP_TS_KEY: { "$lt": end_ts } })
+
+    def delete_rollups_before(self, collection_name, resolution, end_ts, limit):
+        """Deletes up to limit of the oldest rollup buckets that start before end_ts. Returns the number deleted."""
+        rollup_collection = self.database[rollups.rollup_collection_name(collection_name, resolution)]
+        query = { rollups.ROLLUP_TS_KEY: { "$lt": end_ts } }
+        ids = [ doc[DATABASE_ID_KEY] for doc in rollup_collection.find(query, { DATABASE_ID_KEY: 1 }).sort(rollups.ROLLUP_TS_KEY, pymongo.ASCENDING).limit(limit) ]
+        if len(ids) == 0:
+            return 0
+        return rollup_collection.delete_many({ DATABASE_ID_KEY: { "$in": ids } }).deleted_count
+
+    def average_rollup_size(self, collection_name, resolution):
+        """Returns the average size, in bytes, of a rollup bucket."""
+        return self.average_document_size(rollups.rollup_collection_name(collection_name, resolution))
+
+    def create_rollup_state(self, collection_name, epoch):
+        """Records when rollups started being maintained for a collection, unless that has already been recorded."""
+        self.rollup_state_collection.update_one({ DATABASE_ID_KEY: collection_name },
+            { "$setOnInsert": { ROLLUP_STATE_EPOCH_KEY: epoch, ROLLUP_STATE_BACKFILLED_TO_KEY: epoch } },
+            upsert=True)
+        self.rollup_backfilled_to.pop(collection_name, None)
+
+    def retrieve_rollup_state(self, collection_name):
+        """Returns the epoch and backfilled_to times for a collection's rollups, or (None, None) if they were never recorded."""
+        state = self.rollup_state_collection.find_one({ DATABASE_ID_KEY: collection_name })
+        if state is None:
+            return None, None
+        return state[ROLLUP_STATE_EPOCH_KEY], state[ROLLUP_STATE_BACKFILLED_TO_KEY]
+
+    def update_rollup_state(self, collection_name, backfilled_to):
+        """Records how far back the raw readings have been summarized."""
+        self.rollup_state_collection.update_one({ DATABASE_ID_KEY: collection_name }, { "$set": { ROLLUP_STATE_BACKFILLED_TO_KEY: backfilled_to } })
+        self.rollup_backfilled_to[collection_name] = backfilled_to
+
     #
     # Indoor air quality methods
     #
 
-    def retrieve_air_quality(self, min_ts):
+    def retrieve_air_quality(self, min_ts, fields=None, end_ts=None):
         """Retrieve method for air quality measurements."""
         try:
-            filter = {}
-            if min_ts > 0:
-                filter = { "ts": { "$gt": min_ts } }
-            return self.indoor_air_quality.find(filter, { "_id": 0 })
+            filter = mongo_status_filter(min_ts, end_ts)
+            return self.indoor_air_quality.find(filter, status_projection(fields)).batch_size(STATUS_CURSOR_BATCH_SIZE)
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
@@ -532,13 +977,11 @@ class AppMongoDatabase(Database):
     # Patio monitor methods
     #
 
-    def retrieve_patio_status(self, min_ts):
+    def retrieve_patio_status(self, min_ts, fields=None, end_ts=None):
         """Retrieve method for patio monitor measurements."""
         try:
-            filter = {}
-            if min_ts > 0:
-                filter = { "ts": { "$gt": min_ts } }
-            return self.patio_monitor.find(filter, {"_id": 0})
+            filter = mongo_status_filter(min_ts, end_ts)
+            return self.patio_monitor.find(filter, status_projection(fields)).batch_size(STATUS_CURSOR_BATCH_SIZE)
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
@@ -557,13 +1000,11 @@ class AppMongoDatabase(Database):
     # AC monitor methods
     #
 
-    def retrieve_ac_status(self, min_ts):
+    def retrieve_ac_status(self, min_ts, fields=None, end_ts=None):
         """Retrieve method for AC measurements."""
         try:
-            filter = {}
-            if min_ts > 0:
-                filter = { "ts": { "$gt": min_ts } }
-            return self.ac_monitor.find(filter, {"_id": 0})
+            filter = mongo_status_filter(min_ts, end_ts)
+            return self.ac_monitor.find(filter, status_projection(fields)).batch_size(STATUS_CURSOR_BATCH_SIZE)
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
@@ -573,13 +1014,11 @@ class AppMongoDatabase(Database):
     # Keg monitor methods
     #
 
-    def retrieve_keg_status(self, min_ts):
+    def retrieve_keg_status(self, min_ts, fields=None, end_ts=None):
         """Retrieve method for keg measurements (temp, amount left in the keg, etc)."""
         try:
-            filter = {}
-            if min_ts > 0:
-                filter = { "ts": { "$gt": min_ts } }
-            return self.keg.find(filter, {"_id": 0})
+            filter = mongo_status_filter(min_ts, end_ts)
+            return self.keg.find(filter, status_projection(fields)).batch_size(STATUS_CURSOR_BATCH_SIZE)
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
@@ -643,14 +1082,863 @@ class AppMongoDatabase(Database):
     # Website status methods
     #
 
-    def retrieve_website_status(self, min_ts):
+    def retrieve_website_status(self, min_ts, fields=None, end_ts=None):
         """Retrieve method for website statuses."""
         try:
-            filter = {}
-            if min_ts > 0:
-                filter = {"ts": {"$gt": min_ts}}
-            return self.website_status.find(filter, {"_id": 0})
+            filter = mongo_status_filter(min_ts, end_ts)
+            return self.website_status.find(filter, status_projection(fields)).batch_size(STATUS_CURSOR_BATCH_SIZE)
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return []
+
+    def create_site_statuses(self, values_list):
+        """Splits website status readings into per-site rows and stores them."""
+        rows = site_status.normalize_many(values_list)
+        if len(rows) == 0:
+            return True
+        try:
+            result = self.site_status.insert_many(rows, ordered=False)
+            return result is not None and len(result.inserted_ids) == len(rows)
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    def retrieve_site_statuses(self, min_ts, sites=None, end_ts=None):
+        """Retrieve method for the per-site website status rows with min_ts < ts < end_ts, in time order, optionally only for the given sites."""
+        try:
+            filter = mongo_status_filter(min_ts, end_ts)
+            if sites is not None:
+                filter[site_status.SITE_KEY] = { "$in": sites }
+            return self.site_status.find(filter, { DATABASE_ID_KEY: 0 }).sort("ts", pymongo.ASCENDING).batch_size(STATUS_CURSOR_BATCH_SIZE)
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
         return []
+
+    def delete_site_statuses(self, start_ts, end_ts, limit):
+        """Deletes up to limit of the oldest per-site website status rows with start_ts <= ts < end_ts. Returns the number deleted."""
+        query = { "ts": { "$gte": start_ts, "$lt": end_ts } }
+        ids = [ doc[DATABASE_ID_KEY] for doc in self.site_status.find(query, { DATABASE_ID_KEY: 1 }).sort("ts", pymongo.ASCENDING).limit(limit) ]
+        if len(ids) == 0:
+            return 0
+        return self.site_status.delete_many({ DATABASE_ID_KEY: { "$in": ids } }).deleted_count
+
+class AppSqliteDatabase(SqliteDatabase):
+    """SQLite implementation of the application database. Intended for small, single host, deployments."""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.connections = []
+        self.connections_lock = threading.Lock()
+        self.busy_timeout_secs = DEFAULT_CONNECT_TIMEOUT_MS / 1000.0
+        self.status_sql = {}
+        self.rollup_backfilled_to = {} # Cached rollup state, collection name -> backfilled_to
+        SqliteDatabase.__init__(self, "", "")
+
+    def connect(self, database_url,
+                pool_size=DEFAULT_POOL_SIZE,
+                connect_timeout_ms=DEFAULT_CONNECT_TIMEOUT_MS,
+                server_selection_timeout_ms=DEFAULT_SERVER_SELECTION_TIMEOUT_MS,
+                socket_timeout_ms=DEFAULT_SOCKET_TIMEOUT_MS):
+        """Connects/creates the database. Each thread gets its own connection, so the pool settings are unused."""
+        if not is_sqlite_url(database_url):
+            raise DatabaseException("Not a SQLite URL: %s" % database_url)
+        self.db_file_name = database_url[len(SQLITE_URL_PREFIX):]
+        if len(self.db_file_name) == 0:
+            raise DatabaseException("SQLite database file not specified.")
+        self.busy_timeout_secs = connect_timeout_ms / 1000.0
+
+        # The SQL for the sensor tables only differs by table name, so build it once. Using the same
+        # statement text every time lets sqlite3 reuse its compiled (prepared) statements.
+        for collection_name in SENSOR_COLLECTIONS:
+            table = self.quote_identifier(collection_name)
+            self.status_sql[collection_name] = {
+                "create": "CREATE TABLE IF NOT EXISTS " + table + " (id INTEGER PRIMARY KEY, ts REAL NOT NULL, doc TEXT NOT NULL)",
+                "insert": "INSERT INTO " + table + " (ts, doc) VALUES (?, ?)",
+                "select_all": "SELECT doc FROM " + table + " ORDER BY ts, id",
+                "select_after": "SELECT doc FROM " + table + " WHERE ts > ? ORDER BY ts, id",
+                "select_between": "SELECT doc FROM " + table + " WHERE ts > ? AND ts < ? ORDER BY ts, id",
+                "select_latest": "SELECT doc FROM " + table + " ORDER BY ts DESC, id DESC LIMIT 1",
+                "select_range": "SELECT doc FROM " + table + " WHERE ts >= ? AND ts < ? ORDER BY ts, id",
+                "select_oldest": "SELECT MIN(ts) FROM " + table,
+                "select_validator": "SELECT (SELECT MAX(ts) FROM " + table + "), (SELECT MAX(id) FROM " + table + ")",
+                "count_range": "SELECT COUNT(*) FROM " + table + " WHERE ts >= ? AND ts < ?",
+                "delete_range": "DELETE FROM " + table + " WHERE id IN (SELECT id FROM " + table + " WHERE ts >= ? AND ts < ? ORDER BY ts LIMIT ?)",
+                "average_size": "SELECT AVG(LENGTH(doc)) FROM " + table,
+            }
+
+        try:
+            con = self.get_connection()
+            with con:
+                con.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, username TEXT NOT NULL, realname TEXT NOT NULL, hash BLOB NOT NULL)")
+                con.execute("CREATE TABLE IF NOT EXISTS sessions (cookie TEXT NOT NULL, user TEXT NOT NULL, expiry REAL NOT NULL)")
+                con.execute("CREATE TABLE IF NOT EXISTS api_keys (key TEXT NOT NULL, expiry REAL NOT NULL, user TEXT NOT NULL)")
+                con.execute("CREATE TABLE IF NOT EXISTS limits (key TEXT NOT NULL UNIQUE, lower_limit REAL, upper_limit REAL)")
+                con.execute("CREATE TABLE IF NOT EXISTS scale_calibrations (name TEXT NOT NULL, tare_value REAL, calibration_value REAL, calibration_weight REAL, full_value REAL)")
+                con.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL, description TEXT, applied_ts REAL NOT NULL)")
+                con.execute("CREATE TABLE IF NOT EXISTS rollups (collection TEXT NOT NULL, resolution TEXT NOT NULL, ts REAL NOT NULL, doc TEXT NOT NULL, PRIMARY KEY (collection, resolution, ts)) WITHOUT ROWID")
+                con.execute("CREATE TABLE IF NOT EXISTS rollup_state (collection TEXT PRIMARY KEY, epoch REAL NOT NULL, backfilled_to REAL NOT NULL)")
+                con.execute("CREATE TABLE IF NOT EXISTS site_status (id INTEGER PRIMARY KEY, site TEXT NOT NULL, ts REAL NOT NULL, load_time_secs REAL, status)")
+                for collection_name in SENSOR_COLLECTIONS:
+                    con.execute(self.status_sql[collection_name]["create"])
+        except sqlite3.Error as e:
+            raise DatabaseException("Could not open the SQLite database: %s" % e)
+
+    def close(self):
+        """Closes every connection opened by this object."""
+        with self.connections_lock:
+            for con in self.connections:
+                con.close()
+            self.connections = []
+        self.local = threading.local()
+
+    def get_connection(self):
+        """Returns the calling thread's connection, opening it if necessary."""
+        con = getattr(self.local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.db_file_name, timeout=self.busy_timeout_secs, cached_statements=SQLITE_STATEMENT_CACHE_SIZE, check_same_thread=False)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self.local.con = con
+            with self.connections_lock:
+                self.connections.append(con)
+        return con
+
+    def fetch_one(self, sql, params=()):
+        """Runs a query and returns the first row, or None."""
+        return self.get_connection().execute(sql, params).fetchone()
+
+    def fetch_all(self, sql, params=()):
+        """Runs a query and returns all the rows."""
+        return self.get_connection().execute(sql, params).fetchall()
+
+    def iterate_rows(self, sql, params=()):
+        """Runs a query and yields the rows, fetching them a batch at a time so a long result never has to be held in memory."""
+        cursor = self.get_connection().execute(sql, params)
+        try:
+            rows = cursor.fetchmany(STATUS_CURSOR_BATCH_SIZE)
+            while rows:
+                for row in rows:
+                    yield row
+                rows = cursor.fetchmany(STATUS_CURSOR_BATCH_SIZE)
+        finally:
+            cursor.close()
+
+    def modify(self, sql, params=()):
+        """Runs a statement that changes the database, in its own transaction. Returns the number of rows affected."""
+        con = self.get_connection()
+        with con:
+            return con.execute(sql, params).rowcount
+
+    #
+    # Schema version methods
+    #
+
+    def retrieve_schema_version(self):
+        """Returns the schema version recorded in the database, zero if nothing has been applied."""
+        row = self.fetch_one("SELECT MAX(version) FROM schema_version")
+        if row is None or row[0] is None:
+            return 0
+        return row[0]
+
+    def update_schema_version(self, version, description):
+        """Records that the schema migration with the given version has been applied."""
+        self.modify("INSERT INTO schema_version (version, description, applied_ts) VALUES (?, ?, ?)", (version, description, time.time()))
+
+    #
+    # User management methods
+    #
+
+    def create_user(self, username, realname, passhash):
+        """Create method for a user."""
+        if username is None:
+            self.log_error(self.create_user.__name__ + ": Unexpected empty object: username")
+            return False
+        if realname is None:
+            self.log_error(self.create_user.__name__ + ": Unexpected empty object: realname")
+            return False
+        if passhash is None:
+            self.log_error(self.create_user.__name__ + ": Unexpected empty object: passhash")
+            return False
+        if len(username) == 0:
+            self.log_error(self.create_user.__name__ + ": username too short")
+            return False
+        if len(realname) == 0:
+            self.log_error(self.create_user.__name__ + ": realname too short")
+            return False
+        if len(passhash) == 0:
+            self.log_error(self.create_user.__name__ + ": hash too short")
+            return False
+
+        try:
+            return self.modify("INSERT INTO users (username, realname, hash) VALUES (?, ?, ?)", (username, realname, passhash)) == 1
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    def retrieve_user(self, username):
+        """Retrieve method for a user."""
+        if username is None:
+            self.log_error(self.retrieve_user.__name__ + ": Unexpected empty object: username")
+            return None, None, None
+        if len(username) == 0:
+            self.log_error(self.retrieve_user.__name__ + ": username is empty")
+            return None, None, None
+
+        try:
+            user = self.fetch_one("SELECT id, hash, realname FROM users WHERE username = ?", (username,))
+            if user is not None:
+                return str(user[0]), user[1], str(user[2])
+            return None, None, None
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return None, None, None
+
+    def retrieve_user_from_id(self, user_id):
+        """Retrieve method for a user."""
+        if user_id is None:
+            self.log_error(self.retrieve_user_from_id.__name__ + ": Unexpected empty object: user_id")
+            return None, None
+
+        try:
+            user = self.fetch_one("SELECT username, realname FROM users WHERE id = ?", (int(user_id),))
+            if user is not None:
+                return user[0], user[1]
+            return None, None
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return None, None
+
+    def update_user(self, user_id, username, realname, passhash):
+        """Update method for a user."""
+        if user_id is None:
+            self.log_error(self.update_user.__name__ + ": Unexpected empty object: user_id")
+            return False
+        if username is None:
+            self.log_error(self.update_user.__name__ + ": Unexpected empty object: username")
+            return False
+        if realname is None:
+            self.log_error(self.update_user.__name__ + ": Unexpected empty object: realname")
+            return False
+        if len(username) == 0:
+            self.log_error(self.update_user.__name__ + ": username too short")
+            return False
+        if len(realname) == 0:
+            self.log_error(self.update_user.__name__ + ": realname too short")
+            return False
+
+        try:
+            if passhash is not None:
+                return self.modify("UPDATE users SET username = ?, realname = ?, hash = ? WHERE id = ?", (username, realname, passhash, int(user_id))) > 0
+            return self.modify("UPDATE users SET username = ?, realname = ? WHERE id = ?", (username, realname, int(user_id))) > 0
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    def delete_user(self, user_id):
+        """Delete method for a user."""
+        if user_id is None:
+            self.log_error(self.delete_user.__name__ + ": Unexpected empty object: user_id")
+            return False
+
+        try:
+            self.modify("DELETE FROM users WHERE id = ?", (int(user_id),))
+            return True
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    #
+    # Session cookie management methods
+    #
+
+    def create_session_cookie(self, user, cookie, expiry):
+        """Create method for a session cookie."""
+        if user is None:
+            raise Exception("Unexpected empty object: user")
+        if cookie is None:
+            raise Exception("Unexpected empty object: cookie")
+        if expiry is None:
+            raise Exception("Unexpected empty object: expiry")
+
+        try:
+            return self.modify("INSERT INTO sessions (cookie, user, expiry) VALUES (?, ?, ?)", (cookie, user, expiry)) == 1
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    def retrieve_session_data(self, cookie):
+        """Retrieve method for session data. Returns (None, None) if there is no such session, raises DatabaseException if the lookup failed."""
+        if cookie is None:
+            raise Exception("Unexpected empty object: cookie")
+
+        try:
+            session_data = self.fetch_one("SELECT user, expiry FROM sessions WHERE cookie = ?", (cookie,))
+            if session_data is not None:
+                return session_data[0], session_data[1]
+            return (None, None)
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+            raise DatabaseException("Lookup failed.")
+
+    def delete_session_cookie(self, cookie):
+        """Delete method for a session cookie."""
+        if cookie is None:
+            raise Exception("Unexpected empty object: cookie")
+
+        try:
+            self.modify("DELETE FROM sessions WHERE cookie = ?", (cookie,))
+            return True
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    #
+    # API key management methods
+    #
+
+    def create_api_key(self, key, expiry, user):
+        """Create method for an API key."""
+        if key is None:
+            raise Exception("Unexpected empty object: key")
+        if expiry is None:
+            raise Exception("Unexpected empty object: expiry")
+        if user is None:
+            raise Exception("Unexpected empty object: user")
+
+        try:
+            return self.modify("INSERT INTO api_keys (key, expiry, user) VALUES (?, ?, ?)", (str(key), expiry, user)) == 1
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    def retrieve_api_key(self, key):
+        """Retrieve method for data associated with an API key. Returns None if there is no such key, raises DatabaseException if the lookup failed."""
+        if key is None:
+            raise Exception("Unexpected empty object: key")
+
+        try:
+            api_key = self.fetch_one("SELECT user FROM api_keys WHERE key = ?", (key,))
+            if api_key is not None:
+                return api_key[0]
+            return None
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+            raise DatabaseException("Lookup failed.")
+
+    def retrieve_api_keys(self, user):
+        """Retrieve method for API keys associated with a specific user."""
+        if user is None:
+            raise Exception("Unexpected empty object: user")
+
+        try:
+            rows = self.fetch_all("SELECT key, expiry FROM api_keys WHERE user = ?", (user,))
+            return [ { API_KEY: row[0], API_EXPIRY_KEY: row[1] } for row in rows ]
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return []
+
+    def delete_api_key(self, key):
+        """Delete method for an API key."""
+        if key is None:
+            raise Exception("Unexpected empty object: key")
+
+        try:
+            self.modify("DELETE FROM api_keys WHERE key = ?", (key,))
+            return True
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    #
+    # Sensor limit methods
+    #
+
+    def create_sensor_limit(self, key, lower_limit, upper_limit):
+        """Create method for sensor limits."""
+        if key is None:
+            raise Exception("Unexpected empty object: key")
+        if lower_limit is None:
+            raise Exception("Unexpected empty object: lower_limit")
+        if upper_limit is None:
+            raise Exception("Unexpected empty object: upper_limit")
+
+        try:
+            return self.modify("INSERT INTO limits (key, lower_limit, upper_limit) VALUES (?, ?, ?)", (str(key), lower_limit, upper_limit)) == 1
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    def retrieve_sensor_limits(self, key):
+        """Retrieve method for sensor limits."""
+        if key is None:
+            raise Exception("Unexpected empty object: key")
+
+        try:
+            limits_result = self.fetch_one("SELECT lower_limit, upper_limit FROM limits WHERE key = ?", (key,))
+            if limits_result is not None:
+                return limits_result[0], limits_result[1]
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return None, None
+
+    def retrieve_all_sensor_limits(self):
+        """Retrieve method for every sensor's limits, as a dictionary of key -> (lower limit, upper limit)."""
+        rows = self.fetch_all("SELECT key, lower_limit, upper_limit FROM limits")
+        return { row[0]: (row[1], row[2]) for row in rows }
+
+    def update_sensor_limits(self, limits):
+        """Upsert method for sensor limits, given as a dictionary of key -> (lower limit, upper limit). Every key is written in one transaction.
+        Existing rows are deleted rather than replaced, since tables created before the key was unique only get the constraint from a migration."""
+        if limits is None:
+            raise Exception("Unexpected empty object: limits")
+
+        try:
+            con = self.get_connection()
+            with con:
+                con.executemany("DELETE FROM limits WHERE key = ?", [ (str(key),) for key in limits.keys() ])
+                con.executemany("INSERT INTO limits (key, lower_limit, upper_limit) VALUES (?, ?, ?)",
+                    [ (str(key), lower_limit, upper_limit) for key, (lower_limit, upper_limit) in limits.items() ])
+            return True
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    def delete_sensor_limits(self, key):
+        """Delete method for a user."""
+        if key is None:
+            raise Exception("Unexpected empty object: key")
+
+        try:
+            self.modify("DELETE FROM limits WHERE key = ?", (key,))
+            return True
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    #
+    # Status methods
+    #
+
+    def create_status(self, collection_name, values):
+        """Create method for status."""
+        if collection_name is None:
+            raise Exception("Unexpected empty object: collection_name")
+        if values is None:
+            raise Exception("Unexpected empty object: values")
+        return self.create_statuses(collection_name, [ values ])
+
+    def create_statuses(self, collection_name, values_list):
+        """Create method for a batch of statuses, all destined for the same collection. Written in a single transaction."""
+        if collection_name is None:
+            raise Exception("Unexpected empty object: collection_name")
+        if values_list is None:
+            raise Exception("Unexpected empty object: values_list")
+        if len(values_list) == 0:
+            return True
+
+        try:
+            if collection_name not in WRITABLE_STATUS_COLLECTIONS:
+                raise Exception("Unknown collection")
+            rows = [ (values["ts"], json.dumps(values)) for values in values_list ]
+            con = self.get_connection()
+            with con:
+                # Take the write lock up front so the rollups can be read, merged, and written back without racing other writers.
+                con.execute("BEGIN IMMEDIATE")
+                con.executemany(self.status_sql[collection_name]["insert"], rows)
+                self.merge_rollups(con, collection_name, self.readings_to_summarize(collection_name, values_list))
+                if collection_name == COLLECTION_WEBSITE_STATUS:
+                    self.insert_site_statuses(con, values_list)
+            READINGS_INGESTED.inc((collection_name,), len(values_list))
+            return True
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    def retrieve_statuses(self, collection_name, min_ts, fields=None, end_ts=None):
+        """Retrieve method for the readings in a sensor collection with min_ts < ts < end_ts, optionally limited to the given fields."""
+        if end_ts is not None:
+            rows = self.iterate_rows(self.status_sql[collection_name]["select_between"], (min_ts, end_ts))
+        elif min_ts > 0:
+            rows = self.iterate_rows(self.status_sql[collection_name]["select_after"], (min_ts,))
+        else:
+            rows = self.iterate_rows(self.status_sql[collection_name]["select_all"])
+        return ( select_fields(json.loads(row[0]), fields) for row in rows )
+
+    def retrieve_status_page(self, collection_name, min_ts, end_ts, fields, limit, after):
+        """Returns up to limit readings with min_ts < ts < end_ts, in (ts, id) order, starting after the given (ts, id) key.
+        Also returns the key to continue from, or None if this is the last page."""
+        if collection_name not in SENSOR_COLLECTIONS:
+            raise Exception("Unknown collection")
+        if after is not None and (not isinstance(after[1], int) or isinstance(after[1], bool)):
+            raise ValueError("Invalid key")
+        where, params = sqlite_status_where(min_ts, end_ts, after)
+        sql = "SELECT id, ts, doc FROM " + self.quote_identifier(collection_name) + where + " ORDER BY ts, id LIMIT ?"
+        rows = self.fetch_all(sql, params + [ limit + 1 ])
+        next_key = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_key = [ rows[-1][1], rows[-1][0] ]
+        return [ select_fields(json.loads(row[2]), fields) for row in rows ], next_key
+
+    def retrieve_latest_status(self, collection_name):
+        """Retrieve method for the most recent reading in a sensor collection, None if it is empty."""
+        row = self.fetch_one(self.status_sql[collection_name]["select_latest"])
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def retrieve_status_range(self, collection_name, start_ts, end_ts):
+        """Retrieve method for the readings in a sensor collection with start_ts <= ts < end_ts, oldest first."""
+        if collection_name not in SENSOR_COLLECTIONS:
+            raise Exception("Unknown collection")
+        rows = self.fetch_all(self.status_sql[collection_name]["select_range"], (start_ts, end_ts))
+        return [ json.loads(row[0]) for row in rows ]
+
+    def retrieve_status_validator(self, collection_name):
+        """Returns a cheap (latest timestamp, write marker) pair that changes whenever a reading is added to or removed from a
+        sensor collection. The marker is the highest row ID, which catches late readings. Both are zero if the collection is empty."""
+        if collection_name not in SENSOR_COLLECTIONS:
+            raise Exception("Unknown collection")
+        latest_ts, max_id = self.fetch_one(self.status_sql[collection_name]["select_validator"])
+        if latest_ts is None:
+            return 0, 0
+        return latest_ts, max_id
+
+    def retrieve_oldest_status_ts(self, collection_name):
+        """Returns the timestamp of the oldest reading in a sensor collection, or None if it is empty."""
+        if collection_name not in SENSOR_COLLECTIONS:
+            raise Exception("Unknown collection")
+        return self.fetch_one(self.status_sql[collection_name]["select_oldest"])[0]
+
+    def count_statuses(self, collection_name, start_ts, end_ts):
+        """Returns the number of readings in a sensor collection with start_ts <= ts < end_ts."""
+        if collection_name not in SENSOR_COLLECTIONS:
+            raise Exception("Unknown collection")
+        return self.fetch_one(self.status_sql[collection_name]["count_range"], (start_ts, end_ts))[0]
+
+    def delete_statuses(self, collection_name, start_ts, end_ts, limit):
+        """Deletes up to limit of the oldest readings in a sensor collection with start_ts <= ts < end_ts. Returns the number deleted."""
+        if collection_name not in SENSOR_COLLECTIONS:
+            raise Exception("Unknown collection")
+        return self.modify(self.status_sql[collection_name]["delete_range"], (start_ts, end_ts, limit))
+
+    def average_status_size(self, collection_name):
+        """Returns the average size, in bytes, of a reading in a sensor collection."""
+        if collection_name not in SENSOR_COLLECTIONS:
+            raise Exception("Unknown collection")
+        row = self.fetch_one(self.status_sql[collection_name]["average_size"])
+        if row is None or row[0] is None:
+            return 0
+        return row[0] + SQLITE_ROW_OVERHEAD_BYTES
+
+    #
+    # Rollup methods
+    #
+
+    def readings_to_summarize(self, collection_name, values_list):
+        """Returns the newly received readings that should be merged into the rollups."""
+        if collection_name not in ROLLUP_COLLECTIONS:
+            return []
+        if collection_name not in self.rollup_backfilled_to:
+            _, self.rollup_backfilled_to[collection_name] = self.retrieve_rollup_state(collection_name)
+        return rollups.readings_to_summarize(values_list, self.rollup_backfilled_to[collection_name])
+
+    def merge_rollups(self, con, collection_name, values_list):
+        """Merges a list of readings into the minute, hour, and day rollups, as part of the caller's transaction."""
+        if collection_name not in ROLLUP_COLLECTIONS:
+            return
+        for resolution, bucket_secs in rollups.RESOLUTIONS:
+            for bucket, rollup in rollups.aggregate_readings(values_list, bucket_secs).items():
+                row = con.execute("SELECT doc FROM rollups WHERE collection = ? AND resolution = ? AND ts = ?", (collection_name, resolution, bucket)).fetchone()
+                if row is not None:
+                    stored = json.loads(row[0])
+                    rollups.merge_rollup(stored, rollup)
+                    rollup = stored
+                con.execute("INSERT OR REPLACE INTO rollups (collection, resolution, ts, doc) VALUES (?, ?, ?, ?)", (collection_name, resolution, bucket, json.dumps(rollup)))
+
+    def update_rollups(self, collection_name, values_list):
+        """Merges a list of readings into the minute, hour, and day rollups for the collection."""
+        try:
+            con = self.get_connection()
+            with con:
+                con.execute("BEGIN IMMEDIATE")
+                self.merge_rollups(con, collection_name, values_list)
+            return True
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    def retrieve_rollups(self, collection_name, resolution, min_ts, fields=None, end_ts=None):
+        """Retrieve method for the summarized readings from the bucket containing min_ts onwards, up to the bucket containing end_ts."""
+        try:
+            if collection_name not in ROLLUP_COLLECTIONS:
+                raise Exception("Collection does not have rollups")
+            bucket_secs = rollups.RESOLUTION_SECS[resolution]
+            if end_ts is None:
+                end_ts = float("inf")
+            rows = self.iterate_rows("SELECT doc FROM rollups WHERE collection = ? AND resolution = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                (collection_name, resolution, rollups.bucket_start(max(min_ts, 0), bucket_secs), end_ts))
+            return ( rollups.summarize(json.loads(row[0]), fields) for row in rows )
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return []
+
+    def count_rollups_before(self, collection_name, resolution, end_ts):
+        """Returns the number of rollup buckets that start before end_ts."""
+        return self.fetch_one("SELECT COUNT(*) FROM rollups WHERE collection = ? AND resolution = ? AND ts < ?", (collection_name, resolution, end_ts))[0]
+
+    def delete_rollups_before(self, collection_name, resolution, end_ts, limit):
+        """Deletes up to limit of the oldest rollup buckets that start before end_ts. Returns the number deleted."""
+        return self.modify("DELETE FROM rollups WHERE collection = ? AND resolution = ? AND ts IN (SELECT ts FROM rollups WHERE collection = ? AND resolution = ? AND ts < ? ORDER BY ts LIMIT ?)",
+            (collection_name, resolution, collection_name, resolution, end_ts, limit))
+
+    def average_rollup_size(self, collection_name, resolution):
+        """Returns the average size, in bytes, of a rollup bucket."""
+        row = self.fetch_one("SELECT AVG(LENGTH(doc)) FROM rollups WHERE collection = ? AND resolution = ?", (collection_name, resolution))
+        if row is None or row[0] is None:
+            return 0
+        return row[0] + SQLITE_ROW_OVERHEAD_BYTES
+
+    def create_rollup_state(self, collection_name, epoch):
+        """Records when rollups started being maintained for a collection, unless that has already been recorded."""
+        self.modify("INSERT OR IGNORE INTO rollup_state (collection, epoch, backfilled_to) VALUES (?, ?, ?)", (collection_name, epoch, epoch))
+        self.rollup_backfilled_to.pop(collection_name, None)
+
+    def retrieve_rollup_state(self, collection_name):
+        """Returns the epoch and backfilled_to times for a collection's rollups, or (None, None) if they were never recorded."""
+        row = self.fetch_one("SELECT epoch, backfilled_to FROM rollup_state WHERE collection = ?", (collection_name,))
+        if row is None:
+            return None, None
+        return row[0], row[1]
+
+    def update_rollup_state(self, collection_name, backfilled_to):
+        """Records how far back the raw readings have been summarized."""
+        self.modify("UPDATE rollup_state SET backfilled_to = ? WHERE collection = ?", (backfilled_to, collection_name))
+        self.rollup_backfilled_to[collection_name] = backfilled_to
+
+    #
+    # Indoor air quality methods
+    #
+
+    def retrieve_air_quality(self, min_ts, fields=None, end_ts=None):
+        """Retrieve method for air quality measurements."""
+        try:
+            return self.retrieve_statuses(COLLECTION_INDOOR_AIR_QUALITY, min_ts, fields, end_ts)
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return []
+
+    def retrieve_latest_air_quality(self):
+        """Retrieve method for the latest air quality measurement."""
+        try:
+            return self.retrieve_latest_status(COLLECTION_INDOOR_AIR_QUALITY) or []
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return []
+
+    #
+    # Patio monitor methods
+    #
+
+    def retrieve_patio_status(self, min_ts, fields=None, end_ts=None):
+        """Retrieve method for patio monitor measurements."""
+        try:
+            return self.retrieve_statuses(COLLECTION_PATIO_MONITOR, min_ts, fields, end_ts)
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return []
+
+    def retrieve_latest_patio_status(self):
+        """Retrieve method for the latest patio monitor measurement."""
+        try:
+            return self.retrieve_latest_status(COLLECTION_PATIO_MONITOR) or []
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return []
+
+    #
+    # AC monitor methods
+    #
+
+    def retrieve_ac_status(self, min_ts, fields=None, end_ts=None):
+        """Retrieve method for AC measurements."""
+        try:
+            return self.retrieve_statuses(COLLECTION_AC, min_ts, fields, end_ts)
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return []
+
+    #
+    # Keg monitor methods
+    #
+
+    def retrieve_keg_status(self, min_ts, fields=None, end_ts=None):
+        """Retrieve method for keg measurements (temp, amount left in the keg, etc)."""
+        try:
+            return self.retrieve_statuses(COLLECTION_KEG, min_ts, fields, end_ts)
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return []
+
+    #
+    # Scale calibration methods
+    #
+
+    def create_scale_calibration(self, name, tare_value, cal_value, cal_weight, full_value):
+        """Create method for scale calibrations."""
+        try:
+            return self.modify("INSERT INTO scale_calibrations (name, tare_value, calibration_value, calibration_weight, full_value) VALUES (?, ?, ?, ?, ?)",
+                (name, tare_value, cal_value, cal_weight, full_value)) == 1
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    def update_scale_calibration(self, name, tare_value, cal_value, cal_weight, full_value):
+        """Update method for scale calibrations."""
+        try:
+            con = self.get_connection()
+            with con:
+                if tare_value is not None:
+                    con.execute("UPDATE scale_calibrations SET tare_value = ? WHERE name = ?", (tare_value, name))
+                if cal_value is not None and cal_weight is not None:
+                    con.execute("UPDATE scale_calibrations SET calibration_value = ?, calibration_weight = ? WHERE name = ?", (cal_value, cal_weight, name))
+                if full_value is not None:
+                    con.execute("UPDATE scale_calibrations SET full_value = ? WHERE name = ?", (full_value, name))
+                return con.execute("SELECT COUNT(*) FROM scale_calibrations WHERE name = ?", (name,)).fetchone()[0] > 0
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    def retrieve_scale_calibration(self, name):
+        """Retrieve method for scale calibrations."""
+        try:
+            cal = { SCALE_NAME_KEY: name, SCALE_TARE_VALUE_KEY: None, SCALE_CALIBRATION_VALUE_KEY: None, SCALE_CALIBRATION_WEIGHT_KEY: None, SCALE_FULL_VALUE_KEY: None }
+            row = self.fetch_one("SELECT tare_value, calibration_value, calibration_weight, full_value FROM scale_calibrations WHERE name = ?", (name,))
+            if row is not None:
+                cal[SCALE_TARE_VALUE_KEY] = row[0]
+                cal[SCALE_CALIBRATION_VALUE_KEY] = row[1]
+                cal[SCALE_CALIBRATION_WEIGHT_KEY] = row[2]
+                cal[SCALE_FULL_VALUE_KEY] = row[3]
+            return cal
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return {}
+
+    #
+    # Website status methods
+    #
+
+    def retrieve_website_status(self, min_ts, fields=None, end_ts=None):
+        """Retrieve method for website statuses."""
+        try:
+            return self.retrieve_statuses(COLLECTION_WEBSITE_STATUS, min_ts, fields, end_ts)
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return []
+
+    def insert_site_statuses(self, con, values_list):
+        """Splits website status readings into per-site rows and stores them, as part of the caller's transaction."""
+        rows = site_status.normalize_many(values_list)
+        con.executemany("INSERT INTO site_status (site, ts, load_time_secs, status) VALUES (?, ?, ?, ?)",
+            [ (row[site_status.SITE_KEY], row[site_status.TS_KEY], row[site_status.LOAD_TIME_KEY], sqlite_site_status_value(row[site_status.STATUS_KEY])) for row in rows ])
+
+    def retrieve_site_statuses(self, min_ts, sites=None, end_ts=None):
+        """Retrieve method for the per-site website status rows with min_ts < ts < end_ts, in time order, optionally only for the given sites."""
+        try:
+            where, params = sqlite_status_where(min_ts, end_ts)
+            if sites is not None:
+                where = where + (" AND " if len(where) > 0 else " WHERE ") + "site IN (" + ",".join([ "?" ] * len(sites)) + ")"
+                params = params + list(sites)
+            rows = self.iterate_rows("SELECT site, ts, load_time_secs, status FROM site_status" + where + " ORDER BY ts, id", params)
+            return ({ site_status.SITE_KEY: row[0], site_status.TS_KEY: row[1], site_status.LOAD_TIME_KEY: row[2], site_status.STATUS_KEY: row[3] } for row in rows)
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return []
+
+    def delete_site_statuses(self, start_ts, end_ts, limit):
+        """Deletes up to limit of the oldest per-site website status rows with start_ts <= ts < end_ts. Returns the number deleted."""
+        return self.modify("DELETE FROM site_status WHERE id IN (SELECT id FROM site_status WHERE ts >= ? AND ts < ? ORDER BY ts LIMIT ?)", (start_ts, end_ts, limit))
+
+class DatabaseConnectionManager(object):
+    """Hands out a single, pooled, application database connection to every caller in the process."""
+
+    def __init__(self):
+        self.database_url = None
+        self.pool_size = DEFAULT_POOL_SIZE
+        self.connect_timeout_ms = DEFAULT_CONNECT_TIMEOUT_MS
+        self.server_selection_timeout_ms = DEFAULT_SERVER_SELECTION_TIMEOUT_MS
+        self.socket_timeout_ms = DEFAULT_SOCKET_TIMEOUT_MS
+        self.db = None
+        self.lock = threading.Lock()
+        super(DatabaseConnectionManager, self).__init__()
+
+    def configure(self, database_url,
+                  pool_size=DEFAULT_POOL_SIZE,
+                  connect_timeout_ms=DEFAULT_CONNECT_TIMEOUT_MS,
+                  server_selection_timeout_ms=DEFAULT_SERVER_SELECTION_TIMEOUT_MS,
+                  socket_timeout_ms=DEFAULT_SOCKET_TIMEOUT_MS):
+        """Sets the connection parameters. Takes effect the next time a connection is created."""
+        with self.lock:
+            self.database_url = database_url
+            self.pool_size = pool_size
+            self.connect_timeout_ms = connect_timeout_ms
+            self.server_selection_timeout_ms = server_selection_timeout_ms
+            self.socket_timeout_ms = socket_timeout_ms
+
+    def get(self):
+        """Returns the shared database object, connecting on first use."""
+        db = self.db
+        if db is not None:
+            return db
+        with self.lock:
+            if self.db is None:
+                if self.database_url is None:
+                    raise DatabaseException("The database connection has not been configured.")
+                db = create_database(self.database_url)
+                db.connect(self.database_url,
+                    pool_size=self.pool_size,
+                    connect_timeout_ms=self.connect_timeout_ms,
+                    server_selection_timeout_ms=self.server_selection_timeout_ms,
+                    socket_timeout_ms=self.socket_timeout_ms)
+                self.db = db
+            return self.db
+
+    def close(self):
+        """Closes the shared connection, if one was created."""
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
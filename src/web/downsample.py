@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Largest-Triangle-Three-Buckets downsampling, so that a graph only gets as many points as it can draw."""
+
+import numpy
+
+# LTTB always keeps the first and last points, so it can't produce fewer than this.
+MIN_POINTS = 3
+
+def lttb_indices(x, y, threshold):
+    """Returns the indices of the points LTTB keeps when reducing the series (x, y), which must be sorted by x, to threshold points."""
+    n = len(x)
+    if threshold >= n or threshold < MIN_POINTS:
+        return numpy.arange(n)
+
+    # The first and last points are always kept. Everything in between is split into threshold - 2 buckets.
+    edges = numpy.linspace(1, n - 1, threshold - 1).astype(numpy.int64)
+    starts = edges[:-1]
+    ends = edges[1:]
+
+    # The average of each bucket, computed for all buckets at once. The last point stands in for the bucket after the last one.
+    x_sums = numpy.concatenate(([ 0.0 ], numpy.cumsum(x)))
+    y_sums = numpy.concatenate(([ 0.0 ], numpy.cumsum(y)))
+    counts = ends - starts
+    avg_x = numpy.append((x_sums[ends] - x_sums[starts]) / counts, x[-1])
+    avg_y = numpy.append((y_sums[ends] - y_sums[starts]) / counts, y[-1])
+
+    # Each bucket's choice depends on the one before it, so this loop is unavoidable, but the work inside it is vectorized.
+    selected = numpy.empty(threshold, dtype=numpy.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        bucket_x = x[starts[i]:ends[i]]
+        bucket_y = y[starts[i]:ends[i]]
+        areas = numpy.abs((x[a] - avg_x[i + 1]) * (bucket_y - y[a]) - (x[a] - bucket_x) * (avg_y[i + 1] - y[a]))
+        a = starts[i] + int(numpy.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+def numeric_keys(rows):
+    """Returns the keys, other than the timestamp, that have a numeric value in at least one row."""
+    keys = set()
+    for row in rows:
+        for key, value in row.items():
+            if key != "ts" and not isinstance(value, bool) and isinstance(value, (int, float)):
+                keys.add(key)
+    return keys
+
+def downsample_rows(rows, max_points, ts_key="ts"):
+    """Reduces a list of readings so that no numeric field has more than max_points values. Each field is
+    downsampled independently, so a reading in the result only contains the fields that were kept from it.
+    Fields that are not numeric are dropped, since they can't be downsampled."""
+    if len(rows) <= max_points:
+        return rows
+    rows = sorted(rows, key=lambda row: row[ts_key])
+    kept = {}
+    for key in numeric_keys(rows):
+        row_indices = numpy.fromiter((i for i, row in enumerate(rows) if not isinstance(row.get(key), bool) and isinstance(row.get(key), (int, float))), dtype=numpy.int64)
+        x = numpy.fromiter((rows[i][ts_key] for i in row_indices), dtype=numpy.float64, count=len(row_indices))
+        y = numpy.fromiter((rows[i][key] for i in row_indices), dtype=numpy.float64, count=len(row_indices))
+        for i in row_indices[lttb_indices(x, y, max_points)]:
+            i = int(i)
+            if i not in kept:
+                kept[i] = { ts_key: rows[i][ts_key] }
+            kept[i][key] = rows[i][key]
+    return [ kept[i] for i in sorted(kept) ]
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Write-behind queue for sensor readings, so that accepting a reading doesn't have to wait on the database."""
+
+import logging
+import queue
+import threading
+import time
+import traceback
+
+DEFAULT_MAX_ITEMS = 10000
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL_MS = 250
+
+class WriteBehindQueue(object):
+    """Bounded, in-memory, queue of (collection, values) pairs. A background thread drains it, grouping readings
+    by collection, and writes each group with a single batched insert."""
+
+    def __init__(self, get_db_func, max_items=DEFAULT_MAX_ITEMS, batch_size=DEFAULT_BATCH_SIZE, flush_interval_ms=DEFAULT_FLUSH_INTERVAL_MS):
+        self.get_db_func = get_db_func
+        self.batch_size = max(1, batch_size)
+        self.flush_interval_secs = max(1, flush_interval_ms) / 1000.0
+        self.queue = queue.Queue(maxsize=max(1, max_items))
+        self.thread = None
+        self.stopping = threading.Event()
+        self.counters_lock = threading.Lock()
+        self.num_enqueued = 0
+        self.num_dropped = 0
+        self.num_written = 0
+        self.num_failed = 0
+        self.num_flushes = 0
+        super(WriteBehindQueue, self).__init__()
+
+    def log_error(self, log_str):
+        """Writes an error message to the log file."""
+        logger = logging.getLogger()
+        logger.error(log_str)
+
+    def start(self):
+        """Starts the background writer."""
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="write-behind", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops the background writer, after it has written everything that is still queued."""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def put(self, collection, values):
+        """Queues a reading. Returns False, and counts the reading as dropped, if the queue is full."""
+        try:
+            self.queue.put_nowait((collection, values))
+            with self.counters_lock:
+                self.num_enqueued = self.num_enqueued + 1
+            return True
+        except queue.Full:
+            with self.counters_lock:
+                self.num_dropped = self.num_dropped + 1
+        return False
+
+    def depth(self):
+        """Returns the number of readings waiting to be written."""
+        return self.queue.qsize()
+
+    def stats(self):
+        """Returns the queue's counters."""
+        with self.counters_lock:
+            return { "depth": self.depth(), "enqueued": self.num_enqueued, "dropped": self.num_dropped,
+                "written": self.num_written, "failed": self.num_failed, "flushes": self.num_flushes }
+
+    def next_group(self):
+        """Waits for a reading, then keeps collecting until either the batch is full or the flush interval expires."""
+        items = []
+        try:
+            items.append(self.queue.get(timeout=self.flush_interval_secs))
+        except queue.Empty:
+            return items
+        deadline = time.monotonic() + self.flush_interval_secs
+        while len(items) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def drain(self):
+        """Removes everything that is currently queued, without waiting."""
+        items = []
+        while True:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    def write(self, items):
+        """Writes a group of readings, one insert per collection."""
+        if len(items) == 0:
+            return
+        batches = {}
+        for collection, values in items:
+            batches.setdefault(collection, []).append(values)
+
+        db = self.get_db_func()
+        for collection, values_list in batches.items():
+            try:
+                written = db.create_statuses(collection, values_list)
+            except:
+                self.log_error(traceback.format_exc())
+                written = False
+            with self.counters_lock:
+                if written:
+                    self.num_written = self.num_written + len(values_list)
+                else:
+                    self.num_failed = self.num_failed + len(values_list)
+        with self.counters_lock:
+            self.num_flushes = self.num_flushes + 1
+
+    def flush(self):
+        """Synchronously writes everything that is currently queued."""
+        items = self.drain()
+        for i in range(0, len(items), self.batch_size):
+            self.write(items[i:i + self.batch_size])
+
+    def run(self):
+        """Background writer loop."""
+        while not self.stopping.is_set():
+            try:
+                self.write(self.next_group())
+            except:
+                self.log_error(traceback.format_exc())
@@ -31,6 +31,23 @@ function is_numeric(num) {
     return !isNaN(num)
 }
 
+/// @function columnar_points
+/// Converts one field of a columnar API response into graph points, skipping readings that don't have it.
+function columnar_points(columns, key, scale = 1.0) {
+    let points = [];
+    if (columns == null)
+        return points;
+    let ts_values = columns['ts'];
+    let values = columns[key];
+    if (ts_values == null || values == null)
+        return points;
+    for (let i = 0; i < ts_values.length; ++i) {
+        if (values[i] != null)
+            points.push( { x: ts_values[i], y: values[i] * scale });
+    }
+    return points;
+}
+
 /// @function unix_time_to_local_string
 function unix_time_to_local_string(unix_time) {
     let date = new Date(unix_time);
@@ -52,6 +69,58 @@ function send_get_request_async(url, callback) {
     xml_http.send();
 }
 
+/// @function Sends an HTTP GET request for binary data of the given type and waits for the response, which is passed to the callback as an ArrayBuffer.
+function send_get_binary_request_async(url, accept_type, callback) {
+    let xml_http = new XMLHttpRequest();
+
+    xml_http.open("GET", url, true);
+    xml_http.setRequestHeader('Accept', accept_type);
+    xml_http.responseType = "arraybuffer";
+    xml_http.onreadystatechange = function() {
+        if (xml_http.readyState == XMLHttpRequest.DONE) {
+            callback(xml_http.status, xml_http.response);
+        }
+    }
+    xml_http.send();
+}
+
+// Validators from the last full response for each polled series, so the next poll can be conditional.
+var g_series_validators = {};
+
+/// @function Sends an HTTP GET request for a series that is polled, and waits for the response.
+/// The validators from the previous response are sent, so the server can answer 304 Not Modified, with no body, if
+/// nothing has been written since. They're only sent if we already hold the series from start_ts onwards.
+/// A null series_key makes the request unconditional. JSON is passed to the callback as text, anything else as an ArrayBuffer.
+function send_series_request_async(series_key, start_ts, url, accept_type, callback) {
+    let xml_http = new XMLHttpRequest();
+    let validators = (series_key == null) ? null : g_series_validators[series_key];
+
+    xml_http.open("GET", url, true);
+    xml_http.setRequestHeader('Accept', accept_type);
+    if (accept_type != "application/json")
+        xml_http.responseType = "arraybuffer";
+    if (validators != null && start_ts >= validators.start_ts) {
+        if (validators.etag != null)
+            xml_http.setRequestHeader('If-None-Match', validators.etag);
+        if (validators.last_modified != null)
+            xml_http.setRequestHeader('If-Modified-Since', validators.last_modified);
+    }
+    xml_http.onreadystatechange = function() {
+        if (xml_http.readyState == XMLHttpRequest.DONE) {
+            if (xml_http.status == 200 && series_key != null) {
+                let held_start_ts = (validators != null && validators.start_ts < start_ts) ? validators.start_ts : start_ts;
+                g_series_validators[series_key] = {
+                    etag: xml_http.getResponseHeader('ETag'),
+                    last_modified: xml_http.getResponseHeader('Last-Modified'),
+                    start_ts: held_start_ts
+                };
+            }
+            callback(xml_http.status, xml_http.responseType == "arraybuffer" ? xml_http.response : xml_http.responseText);
+        }
+    }
+    xml_http.send();
+}
+
 /// @function Sends an HTTP POST request and waits for the response.
 function send_post_request_async(url, params, callback) {
     let xml_http = new XMLHttpRequest();
@@ -40,11 +40,61 @@ class GraphSettings {
         this.num_columns = 1;
         this.min_loaded_x = null; // We don't have data for x values less than this
         this.max_loaded_x = null; // We don't have data for x values greater than this
-        this.more_data_func = null; // Call this to get more data (settings, min_x, max_x)
+        this.more_data_func = null; // Call this to get more data (settings, min_x, max_x, previously_loaded_min_x)
         this.update_func = null; // Called to append data to the graph
     }
 }
 
+const BINARY_SERIES_MIME_TYPE = "application/x-dashboard-series";
+const BINARY_SERIES_MAGIC = "DSR1";
+
+/// @function decode_binary_series
+/// Decodes the binary series format (see binary_series.py) into the same shape as the columnar JSON format:
+/// an object with a 'ts' array, in seconds, and an array per field with null where a reading is missing.
+function decode_binary_series(buffer) {
+    let view = new DataView(buffer);
+    let decoder = new TextDecoder("utf-8");
+    let offset = 0;
+
+    if (decoder.decode(new Uint8Array(buffer, 0, 4)) != BINARY_SERIES_MAGIC)
+        return null;
+    offset += 4;
+    let num_fields = view.getUint16(offset, true);
+    let num_rows = view.getUint32(offset + 2, true);
+    offset += 6;
+
+    let field_names = [];
+    for (let i = 0; i < num_fields; ++i) {
+        let name_len = view.getUint16(offset, true);
+        offset += 2;
+        field_names.push(decoder.decode(new Uint8Array(buffer, offset, name_len)));
+        offset += name_len;
+    }
+
+    let columns = {};
+    let ts_values = new Array(num_rows);
+    let ts_ms = 0;
+    for (let i = 0; i < num_rows; ++i) {
+        ts_ms += Number(view.getBigInt64(offset, true));
+        ts_values[i] = ts_ms / 1000.0;
+        offset += 8;
+    }
+    columns['ts'] = ts_values;
+
+    let bitmap_len = Math.ceil(num_rows / 8);
+    for (let field_name of field_names) {
+        let bitmap = new Uint8Array(buffer, offset, bitmap_len);
+        offset += bitmap_len;
+        let values = new Array(num_rows);
+        for (let i = 0; i < num_rows; ++i) {
+            values[i] = (bitmap[i >> 3] & (1 << (i & 7))) ? view.getFloat32(offset + i * 4, true) : null;
+        }
+        offset += num_rows * 4;
+        columns[field_name] = values;
+    }
+    return columns;
+}
+
 /// @function graph_data_sort
 function graph_data_sort(a, b) {
     if (a.x < b.x)
@@ -456,13 +506,14 @@ function draw_graph(data, settings, column_index = 0) {
         // Do we need more data?
         if (min_x < settings.min_loaded_x || max_x > settings.max_loaded_x) {
             if (settings.more_data_func) {
+                let previous_min_x = settings.min_loaded_x;
                 if (min_x < settings.min_loaded_x) {
                     settings.min_loaded_x = min_x;
                 }
                 if (max_x > settings.max_loaded_x) {
                     settings.max_loaded_x = max_x;
                 }
-                settings.more_data_func(settings, settings.min_loaded_x, settings.max_loaded_x);
+                settings.more_data_func(settings, settings.min_loaded_x, settings.max_loaded_x, previous_min_x);
             }
         }
         else {
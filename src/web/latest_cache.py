@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Keeps the most recent reading for each sensor collection, and for each device within a collection, so the
+requests for the latest value (gauges, widgets, scale calibration) don't have to query the database."""
+
+import threading
+import time
+
+DEVICE_KEY = "device" # Optional field that identifies which device sent a reading
+TS_KEY = "ts"
+
+# Readings can also be written by other processes (the indoor air quality client writes straight to the
+# database), so a collection's entry is reloaded once it is this old. Readings received by this process
+# update the cache immediately.
+DEFAULT_MAX_AGE_SECS = 60.0
+
+class LatestReadingCache(object):
+    """Thread safe cache of the latest reading per (collection, device). The collection wide entry uses a device of None."""
+
+    def __init__(self, max_age_secs=DEFAULT_MAX_AGE_SECS):
+        self.max_age_secs = max_age_secs
+        self.lock = threading.Lock()
+        self.entries = {} # (collection name, device) -> (reading, time the entry was loaded from the database)
+
+    def store(self, key, reading, loaded_time):
+        """Stores the reading, or None if there isn't one, unless the cache already holds a newer one. Either way the
+        entry counts as fresh from loaded_time. The lock must be held."""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] is not None and (reading is None or entry[0].get(TS_KEY, 0) > reading.get(TS_KEY, 0)):
+            reading = entry[0]
+        self.entries[key] = (reading, loaded_time)
+
+    def update(self, collection_name, values):
+        """Called when a reading is received. Only keeps a copy of the reading, without any database ID."""
+        reading = { key: value for key, value in values.items() if key != "_id" }
+        now = time.time()
+        with self.lock:
+            self.store((collection_name, None), reading, now)
+            device = reading.get(DEVICE_KEY)
+            if device is not None:
+                self.store((collection_name, device), reading, now)
+
+    def update_many(self, collection_name, values_list):
+        """Called when a batch of readings is received."""
+        for values in values_list:
+            self.update(collection_name, values)
+
+    def load(self, db, collection_name):
+        """Reloads the collection wide entry from the database. Returns the latest reading, or None if the collection is empty."""
+        reading = db.retrieve_latest_status(collection_name)
+        now = time.time()
+        with self.lock:
+            self.store((collection_name, None), reading, now)
+            if reading is not None and reading.get(DEVICE_KEY) is not None:
+                self.store((collection_name, reading[DEVICE_KEY]), reading, now)
+            return self.entries[(collection_name, None)][0]
+
+    def prime(self, db, collection_names):
+        """Loads the latest reading for each collection, called at startup."""
+        for collection_name in collection_names:
+            self.load(db, collection_name)
+
+    def get(self, db, collection_name, device=None):
+        """Returns the latest reading for the collection (or the device), or None if there isn't one. The database
+        is only queried when the collection wide entry has expired; device entries come from ingest and those loads."""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get((collection_name, None))
+            if device is not None:
+                device_entry = self.entries.get((collection_name, device))
+        if entry is None or now - entry[1] > self.max_age_secs:
+            reading = self.load(db, collection_name)
+            if device is None:
+                return reading
+            with self.lock:
+                device_entry = self.entries.get((collection_name, device))
+        elif device is None:
+            return entry[0]
+        if device_entry is None:
+            return None
+        return device_entry[0]
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""In-process copy of the sensor limits table. The table is tiny and read far more often than it is written (every
+dashboard snapshot, every limits request, and the alert rules), so it is read once and then served from memory."""
+
+import logging
+import math
+import threading
+import time
+import traceback
+
+DEFAULT_MAX_AGE_SECS = 60.0 # Limits written by other processes are picked up this often
+
+class LimitsCache(object):
+    """Thread safe cache of the whole limits table, as a dictionary of key -> (lower limit, upper limit). The dictionary
+    is replaced, never modified, when the table is reloaded, so callers can hold on to it and compare it by identity
+    to tell whether anything changed."""
+
+    def __init__(self, get_db_func, max_age_secs=DEFAULT_MAX_AGE_SECS):
+        self.get_db_func = get_db_func
+        self.max_age_secs = max_age_secs
+        self.lock = threading.Lock()
+        self.limits = {}
+        self.loaded_time = None
+        self.hits = 0
+        self.misses = 0
+
+    def log_error(self, log_str):
+        """Writes an error message to the log file."""
+        logger = logging.getLogger()
+        logger.error(log_str)
+
+    def get(self):
+        """Returns the limits, reloading them if they were never loaded, are old, or were invalidated.
+        If the reload fails, the previous limits are returned."""
+        now = time.time()
+        with self.lock:
+            limits = self.limits
+            if self.loaded_time is not None and now - self.loaded_time < self.max_age_secs:
+                self.hits = self.hits + 1
+                return limits
+            self.misses = self.misses + 1
+            self.loaded_time = now # Other threads keep using the old limits while these load
+        try:
+            limits = self.get_db_func().retrieve_all_sensor_limits()
+            with self.lock:
+                self.limits = limits
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error("Could not load the sensor limits, keeping the previous ones.")
+        return limits
+
+    def get_one(self, key):
+        """Returns (lower limit, upper limit) for one key, or (None, None) if it has no limits."""
+        return self.get().get(key, (None, None))
+
+    def invalidate(self):
+        """Called after the limits are written. They are reloaded the next time they are needed."""
+        with self.lock:
+            self.loaded_time = None
+
+    def stats(self):
+        """Returns the hit and miss counts, for monitoring."""
+        with self.lock:
+            return { "keys": len(self.limits), "hits": self.hits, "misses": self.misses }
+
+def parse_limit_value(value):
+    """Limits arrive as numbers or as the text of a form field. Returns the value as a float, or None if it isn't a finite number."""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(value) or math.isinf(value):
+        return None
+    return value
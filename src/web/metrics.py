@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Counters and histograms for the /metrics endpoint, in the Prometheus text format.
+
+Recording a value has to be cheap, since it happens on every request and every insert. Each thread therefore
+writes to its own shard of a metric, a plain dictionary no other thread writes to, and no lock is taken.
+Scraping adds the shards together. A scrape can catch a histogram between updating its bucket and its count,
+which Prometheus tolerates; nothing is ever lost."""
+
+import bisect
+import threading
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+TYPE_COUNTER = "counter"
+TYPE_GAUGE = "gauge"
+TYPE_HISTOGRAM = "histogram"
+
+# Seconds. Covers everything from a cache hit to a slow database query.
+DEFAULT_LATENCY_BUCKETS = [ 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0 ]
+
+def escape_label_value(value):
+    """Escapes a label value for the text format."""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+def format_labels(label_names, label_values, extra=None):
+    """Returns the {name="value",...} part of a sample line, or an empty string if there are no labels."""
+    pairs = [ name + "=\"" + escape_label_value(value) + "\"" for name, value in zip(label_names, label_values) ]
+    if extra is not None:
+        pairs.append(extra[0] + "=\"" + escape_label_value(extra[1]) + "\"")
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+def format_value(value):
+    """Formats a sample value."""
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class ShardedMetric(object):
+    """Base class for metrics whose values are kept per thread. Subclasses decide what a value is."""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.local = threading.local()
+        self.shards = [] # Every thread's shard, kept after the thread exits so its counts aren't lost
+        self.shards_lock = threading.Lock() # Only taken the first time a thread records a value
+
+    def shard(self):
+        """Returns the calling thread's shard, creating it if this is the thread's first value."""
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = {}
+            self.local.shard = shard
+            with self.shards_lock:
+                self.shards.append(shard)
+        return shard
+
+    def snapshot_shards(self):
+        """Returns a copy of each shard. Copying a dictionary doesn't release the GIL, so each copy is consistent."""
+        with self.shards_lock:
+            shards = list(self.shards)
+        return [ dict(shard) for shard in shards ]
+
+class Counter(ShardedMetric):
+    """A count that only goes up, optionally broken down by labels."""
+
+    metric_type = TYPE_COUNTER
+
+    def inc(self, label_values=(), amount=1):
+        """Adds to the count for the given label values, which must be a tuple in the order of the label names."""
+        shard = self.shard()
+        shard[label_values] = shard.get(label_values, 0) + amount
+
+    def collect(self):
+        """Returns the text format lines for this metric."""
+        totals = {}
+        for shard in self.snapshot_shards():
+            for label_values, value in shard.items():
+                totals[label_values] = totals.get(label_values, 0) + value
+        return [ self.name + format_labels(self.label_names, label_values) + " " + format_value(value) for label_values, value in sorted(totals.items()) ]
+
+class Histogram(ShardedMetric):
+    """Counts observations, such as latencies, into buckets, optionally broken down by labels."""
+
+    metric_type = TYPE_HISTOGRAM
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, help_text, label_names)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, label_values=()):
+        """Records one observation for the given label values."""
+        shard = self.shard()
+        counts = shard.get(label_values)
+        if counts is None:
+            counts = [ 0 ] * (len(self.buckets) + 1) + [ 0.0 ] # One per bucket, one for +Inf, then the sum
+            shard[label_values] = counts
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def collect(self):
+        """Returns the text format lines for this metric. Buckets are cumulative, as the format requires."""
+        totals = {}
+        for shard in self.snapshot_shards():
+            for label_values, counts in shard.items():
+                counts = list(counts)
+                total = totals.get(label_values)
+                if total is None:
+                    totals[label_values] = counts
+                else:
+                    totals[label_values] = [ a + b for a, b in zip(total, counts) ]
+        lines = []
+        for label_values, counts in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + [ float("inf") ], counts[:-1]):
+                cumulative += count
+                lines.append(self.name + "_bucket" + format_labels(self.label_names, label_values, ("le", format_value(float(bound)))) + " " + str(cumulative))
+            lines.append(self.name + "_sum" + format_labels(self.label_names, label_values) + " " + format_value(counts[-1]))
+            lines.append(self.name + "_count" + format_labels(self.label_names, label_values) + " " + str(cumulative))
+        return lines
+
+class CallbackMetric(object):
+    """A metric whose values are read from somewhere else when scraped, e.g. a cache's own hit counts. The callback
+    returns a number, or a dictionary of label values -> number."""
+
+    def __init__(self, name, help_text, metric_type, func, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.metric_type = metric_type
+        self.func = func
+        self.label_names = tuple(label_names)
+
+    def collect(self):
+        """Returns the text format lines for this metric, nothing if the value isn't available."""
+        values = self.func()
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = { (): values }
+        return [ self.name + format_labels(self.label_names, label_values) + " " + format_value(value) for label_values, value in sorted(values.items()) ]
+
+class Registry(object):
+    """The set of metrics served by the /metrics endpoint."""
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        """Adds a metric, replacing any existing one with the same name. Returns the metric."""
+        with self.lock:
+            self.metrics = [ existing for existing in self.metrics if existing.name != metric.name ] + [ metric ]
+        return metric
+
+    def counter(self, name, help_text, label_names=()):
+        """Creates and registers a counter."""
+        return self.register(Counter(name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        """Creates and registers a histogram."""
+        return self.register(Histogram(name, help_text, label_names, buckets))
+
+    def callback(self, name, help_text, metric_type, func, label_names=()):
+        """Creates and registers a metric that is read from func when scraped."""
+        return self.register(CallbackMetric(name, help_text, metric_type, func, label_names))
+
+    def render(self):
+        """Returns every metric in the Prometheus text format."""
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.append("# HELP " + metric.name + " " + metric.help_text)
+            lines.append("# TYPE " + metric.name + " " + metric.metric_type)
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+# The process wide registry. Modules create their metrics in it when they're imported.
+REGISTRY = Registry()
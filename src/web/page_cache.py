@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Compiles the page templates once and keeps the rendered pages, since their inputs don't change while the server is running."""
+
+import os
+import threading
+
+from mako.lookup import TemplateLookup
+
+class PageCache(object):
+    """Renders Mako templates from a single directory and caches the result, per template and set of arguments.
+    In development mode the template files are checked on each request, and a page is rendered again when its
+    file changes."""
+
+    def __init__(self, template_dir, module_dir, dev_mode=False):
+        self.template_dir = template_dir
+        self.dev_mode = dev_mode
+        self.lookup = TemplateLookup(directories=[template_dir], module_directory=module_dir, filesystem_checks=dev_mode, input_encoding='utf-8')
+        self.lock = threading.Lock()
+        self.pages = {} # (name, args) -> (mtime, rendered bytes)
+        super(PageCache, self).__init__()
+
+    def file_mtime(self, name):
+        """Returns the template file's modification time, or None when not in development mode."""
+        if not self.dev_mode:
+            return None
+        return os.path.getmtime(os.path.join(self.template_dir, name))
+
+    def compile(self, names):
+        """Compiles the named templates, so the first request for each doesn't have to."""
+        for name in names:
+            self.lookup.get_template(name)
+
+    def render(self, name, **kwargs):
+        """Returns the rendered page, as UTF-8 bytes."""
+        key = (name, tuple(sorted(kwargs.items())))
+        mtime = self.file_mtime(name)
+        with self.lock:
+            cached = self.pages.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        # Rendering happens outside the lock. Two requests may render the same page at once, which is harmless.
+        page = self.lookup.get_template(name).render(**kwargs).encode('utf-8')
+        with self.lock:
+            self.pages[key] = (mtime, page)
+        return page
+
+    def clear(self):
+        """Forgets the rendered pages."""
+        with self.lock:
+            self.pages = {}
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Bounded process pool for bcrypt, so password hashing can't tie up the threads that serve the rest of the API."""
+
+import bcrypt
+import concurrent.futures
+import threading
+import time
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_QUEUED = 2 # Requests that may wait for a busy worker. Each pending request holds a server thread, so keep this small.
+DEFAULT_ROUNDS = 12
+DEFAULT_TIMEOUT_SECS = 10.0
+MIN_ROUNDS = 4 # The limits bcrypt itself accepts
+MAX_ROUNDS = 31
+
+class PasswordPoolBusyException(Exception):
+    """Thrown when too many hashing requests are already waiting, or a request waited too long."""
+
+def hash_password(password, rounds):
+    """Returns the salted bcrypt hash of a password. Runs in a worker process."""
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+def check_password(password, hashed):
+    """Returns True if the password matches the bcrypt hash. Runs in a worker process."""
+    return bcrypt.checkpw(password, hashed)
+
+def to_bytes(value):
+    """bcrypt only accepts bytes."""
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return value
+
+def default_max_pending(workers):
+    """Returns the default cap on running and waiting requests: one running per worker, plus a small queue."""
+    return max(1, workers) + DEFAULT_MAX_QUEUED
+
+def timed_call(func, *args):
+    """Returns the function's result along with how long it took, measured where it ran."""
+    start = time.time()
+    value = func(*args)
+    return value, time.time() - start
+
+class PasswordPool(object):
+    """Runs bcrypt in a fixed number of worker processes. The number of requests that may be running or waiting at
+    once is capped, and requests over the cap fail immediately rather than queueing behind the others. With zero
+    workers, hashing is done on the calling thread, but the cap still applies."""
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_pending=None, rounds=DEFAULT_ROUNDS, timeout_secs=DEFAULT_TIMEOUT_SECS):
+        if rounds < MIN_ROUNDS or rounds > MAX_ROUNDS:
+            raise ValueError("bcrypt rounds must be between %d and %d." % (MIN_ROUNDS, MAX_ROUNDS))
+        self.workers = max(0, workers)
+        if max_pending is None:
+            max_pending = default_max_pending(self.workers)
+        self.max_pending = max(1, max_pending)
+        self.rounds = rounds
+        self.timeout_secs = timeout_secs
+        self.executor = None
+        self.lock = threading.Lock()
+        self.num_pending = 0
+        self.num_completed = 0
+        self.num_rejected = 0
+        self.total_wait_secs = 0.0
+        self.total_run_secs = 0.0
+        self.max_run_secs = 0.0
+        super(PasswordPool, self).__init__()
+
+    def start(self):
+        """Starts the worker processes."""
+        if self.workers > 0 and self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+
+    def stop(self):
+        """Stops the worker processes, after they finish what they are doing."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def run(self, func, *args):
+        """Runs one hashing function, in a worker if there are any, and records how long it waited and ran."""
+        with self.lock:
+            if self.num_pending >= self.max_pending:
+                self.num_rejected = self.num_rejected + 1
+                raise PasswordPoolBusyException("Too many password requests are waiting.")
+            self.num_pending = self.num_pending + 1
+        submitted = time.time()
+        try:
+            if self.executor is None:
+                result = timed_call(func, *args)
+            else:
+                future = self.executor.submit(timed_call, func, *args)
+                try:
+                    result = future.result(timeout=self.timeout_secs)
+                except concurrent.futures.TimeoutError:
+                    future.cancel()
+                    with self.lock:
+                        self.num_rejected = self.num_rejected + 1
+                    raise PasswordPoolBusyException("Timed out waiting for a password worker.")
+        finally:
+            with self.lock:
+                self.num_pending = self.num_pending - 1
+        value, run_secs = result
+        with self.lock:
+            self.num_completed = self.num_completed + 1
+            self.total_wait_secs = self.total_wait_secs + max(0.0, time.time() - submitted - run_secs)
+            self.total_run_secs = self.total_run_secs + run_secs
+            self.max_run_secs = max(self.max_run_secs, run_secs)
+        return value
+
+    def hash(self, password):
+        """Returns the salted hash of a password, using the configured work factor."""
+        return self.run(hash_password, to_bytes(password), self.rounds)
+
+    def check(self, password, hashed):
+        """Returns True if the password matches the stored hash."""
+        return self.run(check_password, to_bytes(password), to_bytes(hashed))
+
+    def stats(self):
+        """Returns the counters, for monitoring."""
+        with self.lock:
+            completed = self.num_completed
+            return {
+                "workers": self.workers,
+                "rounds": self.rounds,
+                "pending": self.num_pending,
+                "max_pending": self.max_pending,
+                "completed": completed,
+                "rejected": self.num_rejected,
+                "avg_wait_ms": 1000.0 * self.total_wait_secs / completed if completed else 0.0,
+                "avg_run_ms": 1000.0 * self.total_run_secs / completed if completed else 0.0,
+                "max_run_ms": 1000.0 * self.max_run_secs
+            }
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Retention policies for the sensor collections, and the compaction job that enforces them.
+
+Raw readings are only deleted once they are covered by the rollups, so, with the default policy,
+a month of raw readings is kept and, after that, only the rollups remain."""
+
+import argparse
+import database
+import logging
+import rollups
+import schema
+import sys
+import threading
+import time
+import traceback
+
+TIER_RAW = rollups.RESOLUTION_RAW
+TIERS = [ TIER_RAW ] + [ resolution for resolution, _ in rollups.RESOLUTIONS ]
+
+# Days to keep each tier, None means forever.
+DEFAULT_RAW_RETENTION_DAYS = 30
+DEFAULT_MINUTE_RETENTION_DAYS = 90
+
+# How the compaction job paces itself, so it never holds up ingest for long.
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_BATCH_PAUSE_SECS = 0.1
+DEFAULT_INTERVAL_MINS = 60
+BACKFILL_CHUNKS_PER_PASS = 30
+
+def log_info(log_str):
+    """Writes an info message to the log file."""
+    logger = logging.getLogger()
+    logger.info(log_str)
+
+def log_error(log_str):
+    """Writes an error message to the log file."""
+    logger = logging.getLogger()
+    logger.error(log_str)
+
+def default_policy():
+    """Returns the default policy, a dictionary of collection -> tier -> days to keep."""
+    policy = {}
+    for collection_name in database.ROLLUP_COLLECTIONS:
+        policy[collection_name] = { TIER_RAW: DEFAULT_RAW_RETENTION_DAYS, rollups.RESOLUTION_MINUTE: DEFAULT_MINUTE_RETENTION_DAYS,
+            rollups.RESOLUTION_HOUR: None, rollups.RESOLUTION_DAY: None }
+    policy[database.COLLECTION_WEBSITE_STATUS] = { TIER_RAW: None }
+    return policy
+
+def parse_retention_arg(policy, arg):
+    """Applies a COLLECTION[:TIER]=DAYS setting to the policy. The tier defaults to raw, zero (or less) days means keep forever."""
+    try:
+        name, days = arg.split("=", 1)
+        collection_name, _, tier = name.partition(":")
+        if len(tier) == 0:
+            tier = TIER_RAW
+        days = float(days)
+    except ValueError:
+        raise ValueError("Retention settings look like COLLECTION[:TIER]=DAYS: " + arg)
+    if collection_name not in database.SENSOR_COLLECTIONS:
+        raise ValueError("Unknown collection: " + collection_name)
+    if tier not in TIERS or (tier != TIER_RAW and collection_name not in database.ROLLUP_COLLECTIONS):
+        raise ValueError("Unknown tier for " + collection_name + ": " + tier)
+    if days <= 0:
+        days = None
+    policy.setdefault(collection_name, {})[tier] = days
+    return policy
+
+def cutoff_ts(days, now):
+    """Returns the timestamp before which data in a tier with the given retention is removed, or None if it is kept forever."""
+    if days is None:
+        return None
+    return now - days * 86400.0
+
+def raw_deletion_range(db, collection_name, cutoff):
+    """Returns the (start, end) range of raw readings that may be deleted. Readings in collections with rollups
+    may only be deleted once they've been summarized, i.e., if they're newer than the backfilled_to time."""
+    if collection_name not in database.ROLLUP_COLLECTIONS:
+        return 0, cutoff
+    epoch, backfilled_to = db.retrieve_rollup_state(collection_name)
+    if epoch is None:
+        return None, None
+    if backfilled_to >= cutoff:
+        return None, None
+    return backfilled_to, cutoff
+
+def report(db, policy, now=None):
+    """Dry run: returns a list of (collection, tier, documents, bytes) that the compaction job would remove."""
+    if now is None:
+        now = time.time()
+    results = []
+    for collection_name, tiers in policy.items():
+        for tier, days in tiers.items():
+            cutoff = cutoff_ts(days, now)
+            if cutoff is None:
+                continue
+            if tier == TIER_RAW:
+                start_ts, end_ts = raw_deletion_range(db, collection_name, cutoff)
+                if start_ts is None:
+                    num_docs = 0
+                else:
+                    num_docs = db.count_statuses(collection_name, start_ts, end_ts)
+                num_bytes = num_docs * db.average_status_size(collection_name)
+            else:
+                num_docs = db.count_rollups_before(collection_name, tier, cutoff)
+                num_bytes = num_docs * db.average_rollup_size(collection_name, tier)
+            results.append((collection_name, tier, num_docs, int(num_bytes)))
+    return results
+
+class CompactionJob(object):
+    """Enforces the retention policy. Old data is deleted in small batches with a pause between each one,
+    so that the job never holds the database for long."""
+
+    def __init__(self, get_db_func, policy, interval_mins=DEFAULT_INTERVAL_MINS, batch_size=DEFAULT_BATCH_SIZE, batch_pause_secs=DEFAULT_BATCH_PAUSE_SECS):
+        self.get_db_func = get_db_func
+        self.policy = policy
+        self.interval_secs = interval_mins * 60.0
+        self.batch_size = batch_size
+        self.batch_pause_secs = batch_pause_secs
+        self.thread = None
+        self.stopping = threading.Event()
+        super(CompactionJob, self).__init__()
+
+    def start(self):
+        """Starts running the job periodically, from a background thread."""
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="compaction", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops the background thread. A pass that's underway stops after the current batch."""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def delete_in_batches(self, delete_func):
+        """Calls the delete function until there is nothing left to delete. Returns the number of documents deleted."""
+        num_deleted = 0
+        while not self.stopping.is_set():
+            count = delete_func(self.batch_size)
+            num_deleted = num_deleted + count
+            if count < self.batch_size:
+                break
+            self.stopping.wait(self.batch_pause_secs)
+        return num_deleted
+
+    def compact(self, now=None):
+        """Runs one pass over every collection in the policy. Returns a list of (collection, tier, documents deleted)."""
+        if now is None:
+            now = time.time()
+        db = self.get_db_func()
+        results = []
+        for collection_name, tiers in self.policy.items():
+            for tier, days in tiers.items():
+                cutoff = cutoff_ts(days, now)
+                if cutoff is None or self.stopping.is_set():
+                    continue
+                if tier == TIER_RAW:
+                    # Make sure the old readings are summarized before they're removed.
+                    if collection_name in database.ROLLUP_COLLECTIONS:
+                        rollups.backfill(db, collection_name, max_chunks=BACKFILL_CHUNKS_PER_PASS)
+                    start_ts, end_ts = raw_deletion_range(db, collection_name, cutoff)
+                    if start_ts is None:
+                        continue
+                    num_deleted = self.delete_in_batches(lambda limit: db.delete_statuses(collection_name, start_ts, end_ts, limit))
+                    if collection_name == database.COLLECTION_WEBSITE_STATUS:
+                        # The per-site rows go with the readings they were split from.
+                        self.delete_in_batches(lambda limit: db.delete_site_statuses(start_ts, end_ts, limit))
+                else:
+                    num_deleted = self.delete_in_batches(lambda limit: db.delete_rollups_before(collection_name, tier, cutoff, limit))
+                if num_deleted > 0:
+                    log_info("Compaction removed %d %s documents from %s." % (num_deleted, tier, collection_name))
+                results.append((collection_name, tier, num_deleted))
+        return results
+
+    def run(self):
+        """Background thread loop."""
+        while not self.stopping.is_set():
+            try:
+                self.compact()
+            except:
+                log_error(traceback.format_exc())
+            self.stopping.wait(self.interval_secs)
+
+def main():
+    """Entry point for running the compaction job, or the dry run report, by hand."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database", type=str, action="store", default="mongodb://localhost:27017", help="The URI for connecting to the database, either mongodb://... or sqlite:///path.", required=False)
+    parser.add_argument("--retention", type=str, action="append", default=[], help="Overrides the retention for a collection, as COLLECTION[:TIER]=DAYS where TIER is raw (the default), minute, hour, or day. Zero days means keep forever.", required=False)
+    parser.add_argument("--dry-run", action="store_true", default=False, help="Reports what would be removed, without removing anything.", required=False)
+
+    try:
+        args = parser.parse_args()
+        policy = default_policy()
+        for arg in args.retention:
+            parse_retention_arg(policy, arg)
+    except (IOError, ValueError) as e:
+        parser.error(e)
+        sys.exit(1)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+
+    db = database.create_database(args.database)
+    db.connect(args.database)
+    try:
+        schema.upgrade(db)
+        if args.dry_run:
+            total_docs = 0
+            total_bytes = 0
+            for collection_name, tier, num_docs, num_bytes in report(db, policy):
+                print("%-24s %-8s %12d docs %14d bytes" % (collection_name, tier, num_docs, num_bytes))
+                total_docs = total_docs + num_docs
+                total_bytes = total_bytes + num_bytes
+            print("%-33s %12d docs %14d bytes" % ("Total", total_docs, total_bytes))
+        else:
+            job = CompactionJob(lambda: db, policy)
+            for collection_name, tier, num_deleted in job.compact():
+                print("%-24s %-8s %12d docs removed" % (collection_name, tier, num_deleted))
+    finally:
+        db.close()
+
+if __name__=="__main__":
+    main()
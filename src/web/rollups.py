@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Time bucketed summaries (rollups) of the sensor collections.
+
+Each rollup document covers one bucket of time and holds, for each numeric field, the
+minimum, maximum, sum, count, and last value seen in that bucket:
+
+    { "ts": bucket_start, "count": n, "fields": { "co2_ppm": { "min": ..., "max": ..., "sum": ..., "count": ..., "last": { "ts": ..., "value": ... } } } }
+
+"last" is stored as a (ts, value) document so that a $max update keeps the value with the latest timestamp,
+regardless of the order in which readings arrive."""
+
+import math
+
+RESOLUTION_RAW = "raw"
+RESOLUTION_AUTO = "auto"
+RESOLUTION_MINUTE = "minute"
+RESOLUTION_HOUR = "hour"
+RESOLUTION_DAY = "day"
+
+# Ordered from finest to coarsest.
+RESOLUTIONS = [ (RESOLUTION_MINUTE, 60), (RESOLUTION_HOUR, 3600), (RESOLUTION_DAY, 86400) ]
+RESOLUTION_SECS = dict(RESOLUTIONS)
+
+# Ranges shorter than this are always served from the raw readings when the resolution is "auto".
+AUTO_RAW_MAX_RANGE_SECS = 36 * 3600
+
+# When the resolution is "auto", pick the finest rollup that returns no more than this many buckets.
+AUTO_MAX_POINTS = 1500
+
+# Keys used in the rollup documents.
+ROLLUP_TS_KEY = "ts"
+ROLLUP_COUNT_KEY = "count"
+ROLLUP_FIELDS_KEY = "fields"
+ROLLUP_MIN_KEY = "min"
+ROLLUP_MAX_KEY = "max"
+ROLLUP_SUM_KEY = "sum"
+ROLLUP_LAST_KEY = "last"
+ROLLUP_LAST_TS_KEY = "ts"
+ROLLUP_LAST_VALUE_KEY = "value"
+
+# Suffixes for the extra fields in the summarized (i.e. returned by the API) rows.
+SUMMARY_MIN_SUFFIX = "_min"
+SUMMARY_MAX_SUFFIX = "_max"
+SUMMARY_LAST_SUFFIX = "_last"
+
+# Keys that are never summarized.
+EXCLUDED_KEYS = set([ "_id", "ts" ])
+
+def is_valid_resolution(resolution):
+    """Returns True if the resolution is one the API understands."""
+    return resolution == RESOLUTION_RAW or resolution == RESOLUTION_AUTO or resolution in RESOLUTION_SECS
+
+def rollup_collection_name(collection_name, resolution):
+    """Returns the name of the collection (or table) that holds the given rollup."""
+    return collection_name + "_" + resolution
+
+def bucket_start(ts, bucket_secs):
+    """Returns the start of the bucket containing the timestamp."""
+    return math.floor(ts / bucket_secs) * bucket_secs
+
+def numeric_fields(values):
+    """Returns the fields of a reading that can be summarized. The indoor air quality client has a copy of this; keep the two identical."""
+    fields = {}
+    for key, value in values.items():
+        if key in EXCLUDED_KEYS or '.' in key or key.startswith('$'):
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        if isinstance(value, float) and not math.isfinite(value):
+            continue
+        fields[key] = value
+    return fields
+
+def new_field_summary(ts, value):
+    """Returns the summary of a single value."""
+    return { ROLLUP_MIN_KEY: value, ROLLUP_MAX_KEY: value, ROLLUP_SUM_KEY: value, ROLLUP_COUNT_KEY: 1,
+        ROLLUP_LAST_KEY: { ROLLUP_LAST_TS_KEY: ts, ROLLUP_LAST_VALUE_KEY: value } }
+
+def merge_field_summary(summary, other):
+    """Merges one field summary into another, in place."""
+    summary[ROLLUP_MIN_KEY] = min(summary[ROLLUP_MIN_KEY], other[ROLLUP_MIN_KEY])
+    summary[ROLLUP_MAX_KEY] = max(summary[ROLLUP_MAX_KEY], other[ROLLUP_MAX_KEY])
+    summary[ROLLUP_SUM_KEY] = summary[ROLLUP_SUM_KEY] + other[ROLLUP_SUM_KEY]
+    summary[ROLLUP_COUNT_KEY] = summary[ROLLUP_COUNT_KEY] + other[ROLLUP_COUNT_KEY]
+    if other[ROLLUP_LAST_KEY][ROLLUP_LAST_TS_KEY] >= summary[ROLLUP_LAST_KEY][ROLLUP_LAST_TS_KEY]:
+        summary[ROLLUP_LAST_KEY] = other[ROLLUP_LAST_KEY]
+
+def merge_rollup(rollup, other):
+    """Merges one rollup document into another (for the same bucket), in place."""
+    rollup[ROLLUP_COUNT_KEY] = rollup.get(ROLLUP_COUNT_KEY, 0) + other[ROLLUP_COUNT_KEY]
+    fields = rollup.setdefault(ROLLUP_FIELDS_KEY, {})
+    for key, summary in other[ROLLUP_FIELDS_KEY].items():
+        if key in fields:
+            merge_field_summary(fields[key], summary)
+        else:
+            fields[key] = dict(summary)
+
+def aggregate_readings(readings, bucket_secs):
+    """Summarizes a list of readings into a dictionary of bucket start -> rollup document."""
+    rollups = {}
+    for values in readings:
+        ts = values.get(ROLLUP_TS_KEY)
+        if ts is None:
+            continue
+        bucket = bucket_start(ts, bucket_secs)
+        rollup = rollups.get(bucket)
+        if rollup is None:
+            rollup = { ROLLUP_TS_KEY: bucket, ROLLUP_COUNT_KEY: 0, ROLLUP_FIELDS_KEY: {} }
+            rollups[bucket] = rollup
+        rollup[ROLLUP_COUNT_KEY] = rollup[ROLLUP_COUNT_KEY] + 1
+        fields = rollup[ROLLUP_FIELDS_KEY]
+        for key, value in numeric_fields(values).items():
+            if key in fields:
+                merge_field_summary(fields[key], new_field_summary(ts, value))
+            else:
+                fields[key] = new_field_summary(ts, value)
+    return rollups
+
+def readings_to_summarize(values_list, backfilled_to):
+    """Readings older than the backfilled_to time will be summarized by the backfill, so
+    summarizing them when they're received would count them twice."""
+    if backfilled_to is None:
+        return values_list
+    return [ values for values in values_list if values.get(ROLLUP_TS_KEY, backfilled_to) >= backfilled_to ]
+
+def summarize(rollup, fields=None):
+    """Converts a rollup document into a row that looks like a reading: the mean is stored under the field's own name,
+    so existing graphing code works unchanged, with the min, max, and last values alongside it. If a list of
+    fields is given then only those fields are summarized."""
+    row = { ROLLUP_TS_KEY: rollup[ROLLUP_TS_KEY], ROLLUP_COUNT_KEY: rollup.get(ROLLUP_COUNT_KEY, 0) }
+    for key, summary in rollup.get(ROLLUP_FIELDS_KEY, {}).items():
+        if fields is not None and key not in fields:
+            continue
+        if summary[ROLLUP_COUNT_KEY] > 0:
+            row[key] = summary[ROLLUP_SUM_KEY] / summary[ROLLUP_COUNT_KEY]
+        row[key + SUMMARY_MIN_SUFFIX] = summary[ROLLUP_MIN_KEY]
+        row[key + SUMMARY_MAX_SUFFIX] = summary[ROLLUP_MAX_KEY]
+        row[key + SUMMARY_LAST_SUFFIX] = summary[ROLLUP_LAST_KEY][ROLLUP_LAST_VALUE_KEY]
+    return row
+
+def choose_resolution(start_ts, end_ts):
+    """Picks the resolution to use for a query over the given range when the caller asked for "auto"."""
+    range_secs = end_ts - start_ts
+    if start_ts > 0 and range_secs <= AUTO_RAW_MAX_RANGE_SECS:
+        return RESOLUTION_RAW
+    for resolution, bucket_secs in RESOLUTIONS:
+        if start_ts > 0 and range_secs / bucket_secs <= AUTO_MAX_POINTS:
+            return resolution
+    return RESOLUTIONS[-1][0]
+
+# Backfill works through the history in chunks of this many seconds, newest first.
+BACKFILL_CHUNK_SECS = 86400
+
+def backfill(db, collection_name, max_chunks=None):
+    """Summarizes the raw readings that predate the rollups (i.e., were stored before rollups were maintained at ingest time),
+    working backwards from the rollup epoch one chunk at a time. Progress is recorded after each chunk, so this can be
+    interrupted and resumed. Returns the number of readings summarized."""
+    epoch, backfilled_to = db.retrieve_rollup_state(collection_name)
+    if epoch is None:
+        return 0
+    oldest_ts = db.retrieve_oldest_status_ts(collection_name)
+    num_readings = 0
+    num_chunks = 0
+    while oldest_ts is not None and backfilled_to > oldest_ts:
+        if max_chunks is not None and num_chunks >= max_chunks:
+            break
+        chunk_start = backfilled_to - BACKFILL_CHUNK_SECS
+        readings = db.retrieve_status_range(collection_name, chunk_start, backfilled_to)
+        if len(readings) > 0 and not db.update_rollups(collection_name, readings):
+            break
+        db.update_rollup_state(collection_name, chunk_start)
+        backfilled_to = chunk_start
+        num_readings = num_readings + len(readings)
+        num_chunks = num_chunks + 1
+    return num_readings
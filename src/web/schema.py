@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Versioned index creation and schema migrations for the application database."""
+
+import argparse
+import database
+import datetime
+import logging
+import pymongo
+import rollups
+import site_status
+import sqlite3
+import sys
+import time
+
+MONGO_INDEX_NOT_FOUND = 27 # Error code returned when dropping an index that doesn't exist
+
+def log_info(log_str):
+    """Writes an info message to the log file."""
+    logger = logging.getLogger()
+    logger.info(log_str)
+
+#
+# MongoDB migrations
+#
+
+def create_sensor_ts_indexes(db):
+    """Every sensor query is a range query on the timestamp."""
+    mongo_db = db.database
+    for collection_name in database.SENSOR_COLLECTIONS:
+        mongo_db[collection_name].create_index([ ("ts", pymongo.ASCENDING) ], name="ts")
+
+def create_lookup_indexes(db):
+    """Unique indexes for the things we look up by key, plus the other lookups that would otherwise be collection scans."""
+    mongo_db = db.database
+    mongo_db[database.COLLECTION_USERS].create_index([ (database.USERNAME_KEY, pymongo.ASCENDING) ], name="username", unique=True)
+    mongo_db[database.COLLECTION_API_KEYS].create_index([ (database.API_KEY, pymongo.ASCENDING) ], name="key", unique=True)
+    mongo_db[database.COLLECTION_API_KEYS].create_index([ (database.API_USER_KEY, pymongo.ASCENDING) ], name="user")
+    mongo_db[database.COLLECTION_SESSIONS].create_index([ (database.SESSION_COOKIE_KEY, pymongo.ASCENDING) ], name="cookie", unique=True)
+    mongo_db[database.COLLECTION_LIMITS].create_index([ ("key", pymongo.ASCENDING) ], name="key")
+    mongo_db[database.COLLECTION_SCALE_CALIBRATIONS].create_index([ (database.SCALE_NAME_KEY, pymongo.ASCENDING) ], name="name")
+
+def create_session_ttl_index(db):
+    """Lets the database expire old sessions. Sessions created before this migration only have the numeric expiry, so backfill the date."""
+    sessions = db.database[database.COLLECTION_SESSIONS]
+    query = { database.SESSION_EXPIRES_AT_KEY: { "$exists": False } }
+    for session in sessions.find(query, { database.SESSION_EXPIRY_KEY: 1 }):
+        expiry = session.get(database.SESSION_EXPIRY_KEY)
+        if expiry is None:
+            continue
+        expires_at = datetime.datetime.fromtimestamp(expiry, tz=datetime.timezone.utc)
+        sessions.update_one({ database.DATABASE_ID_KEY: session[database.DATABASE_ID_KEY] }, { "$set": { database.SESSION_EXPIRES_AT_KEY: expires_at } })
+    sessions.create_index([ (database.SESSION_EXPIRES_AT_KEY, pymongo.ASCENDING) ], name="expires_at", expireAfterSeconds=0)
+
+def create_rollup_indexes(db):
+    """Rollups are looked up, and upserted, by bucket start time. Also records when rollups started being maintained,
+    since readings received before then have to be backfilled."""
+    now = time.time()
+    for collection_name in database.ROLLUP_COLLECTIONS:
+        for resolution, _ in rollups.RESOLUTIONS:
+            rollup_collection = db.database[rollups.rollup_collection_name(collection_name, resolution)]
+            rollup_collection.create_index([ (rollups.ROLLUP_TS_KEY, pymongo.ASCENDING) ], name="ts", unique=True)
+        db.create_rollup_state(collection_name, now)
+
+def create_sensor_keyset_indexes(db):
+    """Paged series queries sort on (ts, _id) so that readings with the same timestamp are never skipped or repeated.
+    SQLite doesn't need this, since its indexes already end with the row ID."""
+    mongo_db = db.database
+    for collection_name in database.SENSOR_COLLECTIONS:
+        mongo_db[collection_name].create_index([ ("ts", pymongo.ASCENDING), (database.DATABASE_ID_KEY, pymongo.ASCENDING) ], name="ts_id")
+
+def swap_inverted_limits(db):
+    """Limits used to be written with the lower and upper values swapped (and read back swapped, which hid it)."""
+    db.database[database.COLLECTION_LIMITS].update_many({ "$expr": { "$gt": [ "$lower_limit", "$upper_limit" ] } },
+        [ { "$set": { "lower_limit": "$upper_limit", "upper_limit": "$lower_limit" } } ])
+
+def create_limits_key_index(db):
+    """Limits are upserted by key, so there can only be one document per key. Keeps the newest if there are duplicates."""
+    limits_collection = db.database[database.COLLECTION_LIMITS]
+    newest = {}
+    for limits_result in limits_collection.find({}, { "key": 1 }).sort(database.DATABASE_ID_KEY, pymongo.ASCENDING):
+        newest[limits_result.get("key")] = limits_result[database.DATABASE_ID_KEY]
+    limits_collection.delete_many({ database.DATABASE_ID_KEY: { "$nin": list(newest.values()) } })
+
+    # Migration 2 made a non-unique index with the same name, which can't be changed in place.
+    try:
+        limits_collection.drop_index("key")
+    except pymongo.errors.OperationFailure as e:
+        if e.code != MONGO_INDEX_NOT_FOUND:
+            raise
+    limits_collection.create_index([ ("key", pymongo.ASCENDING) ], name="key", unique=True)
+
+def create_site_status_series(db):
+    """Website status readings are split into a row per site as they're stored. Index the rows by site and time, and
+    split the readings that were stored before this migration."""
+    site_status_collection = db.database[database.COLLECTION_SITE_STATUS]
+    site_status_collection.create_index([ (site_status.SITE_KEY, pymongo.ASCENDING), (site_status.TS_KEY, pymongo.ASCENDING) ], name="site_ts")
+    site_status_collection.create_index([ (site_status.TS_KEY, pymongo.ASCENDING) ], name="ts")
+    if site_status_collection.count_documents({}, limit=1) > 0:
+        return
+    batch = []
+    for reading in db.database[database.COLLECTION_WEBSITE_STATUS].find({}, { database.DATABASE_ID_KEY: 0 }).batch_size(database.STATUS_CURSOR_BATCH_SIZE):
+        batch.append(reading)
+        if len(batch) >= database.STATUS_CURSOR_BATCH_SIZE:
+            db.create_site_statuses(batch)
+            batch = []
+    db.create_site_statuses(batch)
+
+# Ordered list of (version, description, function). Append only, never renumber.
+MONGO_MIGRATIONS = [
+    (1, "Timestamp indexes on the sensor collections", create_sensor_ts_indexes),
+    (2, "Unique indexes on users, API keys, and sessions", create_lookup_indexes),
+    (3, "TTL expiry on sessions", create_session_ttl_index),
+    (4, "Rollup indexes and rollup epoch", create_rollup_indexes),
+    (5, "Keyset pagination indexes on the sensor collections", create_sensor_keyset_indexes),
+    (6, "Swap limits stored with the lower and upper values inverted", swap_inverted_limits),
+    (7, "Unique index on the limits key", create_limits_key_index),
+    (8, "Per-site website status series", create_site_status_series),
+]
+
+#
+# SQLite migrations
+#
+
+def create_sqlite_sensor_ts_indexes(db):
+    """Every sensor query is a range query on the timestamp."""
+    con = db.get_connection()
+    with con:
+        for collection_name in database.SENSOR_COLLECTIONS:
+            con.execute("CREATE INDEX IF NOT EXISTS " + db.quote_identifier(collection_name + "_ts") + " ON " + db.quote_identifier(collection_name) + " (ts)")
+
+def create_sqlite_lookup_indexes(db):
+    """Unique indexes for the things we look up by key, plus the other lookups that would otherwise be table scans."""
+    con = db.get_connection()
+    with con:
+        con.execute("CREATE UNIQUE INDEX IF NOT EXISTS users_username ON users (username)")
+        con.execute("CREATE UNIQUE INDEX IF NOT EXISTS api_keys_key ON api_keys (key)")
+        con.execute("CREATE INDEX IF NOT EXISTS api_keys_user ON api_keys (user)")
+        con.execute("CREATE UNIQUE INDEX IF NOT EXISTS sessions_cookie ON sessions (cookie)")
+        con.execute("CREATE INDEX IF NOT EXISTS limits_key ON limits (key)")
+        con.execute("CREATE INDEX IF NOT EXISTS scale_calibrations_name ON scale_calibrations (name)")
+
+def create_sqlite_session_expiry_index(db):
+    """SQLite has no TTL indexes, so index the expiry and remove the sessions that have already expired."""
+    con = db.get_connection()
+    with con:
+        con.execute("CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expiry)")
+        con.execute("DELETE FROM sessions WHERE expiry < ?", (time.time(),))
+
+def create_sqlite_rollup_state(db):
+    """The rollups table is keyed by bucket already, so just record when rollups started being maintained."""
+    now = time.time()
+    for collection_name in database.ROLLUP_COLLECTIONS:
+        db.create_rollup_state(collection_name, now)
+
+def swap_sqlite_inverted_limits(db):
+    """Limits used to be written with the lower and upper values swapped (and read back swapped, which hid it)."""
+    con = db.get_connection()
+    with con:
+        con.execute("UPDATE limits SET lower_limit = upper_limit, upper_limit = lower_limit WHERE lower_limit > upper_limit")
+
+def create_sqlite_limits_key_index(db):
+    """Limits are upserted by key, so there can only be one row per key. Keeps the newest if there are duplicates."""
+    con = db.get_connection()
+    with con:
+        con.execute("DELETE FROM limits WHERE rowid NOT IN (SELECT MAX(rowid) FROM limits GROUP BY key)")
+        con.execute("DROP INDEX IF EXISTS limits_key")
+        con.execute("CREATE UNIQUE INDEX IF NOT EXISTS limits_key ON limits (key)")
+
+def create_sqlite_site_status_series(db):
+    """Website status readings are split into a row per site as they're stored. Index the rows by site and time, and
+    split the readings that were stored before this migration."""
+    con = db.get_connection()
+    with con:
+        con.execute("CREATE INDEX IF NOT EXISTS site_status_site_ts ON site_status (site, ts)")
+        con.execute("CREATE INDEX IF NOT EXISTS site_status_ts ON site_status (ts)")
+        if con.execute("SELECT COUNT(*) FROM site_status").fetchone()[0] > 0:
+            return
+        db.insert_site_statuses(con, db.retrieve_statuses(database.COLLECTION_WEBSITE_STATUS, 0))
+
+SQLITE_MIGRATIONS = [
+    (1, "Timestamp indexes on the sensor collections", create_sqlite_sensor_ts_indexes),
+    (2, "Unique indexes on users, API keys, and sessions", create_sqlite_lookup_indexes),
+    (3, "Expiry index on sessions", create_sqlite_session_expiry_index),
+    (4, "Rollup epoch", create_sqlite_rollup_state),
+    (5, "Swap limits stored with the lower and upper values inverted", swap_sqlite_inverted_limits),
+    (6, "Unique index on the limits key", create_sqlite_limits_key_index),
+    (7, "Per-site website status series", create_sqlite_site_status_series),
+]
+
+def migrations_for(db):
+    """Returns the list of migrations that applies to the given database."""
+    if isinstance(db, database.AppSqliteDatabase):
+        return SQLITE_MIGRATIONS
+    return MONGO_MIGRATIONS
+
+def latest_version(db):
+    """Returns the version the schema will be at once all migrations have been applied."""
+    return migrations_for(db)[-1][0]
+
+def current_version(db):
+    """Returns the schema version recorded in the database, zero if nothing has been applied."""
+    return db.retrieve_schema_version()
+
+def pending_migrations(db):
+    """Returns the migrations that have not yet been applied."""
+    version = current_version(db)
+    return [ migration for migration in migrations_for(db) if migration[0] > version ]
+
+def upgrade(db):
+    """Applies any pending migrations, in order, recording the version after each one. Returns the new version."""
+    version = current_version(db)
+    for migration_version, description, func in pending_migrations(db):
+        log_info("Applying schema migration %d: %s" % (migration_version, description))
+        try:
+            func(db)
+        except (pymongo.errors.DuplicateKeyError, sqlite3.IntegrityError) as e:
+            raise database.DatabaseException("Schema migration %d failed, remove the duplicate documents and try again: %s" % (migration_version, e))
+        except (pymongo.errors.PyMongoError, sqlite3.Error) as e:
+            raise database.DatabaseException("Schema migration %d failed: %s" % (migration_version, e))
+        db.update_schema_version(migration_version, description)
+        version = migration_version
+    return version
+
+def main():
+    """Entry point for running the migrations by hand."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database", type=str, action="store", default="mongodb://localhost:27017", help="The URI for connecting to the database, either mongodb://... or sqlite:///path.", required=False)
+    parser.add_argument("--status", action="store_true", default=False, help="Lists the pending migrations without applying them.", required=False)
+    parser.add_argument("--backfill-rollups", action="store_true", default=False, help="After migrating, summarizes the readings that were stored before rollups were maintained.", required=False)
+
+    try:
+        args = parser.parse_args()
+    except IOError as e:
+        parser.error(e)
+        sys.exit(1)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+
+    db = database.create_database(args.database)
+    db.connect(args.database)
+    try:
+        if args.status:
+            print("Schema version: %d (latest is %d)" % (current_version(db), latest_version(db)))
+            for migration_version, description, _ in pending_migrations(db):
+                print("Pending: %d %s" % (migration_version, description))
+        else:
+            print("Schema version: %d" % upgrade(db))
+            if args.backfill_rollups:
+                for collection_name in database.ROLLUP_COLLECTIONS:
+                    print("Backfilled %d %s readings." % (rollups.backfill(db, collection_name), collection_name))
+    finally:
+        db.close()
+
+if __name__=="__main__":
+    main()
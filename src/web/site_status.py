@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Per-site series for the website status collection.
+
+A website status reading holds one object per monitored site:
+
+    { "ts": ..., "example.com": { "load_time_secs": 0.42, "status": 200 }, "example.org": { ... } }
+
+Reading that back means every request gets every site. So, as readings are stored, each one is also split into a
+row per site, which can be read for a single site, downsampled, and summarized:
+
+    { "site": "example.com", "ts": ..., "load_time_secs": 0.42, "status": 200 }"""
+
+import downsample
+import numpy
+
+SITE_KEY = "site"
+TS_KEY = "ts"
+LOAD_TIME_KEY = "load_time_secs"
+STATUS_KEY = "status"
+
+# Reading keys that are never sites.
+NON_SITE_KEYS = [ TS_KEY, "_id", "device" ]
+
+# Load time percentiles returned by load_time_percentiles.
+PERCENTILES = [ 50, 95, 99 ]
+
+def to_load_time(value):
+    """Returns the load time as a float, or None if it isn't a number."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+def normalize(reading):
+    """Splits one website status reading into a row per site. Keys that don't hold an object aren't sites."""
+    rows = []
+    ts = reading.get(TS_KEY)
+    if ts is None:
+        return rows
+    for site, site_values in reading.items():
+        if site in NON_SITE_KEYS or not isinstance(site_values, dict):
+            continue
+        rows.append({ SITE_KEY: site, TS_KEY: ts, LOAD_TIME_KEY: to_load_time(site_values.get(LOAD_TIME_KEY)), STATUS_KEY: site_values.get(STATUS_KEY) })
+    return rows
+
+def normalize_many(readings):
+    """Splits a list of website status readings into rows, one per site per reading."""
+    rows = []
+    for reading in readings:
+        rows.extend(normalize(reading))
+    return rows
+
+def group_by_site(rows):
+    """Returns a dictionary of site -> that site's rows, keeping their order."""
+    sites = {}
+    for row in rows:
+        sites.setdefault(row[SITE_KEY], []).append(row)
+    return sites
+
+def downsample_by_site(rows, max_points):
+    """Reduces each site's load times, whose rows must be sorted by time, to at most max_points. Unlike
+    downsample.downsample_rows the kept rows are whole, so the site and status stay with the load time.
+    Rows without a load time, i.e. failed loads, are always kept."""
+    result = []
+    for site_rows in group_by_site(rows).values():
+        timed_rows = [ row for row in site_rows if row[LOAD_TIME_KEY] is not None ]
+        result.extend(row for row in site_rows if row[LOAD_TIME_KEY] is None)
+        if len(timed_rows) <= max_points:
+            result.extend(timed_rows)
+            continue
+        x = numpy.fromiter((row[TS_KEY] for row in timed_rows), dtype=numpy.float64, count=len(timed_rows))
+        y = numpy.fromiter((row[LOAD_TIME_KEY] for row in timed_rows), dtype=numpy.float64, count=len(timed_rows))
+        result.extend(timed_rows[int(i)] for i in downsample.lttb_indices(x, y, max_points))
+    result.sort(key=lambda row: row[TS_KEY])
+    return result
+
+def load_time_percentiles(rows):
+    """Returns a dictionary of site -> { "count", "p50", "p95", "p99" } for the load times in the rows.
+    Rows without a load time, i.e. where the site couldn't be loaded, only count towards "failures"."""
+    result = {}
+    for site, site_rows in group_by_site(rows).items():
+        load_times = numpy.fromiter((row[LOAD_TIME_KEY] for row in site_rows if row[LOAD_TIME_KEY] is not None), dtype=numpy.float64)
+        summary = { "count": len(load_times), "failures": len(site_rows) - len(load_times) }
+        if len(load_times) > 0:
+            for pct, value in zip(PERCENTILES, numpy.percentile(load_times, PERCENTILES)):
+                summary["p%d" % pct] = float(value)
+        else:
+            for pct in PERCENTILES:
+                summary["p%d" % pct] = None
+        result[site] = summary
+    return result
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Server-Sent Events feed of new sensor readings.
+
+The feed runs on its own asyncio event loop and port, rather than on waitress, because every subscriber holds its
+connection open indefinitely and waitress would need a thread for each one. Here an idle subscriber costs a socket
+and a suspended coroutine."""
+
+import asyncio
+import collections
+import json
+import logging
+import threading
+import time
+import traceback
+
+from urllib.parse import parse_qs, urlsplit
+
+STREAM_PATH = "/api/1.0/stream"
+DEFAULT_MAX_SUBSCRIBERS = 256
+DEFAULT_BACKLOG_EVENTS = 1000 # Recent events kept for clients that reconnect with Last-Event-ID
+DEFAULT_HEARTBEAT_SECS = 15.0 # Idle connections get a comment this often, so proxies don't close them
+MAX_QUEUED_EVENTS = 256 # Events waiting for one subscriber, beyond which it is disconnected
+WRITE_TIMEOUT_SECS = 30.0 # A subscriber that can't accept data for this long is disconnected
+MAX_REQUEST_BYTES = 8192
+RETRY_MS = 5000 # How long browsers wait before reconnecting
+PARAM_COLLECTIONS = "collections"
+PARAM_LAST_EVENT_ID = "last_event_id" # For clients that can't set the Last-Event-ID header
+
+def log_error(log_str):
+    """Writes an error message to the log file."""
+    logger = logging.getLogger()
+    logger.error(log_str)
+
+def encode_event(event_id, event_type, data):
+    """Returns one event in the text/event-stream format."""
+    return ("id: %s\nevent: %s\ndata: %s\n\n" % (event_id, event_type, json.dumps(data, default=str))).encode('utf-8')
+
+class StreamHub(object):
+    """Numbers each published reading, keeps the most recent ones for clients that reconnect, and hands them to the
+    subscribers. Readings may be published from any thread. Nothing is kept until the server is running."""
+
+    def __init__(self, backlog_events=DEFAULT_BACKLOG_EVENTS):
+        self.lock = threading.Lock()
+        self.epoch = "%x" % int(time.time()) # Event IDs from before a restart can't be resumed from
+        self.next_seq = 1
+        self.backlog = collections.deque(maxlen=max(1, backlog_events))
+        self.loop = None
+        self.subscribers = set() # Only used on the event loop's thread
+        self.num_subscribers = 0
+        self.num_published = 0
+        self.num_disconnected = 0
+        super(StreamHub, self).__init__()
+
+    def publish(self, collection_name, values):
+        """Called when a reading is accepted. Sends a copy, without any database ID, to the interested subscribers."""
+        loop = self.loop
+        if loop is None:
+            return
+        reading = { key: value for key, value in values.items() if key != "_id" }
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq = self.next_seq + 1
+            event_id = "%s-%d" % (self.epoch, seq)
+            event = (seq, collection_name, encode_event(event_id, "reading", { "collection": collection_name, "reading": reading }))
+            self.backlog.append(event)
+            self.num_published = self.num_published + 1
+
+            # Scheduled while holding the lock, so the loop dispatches events in sequence order. Subscribers
+            # skip anything at or below the last sequence number they sent, so a late event would be lost.
+            try:
+                loop.call_soon_threadsafe(self.dispatch, event)
+            except RuntimeError:
+                pass # The loop was closed while we were publishing
+
+    def publish_many(self, collection_name, values_list):
+        """Called when a batch of readings is accepted."""
+        for values in values_list:
+            self.publish(collection_name, values)
+
+    def events_after(self, last_event_id):
+        """Returns the kept events that came after the given event ID, and False if some may have been missed,
+        because the ID is from before a restart or older than anything still kept."""
+        epoch, _, seq_str = last_event_id.partition("-")
+        with self.lock:
+            events = list(self.backlog)
+        try:
+            seq = int(seq_str)
+        except ValueError:
+            return events, False
+        if epoch != self.epoch:
+            return events, False
+        complete = len(events) == 0 or events[0][0] <= seq + 1
+        return [ event for event in events if event[0] > seq ], complete
+
+    def dispatch(self, event):
+        """Hands an event to the subscribers. Runs on the event loop's thread."""
+        for subscriber in list(self.subscribers):
+            subscriber.offer(event)
+
+    def subscribe(self, subscriber):
+        """Starts sending events to a subscriber. Runs on the event loop's thread."""
+        self.subscribers.add(subscriber)
+        self.num_subscribers = len(self.subscribers)
+
+    def unsubscribe(self, subscriber):
+        """Stops sending events to a subscriber. Runs on the event loop's thread."""
+        self.subscribers.discard(subscriber)
+        self.num_subscribers = len(self.subscribers)
+        if subscriber.overflowed:
+            with self.lock:
+                self.num_disconnected = self.num_disconnected + 1
+
+    def stats(self):
+        """Returns the counters, for monitoring."""
+        with self.lock:
+            return {
+                "running": self.loop is not None,
+                "subscribers": self.num_subscribers,
+                "published": self.num_published,
+                "backlog": len(self.backlog),
+                "disconnected_slow": self.num_disconnected
+            }
+
+class Subscriber(object):
+    """One connected client, and the events waiting to be written to it."""
+
+    def __init__(self, collection_names):
+        self.collection_names = collection_names # None for every collection
+        self.queue = asyncio.Queue(maxsize=MAX_QUEUED_EVENTS)
+        self.last_seq = 0
+        self.overflowed = False
+        super(Subscriber, self).__init__()
+
+    def wants(self, collection_name):
+        """Returns True if the client asked for readings from the collection."""
+        return self.collection_names is None or collection_name in self.collection_names
+
+    def offer(self, event):
+        """Queues an event, if it's one the client asked for. A client that falls too far behind is marked to be
+        disconnected, rather than letting its queue grow. It can reconnect and resume from the backlog."""
+        if self.overflowed or not self.wants(event[1]):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+class StreamServer(object):
+    """Minimal HTTP server for the event stream. It only answers GET requests for STREAM_PATH."""
+
+    def __init__(self, hub, host, port, collection_names, max_subscribers=DEFAULT_MAX_SUBSCRIBERS, heartbeat_secs=DEFAULT_HEARTBEAT_SECS):
+        self.hub = hub
+        self.host = host
+        self.port = port
+        self.collection_names = set(collection_names)
+        self.max_subscribers = max(1, max_subscribers)
+        self.heartbeat_secs = max(1.0, heartbeat_secs)
+        self.thread = None
+        self.loop = None
+        self.stop_event = None
+        self.ready = threading.Event()
+        self.handlers = set()
+        super(StreamServer, self).__init__()
+
+    def start(self):
+        """Starts the event loop thread, and waits for it to start listening."""
+        self.ready.clear()
+        self.thread = threading.Thread(target=self.run, name="event-stream", daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    def stop(self):
+        """Disconnects the subscribers and stops the event loop thread."""
+        if self.thread is None:
+            return
+        loop = self.loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self.stop_event.set)
+            except RuntimeError:
+                pass
+        self.thread.join()
+        self.thread = None
+
+    def run(self):
+        """Thread function."""
+        try:
+            asyncio.run(self.serve())
+        except:
+            log_error(traceback.format_exc())
+            log_error("The event stream server stopped unexpectedly.")
+        finally:
+            self.hub.loop = None
+            self.ready.set()
+
+    async def serve(self):
+        """Listens for subscribers until stop() is called."""
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port, limit=MAX_REQUEST_BYTES)
+        self.port = server.sockets[0].getsockname()[1]
+        self.hub.loop = self.loop
+        self.ready.set()
+        await self.stop_event.wait()
+
+        # Stop publishing, then close the subscribers' connections along with the listener.
+        self.hub.loop = None
+        server.close()
+        for handler in list(self.handlers):
+            handler.cancel()
+        if self.handlers:
+            await asyncio.wait(list(self.handlers))
+        await server.wait_closed()
+        self.loop = None
+
+    async def handle_connection(self, reader, writer):
+        """Reads the request, then writes events until the client goes away or falls behind."""
+        handler = asyncio.current_task()
+        self.handlers.add(handler)
+        subscriber = None
+        try:
+            try:
+                request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=WRITE_TIMEOUT_SECS)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                return
+            status, collection_names, last_event_id = self.parse_request(request)
+            if status != 200:
+                await self.write_error(writer, status)
+                return
+            if self.hub.num_subscribers >= self.max_subscribers:
+                await self.write_error(writer, 503)
+                return
+
+            # Register before looking at the backlog, so nothing published in between is missed. Anything
+            # seen twice is skipped using its sequence number.
+            subscriber = Subscriber(collection_names)
+            self.hub.subscribe(subscriber)
+            chunks = [ b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/event-stream\r\n"
+                b"Cache-Control: no-cache\r\n"
+                b"Connection: keep-alive\r\n"
+                b"Access-Control-Allow-Origin: *\r\n"
+                b"X-Accel-Buffering: no\r\n\r\n",
+                ("retry: %d\n\n" % RETRY_MS).encode('ascii') ]
+            if last_event_id:
+                events, complete = self.hub.events_after(last_event_id)
+                if not complete:
+                    chunks.append(encode_event(last_event_id, "reset", {})) # Some readings were missed, so the client has to reload
+                    events = []
+                for event in events:
+                    if subscriber.wants(event[1]):
+                        chunks.append(event[2])
+                subscriber.last_seq = max([ event[0] for event in events ] + [ 0 ])
+            await self.write(writer, chunks)
+
+            # Write whatever is queued, or a heartbeat if nothing has been for a while.
+            while not subscriber.overflowed:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=self.heartbeat_secs)
+                except asyncio.TimeoutError:
+                    await self.write(writer, [ b": heartbeat\n\n" ])
+                    continue
+                chunks = []
+                while event is not None:
+                    if event[0] > subscriber.last_seq:
+                        chunks.append(event[2])
+                        subscriber.last_seq = event[0]
+                    event = None if subscriber.queue.empty() else subscriber.queue.get_nowait()
+                if chunks:
+                    await self.write(writer, chunks)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass # The client went away, or stopped reading
+        except asyncio.CancelledError:
+            pass # Shutting down
+        except:
+            log_error(traceback.format_exc())
+        finally:
+            if subscriber is not None:
+                self.hub.unsubscribe(subscriber)
+            self.handlers.discard(handler)
+            writer.close()
+
+    def parse_request(self, request):
+        """Returns the status code to respond with, the collections the client wants (None for all), and the event ID to resume after."""
+        lines = request.decode('latin-1').split("\r\n")
+        parts = lines[0].split(" ")
+        if len(parts) != 3:
+            return 400, None, None
+        method, target, _ = parts
+        url = urlsplit(target)
+        if url.path != STREAM_PATH:
+            return 404, None, None
+        if method != "GET":
+            return 405, None, None
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        params = parse_qs(url.query)
+
+        collection_names = None
+        if PARAM_COLLECTIONS in params:
+            collection_names = set(name for name in params[PARAM_COLLECTIONS][0].split(",") if len(name) > 0)
+            if len(collection_names) == 0 or not collection_names.issubset(self.collection_names):
+                return 400, None, None
+        last_event_id = headers.get("last-event-id")
+        if not last_event_id and PARAM_LAST_EVENT_ID in params:
+            last_event_id = params[PARAM_LAST_EVENT_ID][0]
+        return 200, collection_names, last_event_id
+
+    async def write(self, writer, chunks):
+        """Writes to the client, giving up if it won't take the data."""
+        writer.write(b"".join(chunks))
+        await asyncio.wait_for(writer.drain(), timeout=WRITE_TIMEOUT_SECS)
+
+    async def write_error(self, writer, status):
+        """Writes an error response. The connection is closed afterwards."""
+        reasons = { 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 503: "Service Unavailable" }
+        body = reasons[status].encode('ascii')
+        headers = "HTTP/1.1 %d %s\r\nContent-Type: text/plain\r\nContent-Length: %d\r\nConnection: close\r\n" % (status, reasons[status], len(body))
+        if status == 503:
+            headers = headers + "Retry-After: %d\r\n" % (RETRY_MS // 1000)
+        await self.write(writer, [ (headers + "\r\n").encode('ascii'), body ])
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2026 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Picks up readings that reach the database without going through this server, such as those the indoor air quality
+client writes directly, so the live stream and the alerts see them too."""
+
+import logging
+import threading
+import traceback
+
+DEFAULT_INTERVAL_SECS = 5.0
+PAGE_SIZE = 500
+TS_KEY = "ts"
+
+class DatabaseTailer(object):
+    """Polls collections for readings newer than any seen so far and passes them to on_readings_func. Readings this
+    server received are reported with note(), so they aren't passed on twice. Polling only happens while
+    is_needed_func says something wants the readings."""
+
+    def __init__(self, get_db_func, collection_names, on_readings_func, is_needed_func, interval_secs=DEFAULT_INTERVAL_SECS):
+        self.get_db_func = get_db_func
+        self.collection_names = collection_names
+        self.on_readings_func = on_readings_func
+        self.is_needed_func = is_needed_func
+        self.interval_secs = max(0.1, interval_secs)
+        self.cursors = {} # Collection name -> newest timestamp polled
+        self.lock = threading.Lock()
+        self.seen_ts = {} # Collection name -> newest timestamp passed on, or received by this server
+        self.thread = None
+        self.stopping = threading.Event()
+        super(DatabaseTailer, self).__init__()
+
+    def log_error(self, log_str):
+        """Writes an error message to the log file."""
+        logger = logging.getLogger()
+        logger.error(log_str)
+
+    def start(self):
+        """Starts polling, from a background thread."""
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="tailer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops the background thread."""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """Thread function."""
+        while not self.stopping.wait(self.interval_secs):
+            try:
+                self.poll()
+            except:
+                self.log_error(traceback.format_exc())
+                self.log_error("Polling for new readings failed.")
+
+    def note(self, collection_name, values_list):
+        """Called with readings this server received, or passed on."""
+        if collection_name not in self.collection_names:
+            return
+        newest = max([ values.get(TS_KEY, 0) for values in values_list ] + [ 0 ])
+        with self.lock:
+            if newest > self.seen_ts.get(collection_name, 0):
+                self.seen_ts[collection_name] = newest
+
+    def poll(self):
+        """Passes on the readings added since the last poll."""
+        if not self.is_needed_func():
+            self.cursors = {} # Nothing wants the readings, so start from the newest one when something does
+            return
+        db = self.get_db_func()
+        for collection_name in self.collection_names:
+            if collection_name not in self.cursors:
+                latest = db.retrieve_latest_status(collection_name)
+                self.cursors[collection_name] = latest[TS_KEY] if latest is not None else 0
+                continue
+            readings, _ = db.retrieve_status_page(collection_name, self.cursors[collection_name], None, None, PAGE_SIZE, None)
+            if len(readings) == 0:
+                continue
+            self.cursors[collection_name] = readings[-1][TS_KEY]
+            with self.lock:
+                seen_ts = self.seen_ts.get(collection_name, 0)
+            readings = [ reading for reading in readings if reading[TS_KEY] > seen_ts ]
+            if len(readings) > 0:
+                self.on_readings_func(collection_name, readings)
+                self.note(collection_name, readings)